@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'autoreduce_rest_api.autoreduce_django.settings')
 
-application = get_asgi_application()
+# as done by get_asgi_application, but with the handler that streams the responses outside of the event loop
+django.setup(set_prefix=False)
+
+# pylint:disable=wrong-import-position
+from autoreduce_rest_api.runs.async_views import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
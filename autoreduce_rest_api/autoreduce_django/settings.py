@@ -12,7 +12,6 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 import os
-from autoreduce_db.autoreduce_django.settings import DATABASES as autoreduce_db_settings
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -66,9 +65,31 @@ if os.environ.get("TESTING_MYSQL_DB", None) is not None:
         }
     }
 else:
-    DATABASES = autoreduce_db_settings
+    # only imported when used, as it loads the settings and credentials of autoreduce_utils
+    from autoreduce_db.autoreduce_django.settings import DATABASES as autoreduce_db_settings
+    # copied, as the connection settings below must not change those of autoreduce_db
+    DATABASES = {alias: dict(database) for alias, database in autoreduce_db_settings.items()}
+
+# Database connections, see autoreduce_rest_api.runs.connections
+
+# Number of seconds a connection is kept open for the next requests of its thread, 0 to close it
+# at the end of each request
+AUTOREDUCE_DB_CONN_MAX_AGE = int(os.getenv('AUTOREDUCE_DB_CONN_MAX_AGE', '60'))
+# Whether persistent connections are checked before each request, and reopened if the database dropped them
+AUTOREDUCE_DB_HEALTH_CHECKS = os.getenv('AUTOREDUCE_DB_HEALTH_CHECKS', 'true').lower() == 'true'
+# Number of queries, and milliseconds spent in them, above which a request is logged
+AUTOREDUCE_QUERY_BUDGET = int(os.getenv('AUTOREDUCE_QUERY_BUDGET', '50'))
+AUTOREDUCE_QUERY_TIME_BUDGET = float(os.getenv('AUTOREDUCE_QUERY_TIME_BUDGET', '500'))
+
+for database in DATABASES.values():
+    database.setdefault('CONN_MAX_AGE', AUTOREDUCE_DB_CONN_MAX_AGE)
 
 MIDDLEWARE = [
+    # first, so that the time spent in the other middleware is measured
+    'autoreduce_rest_api.runs.metrics.MetricsMiddleware',
+    'autoreduce_rest_api.runs.connections.QueryBudgetMiddleware',
+    # before the middleware that reads or changes the responses, so that it compresses what they produce
+    'autoreduce_rest_api.runs.encodings.ContentEncodingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -122,3 +143,149 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Asynchronous submission jobs, see autoreduce_rest_api.runs.jobs
+
+# Number of jobs that are processed at the same time
+AUTOREDUCE_JOB_WORKERS = int(os.getenv('AUTOREDUCE_JOB_WORKERS', '4'))
+# Number of queued or running jobs after which new jobs are rejected
+AUTOREDUCE_JOB_MAX_PENDING = int(os.getenv('AUTOREDUCE_JOB_MAX_PENDING', '100'))
+# Number of jobs kept in memory so that their status can be queried
+AUTOREDUCE_JOB_RETENTION = int(os.getenv('AUTOREDUCE_JOB_RETENTION', '1000'))
+
+# Run range expressions, see autoreduce_rest_api.runs.run_ranges
+
+# Number of runs, counting duplicates, above which the runs of a request are rejected
+AUTOREDUCE_MAX_RUNS = int(os.getenv('AUTOREDUCE_MAX_RUNS', '10000'))
+
+# Bulk removal of runs, see autoreduce_rest_api.runs.removal
+
+# Number of runs looked up at once, and of reduction runs deleted in a single transaction
+AUTOREDUCE_REMOVAL_CHUNK_SIZE = int(os.getenv('AUTOREDUCE_REMOVAL_CHUNK_SIZE', '500'))
+
+# Listing of the runs of an instrument, see autoreduce_rest_api.runs.run_list
+
+# Number of runs in a page, unless the request sets its limit
+AUTOREDUCE_RUN_LIST_PAGE_SIZE = int(os.getenv('AUTOREDUCE_RUN_LIST_PAGE_SIZE', '100'))
+# Largest number of runs in a page that a request can ask for
+AUTOREDUCE_RUN_LIST_MAX_PAGE_SIZE = int(os.getenv('AUTOREDUCE_RUN_LIST_MAX_PAGE_SIZE', '1000'))
+
+# Concurrent run lookups, see autoreduce_rest_api.runs.submission
+
+# Number of runs of a single request that are looked up at the same time
+AUTOREDUCE_SUBMISSION_WORKERS = int(os.getenv('AUTOREDUCE_SUBMISSION_WORKERS', '8'))
+# Number of threads that look the runs up for all requests, each keeping its database connection
+AUTOREDUCE_LOOKUP_THREADS = int(os.getenv('AUTOREDUCE_LOOKUP_THREADS', '32'))
+# Number of runs of an instrument that are looked up at the same time, across all requests
+AUTOREDUCE_INSTRUMENT_CONCURRENCY = int(os.getenv('AUTOREDUCE_INSTRUMENT_CONCURRENCY', '8'))
+
+# Run metadata cache, see autoreduce_rest_api.runs.cache
+
+# "local" keeps the metadata in each process, "django" stores it in the Django cache
+# named by AUTOREDUCE_RUN_CACHE_ALIAS so it is shared between processes, "none" disables it
+AUTOREDUCE_RUN_CACHE_BACKEND = os.getenv('AUTOREDUCE_RUN_CACHE_BACKEND', 'local')
+AUTOREDUCE_RUN_CACHE_ALIAS = os.getenv('AUTOREDUCE_RUN_CACHE_ALIAS', 'default')
+# Number of runs kept by the local backend
+AUTOREDUCE_RUN_CACHE_SIZE = int(os.getenv('AUTOREDUCE_RUN_CACHE_SIZE', '10000'))
+# Number of seconds after which the metadata of a run is looked up again
+AUTOREDUCE_RUN_CACHE_TTL = int(os.getenv('AUTOREDUCE_RUN_CACHE_TTL', '86400'))
+
+# Asynchronous views, see autoreduce_rest_api.runs.async_views
+
+# Number of threads that run the blocking submission and removal of the asynchronous views
+AUTOREDUCE_ASYNC_WORKERS = int(os.getenv('AUTOREDUCE_ASYNC_WORKERS', '32'))
+
+# Token authentication cache, see autoreduce_rest_api.runs.authentication
+
+# "local" keeps the tokens in each process, "django" stores them in the Django cache
+# named by AUTOREDUCE_TOKEN_CACHE_ALIAS so they are shared between processes, "none" disables it
+AUTOREDUCE_TOKEN_CACHE_BACKEND = os.getenv('AUTOREDUCE_TOKEN_CACHE_BACKEND', 'local')
+AUTOREDUCE_TOKEN_CACHE_ALIAS = os.getenv('AUTOREDUCE_TOKEN_CACHE_ALIAS', 'default')
+# Number of tokens kept by the local backend
+AUTOREDUCE_TOKEN_CACHE_SIZE = int(os.getenv('AUTOREDUCE_TOKEN_CACHE_SIZE', '1000'))
+# Number of seconds after which a token is checked against the database again. Tokens and users
+# changed by this process are invalidated at once, those changed by other processes after this delay
+AUTOREDUCE_TOKEN_CACHE_TTL = int(os.getenv('AUTOREDUCE_TOKEN_CACHE_TTL', '300'))
+
+# Responses of the submissions made with an Idempotency-Key, see autoreduce_rest_api.runs.idempotency
+
+# "local" keeps the responses in each process, "django" stores them in the Django cache named by
+# AUTOREDUCE_IDEMPOTENCY_CACHE_ALIAS so retries are recognised by any process, "none" disables it
+AUTOREDUCE_IDEMPOTENCY_CACHE_BACKEND = os.getenv('AUTOREDUCE_IDEMPOTENCY_CACHE_BACKEND', 'local')
+AUTOREDUCE_IDEMPOTENCY_CACHE_ALIAS = os.getenv('AUTOREDUCE_IDEMPOTENCY_CACHE_ALIAS', 'default')
+# Number of responses kept by the local backend
+AUTOREDUCE_IDEMPOTENCY_CACHE_SIZE = int(os.getenv('AUTOREDUCE_IDEMPOTENCY_CACHE_SIZE', '10000'))
+# Number of seconds for which a retry with the same key returns the stored response
+AUTOREDUCE_IDEMPOTENCY_CACHE_TTL = int(os.getenv('AUTOREDUCE_IDEMPOTENCY_CACHE_TTL', '86400'))
+# Seconds a request waits for the first request with the same key to finish, before it is rejected with a 409.
+# Under WSGI the wait holds a server thread, so it is kept short
+AUTOREDUCE_IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('AUTOREDUCE_IDEMPOTENCY_WAIT_TIMEOUT', '5'))
+
+# Notifications of the status transitions of the runs, see autoreduce_rest_api.runs.watcher
+
+# Number of seconds between two polls of the database for the runs that have been updated
+AUTOREDUCE_WATCH_INTERVAL = float(os.getenv('AUTOREDUCE_WATCH_INTERVAL', '1'))
+# Number of events kept for the clients that have not yet been given them
+AUTOREDUCE_WATCH_HISTORY = int(os.getenv('AUTOREDUCE_WATCH_HISTORY', '10000'))
+# Number of seconds without a waiting client after which the database is no longer polled
+AUTOREDUCE_WATCH_IDLE = float(os.getenv('AUTOREDUCE_WATCH_IDLE', '60'))
+# Longest number of seconds a client can wait for events in a single request
+AUTOREDUCE_WATCH_MAX_TIMEOUT = int(os.getenv('AUTOREDUCE_WATCH_MAX_TIMEOUT', '60'))
+# Number of clients that can wait for events at the same time, as under hurricane each holds a server thread
+AUTOREDUCE_WATCH_MAX_WAITERS = int(os.getenv('AUTOREDUCE_WATCH_MAX_WAITERS', '8'))
+
+# Throttling and admission control of the run submissions, see autoreduce_rest_api.runs.throttling
+
+# "local" keeps the limits of each process, "django" shares them between processes through the
+# Django cache named by AUTOREDUCE_THROTTLE_ALIAS, "none" disables the throttling
+AUTOREDUCE_THROTTLE_BACKEND = os.getenv('AUTOREDUCE_THROTTLE_BACKEND', 'local')
+AUTOREDUCE_THROTTLE_ALIAS = os.getenv('AUTOREDUCE_THROTTLE_ALIAS', 'default')
+# Number of submissions per second each token can make, and how many it can make at once
+AUTOREDUCE_THROTTLE_TOKEN_RATE = float(os.getenv('AUTOREDUCE_THROTTLE_TOKEN_RATE', '2'))
+AUTOREDUCE_THROTTLE_TOKEN_BURST = int(os.getenv('AUTOREDUCE_THROTTLE_TOKEN_BURST', '60'))
+# Number of runs per second that can be submitted to each instrument, and how many can be submitted
+# at once, by default as many as a request can have so that any valid request can be admitted
+AUTOREDUCE_THROTTLE_INSTRUMENT_RATE = float(os.getenv('AUTOREDUCE_THROTTLE_INSTRUMENT_RATE', '100'))
+AUTOREDUCE_THROTTLE_INSTRUMENT_BURST = int(os.getenv('AUTOREDUCE_THROTTLE_INSTRUMENT_BURST', str(AUTOREDUCE_MAX_RUNS)))
+# Number of runs of each instrument that can be in the submissions being handled, by default those of two requests
+AUTOREDUCE_THROTTLE_MAX_IN_FLIGHT_RUNS = int(
+    os.getenv('AUTOREDUCE_THROTTLE_MAX_IN_FLIGHT_RUNS', str(2 * AUTOREDUCE_MAX_RUNS)))
+
+# Publishing of the submitted runs to Kafka, see autoreduce_rest_api.runs.publishing
+
+# "kafka" publishes to the brokers configured by the KAFKA_* environment variables of autoreduce_utils,
+# "memory" keeps the messages in the process, as the unit tests do (see runs.test.utils.use_memory_broker)
+AUTOREDUCE_KAFKA_BACKEND = os.getenv('AUTOREDUCE_KAFKA_BACKEND', 'kafka')
+# Milliseconds the producer waits for more messages before sending a batch, and the most messages in a batch
+AUTOREDUCE_KAFKA_LINGER_MS = int(os.getenv('AUTOREDUCE_KAFKA_LINGER_MS', '5'))
+AUTOREDUCE_KAFKA_BATCH_SIZE = int(os.getenv('AUTOREDUCE_KAFKA_BATCH_SIZE', '10000'))
+# Seconds a request waits for its messages to be delivered
+AUTOREDUCE_KAFKA_FLUSH_TIMEOUT = float(os.getenv('AUTOREDUCE_KAFKA_FLUSH_TIMEOUT', '10'))
+# Seconds the process waits for the messages still queued to be delivered when it exits
+AUTOREDUCE_KAFKA_DRAIN_TIMEOUT = float(os.getenv('AUTOREDUCE_KAFKA_DRAIN_TIMEOUT', '30'))
+
+# Store of the reduction scripts uploaded to /api/scripts, see autoreduce_rest_api.runs.script_store
+
+# "local" keeps the scripts in this process only, "django" also stores them in the Django cache named by
+# AUTOREDUCE_SCRIPT_STORE_ALIAS, for every process to find them
+AUTOREDUCE_SCRIPT_STORE_BACKEND = os.getenv('AUTOREDUCE_SCRIPT_STORE_BACKEND', 'local')
+AUTOREDUCE_SCRIPT_STORE_ALIAS = os.getenv('AUTOREDUCE_SCRIPT_STORE_ALIAS', 'default')
+# Number of bytes of scripts kept in the memory of each process, the least recently used being evicted
+AUTOREDUCE_SCRIPT_STORE_SIZE = int(os.getenv('AUTOREDUCE_SCRIPT_STORE_SIZE', '67108864'))
+# Number of bytes above which a script is not accepted
+AUTOREDUCE_SCRIPT_MAX_SIZE = int(os.getenv('AUTOREDUCE_SCRIPT_MAX_SIZE', '1048576'))
+
+# Compressed and MessagePack request and response bodies, see autoreduce_rest_api.runs.encodings
+
+# Number of bytes a request body can decode to, above which it is rejected with a 413
+AUTOREDUCE_MAX_DECODED_BODY_SIZE = int(os.getenv('AUTOREDUCE_MAX_DECODED_BODY_SIZE', '16777216'))
+# Number of bytes below which responses are not compressed, as the savings do not make up for the time
+AUTOREDUCE_COMPRESS_MIN_SIZE = int(os.getenv('AUTOREDUCE_COMPRESS_MIN_SIZE', '1024'))
+# Compression levels of the responses, from 1 to 9 for gzip and 1 to 22 for zstd
+AUTOREDUCE_GZIP_LEVEL = int(os.getenv('AUTOREDUCE_GZIP_LEVEL', '6'))
+AUTOREDUCE_ZSTD_LEVEL = int(os.getenv('AUTOREDUCE_ZSTD_LEVEL', '3'))
+
+# Index of the instruments, used by the plans and the metrics, see autoreduce_rest_api.runs.instruments
+
+# Number of seconds after which the cached index of the instruments, and of their reduce_vars.py, is reloaded
+AUTOREDUCE_INSTRUMENT_INDEX_TTL = int(os.getenv('AUTOREDUCE_INSTRUMENT_INDEX_TTL', '60'))
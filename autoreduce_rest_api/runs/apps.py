@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class RunsConfig(AppConfig):
+    name = "autoreduce_rest_api.runs"
+
+    def ready(self):
+        # pylint:disable=import-outside-toplevel
+        from autoreduce_rest_api.runs import authentication, connections
+        authentication.connect_signals()
+        connections.connect_signals()
@@ -0,0 +1,264 @@
+"""
+Asynchronous counterparts of the run views, for when the API is served through ASGI (see asgi.py).
+
+Under ASGI Django runs the sync views one at a time in a single thread, and under WSGI each request
+holds a server thread until its runs are submitted. These views instead wait on the submission without
+blocking the event loop, so the number of requests in flight is not capped by the server's threads.
+
+ICAT, the Kafka producer and the ORM calls made by autoreduce_scripts are blocking clients, so they are
+run in a thread pool reserved for these views, sized by AUTOREDUCE_ASYNC_WORKERS.
+
+A retry with the same Idempotency-Key header is handled as by the sync views, see idempotent_response.
+
+run_events long-polls for the status transitions of the runs, see autoreduce_rest_api.runs.watcher.
+
+The streamed responses of the sync views, whose content is produced by a sync generator that submits the
+runs, are sent by StreamingASGIHandler, which produces each part in the same thread pool as these views.
+Django's ASGIHandler would iterate the generator in the event loop, blocking every other connection until
+the submission has finished.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from rest_framework import exceptions
+
+from autoreduce_rest_api.runs.authentication import CachedTokenAuthentication
+from autoreduce_rest_api.runs.connections import close_unusable_connections
+from autoreduce_rest_api.runs.encodings import EncodedResponse, RequestTooLarge, parse_body
+from autoreduce_rest_api.runs.idempotency import (IN_PROGRESS_MESSAGE, INVALID_KEY_MESSAGE, claim, finish, fingerprint,
+                                                  keep, key_scope, replay, replay_stored)
+from autoreduce_rest_api.runs.throttling import Throttled, admit, client_key, release, release_when_sent
+from autoreduce_rest_api.runs.views import error_response, remove_runs, submit_batch_runs, submit_runs
+from autoreduce_rest_api.runs.watcher import TooManyWaiters, run_watcher
+
+INVALID_JSON_MESSAGE = "Request body must be a JSON or MessagePack object"
+INVALID_CURSOR_MESSAGE = "'cursor' must be the cursor returned by the previous request"
+INVALID_IDS_MESSAGE = "'ids' must be a comma separated list of reduction run IDs"
+
+_executor = ThreadPoolExecutor(max_workers=settings.AUTOREDUCE_ASYNC_WORKERS, thread_name_prefix="async-views")
+
+
+def run_in_executor(func):
+    """
+    Wraps a blocking function into a coroutine function that runs it in the executor of the views.
+
+    The connections of the executor's threads are handled as Django handles those of a sync request,
+    so that they are not left open, or reused after they have become unusable.
+    """
+
+    def with_connections(*args, **kwargs):
+        close_old_connections()
+        close_unusable_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(with_connections, thread_sensitive=False, executor=_executor)
+
+
+def authenticate(request):
+    """
+    Authenticates the request's token as the sync views do.
+
+    Returns:
+        The authenticated user and its token, or None if the request has no token
+    """
+    return CachedTokenAuthentication().authenticate(request)
+
+
+_authenticate = run_in_executor(authenticate)
+_submit_runs = run_in_executor(submit_runs)
+_submit_batch_runs = run_in_executor(submit_batch_runs)
+_remove_runs = run_in_executor(remove_runs)
+_admit = run_in_executor(admit)
+_replay_stored = run_in_executor(replay_stored)
+_keep = run_in_executor(keep)
+# the end of the parts of a streamed response, which are all bytes
+_END = object()
+_next_part = run_in_executor(next)
+
+
+async def admitted(request, instrument: str, data: dict, submit):
+    """Submits the runs with the coroutine function once the request has been admitted, see throttling."""
+    try:
+        held = await _admit(client_key(request), instrument, data)
+    except Throttled as err:
+        return err.response()
+    try:
+        response = await submit(instrument, data)
+    except BaseException:
+        release(held)
+        raise
+    return release_when_sent(response, held)
+
+
+async def idempotent_response(request, data: dict, get_response):
+    """
+    Returns the response to the request as the idempotent decorator of the sync views does, awaiting
+    the coroutine function for it unless the request's Idempotency-Key has already been handled.
+    A request whose key is in flight waits for the first request's response without holding a thread.
+    """
+    key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+    if key is None:
+        return await get_response()
+    scope = key_scope(request, key)
+    if scope is None:
+        return error_response(INVALID_KEY_MESSAGE)
+    request_fingerprint = fingerprint(data)
+
+    future, first = claim(scope)
+    if not first:
+        try:
+            # shielded, as the timeout would otherwise cancel the future shared with the first request
+            stored = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                            settings.AUTOREDUCE_IDEMPOTENCY_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            return error_response(IN_PROGRESS_MESSAGE, status=409)
+        return replay(stored, request_fingerprint)
+
+    response = await _replay_stored(scope, future, request_fingerprint)
+    if response is not None:
+        return response
+    try:
+        response = await get_response()
+    except BaseException:
+        finish(scope, future, None)
+        raise
+    return await _keep(response, scope, future, request_fingerprint)
+
+
+def async_api_view(*methods: str):
+    """
+    Decorates an asynchronous view with what APIView provides the sync views: the allowed methods,
+    token authentication, with IsAuthenticated, and the parsing of the JSON or MessagePack body.
+
+    The view is called with the request, the parsed body and the URL arguments.
+    """
+
+    def decorator(view):
+
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return EncodedResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+            try:
+                user_auth = await _authenticate(request)
+            except exceptions.AuthenticationFailed as err:
+                return EncodedResponse({"detail": err.detail}, status=401)
+            if user_auth is None:
+                return EncodedResponse({"detail": exceptions.NotAuthenticated.default_detail}, status=401)
+            request.user, request.auth = user_auth
+            try:
+                data = parse_body(request)
+            except RequestTooLarge as err:
+                return EncodedResponse({"detail": err.detail}, status=err.status_code)
+            except exceptions.ParseError:
+                data = None
+            if not isinstance(data, dict):
+                return error_response(INVALID_JSON_MESSAGE)
+            return await view(request, data, *args, **kwargs)
+
+        # as done by csrf_exempt, which cannot wrap a coroutine function in this version of Django.
+        # Like APIView, the views are authenticated by token rather than by session
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+@async_api_view("POST", "DELETE")
+async def manage_runs(request, data: dict, instrument: str):
+    """Asynchronous counterpart of ManageRuns, taking the same arguments and giving the same responses."""
+    if request.method == "POST":
+        return await idempotent_response(request, data, lambda: admitted(request, instrument, data, _submit_runs))
+    return await _remove_runs(instrument, data)
+
+
+@async_api_view("POST", "DELETE")
+async def batch_submit(request, data: dict, instrument: str):
+    """Asynchronous counterpart of BatchSubmit, taking the same arguments and giving the same responses."""
+    if request.method == "POST":
+        return await idempotent_response(request, data, lambda: admitted(request, instrument, data, _submit_batch_runs))
+    return await _remove_runs(instrument, data, batch=True)
+
+
+def parse_events_query(params) -> dict:
+    """
+    Returns the arguments of RunWatcher.wait from the query parameters of a run_events request.
+
+    Raises:
+        ValueError: if any of the parameters is not valid
+    """
+    kwargs = {}
+    if params.get("cursor"):
+        if not params["cursor"].isdigit():
+            raise ValueError(INVALID_CURSOR_MESSAGE)
+        kwargs["cursor"] = int(params["cursor"])
+    if params.get("ids"):
+        try:
+            kwargs["ids"] = {int(run_id) for run_id in params["ids"].split(",")}
+        except ValueError as err:
+            raise ValueError(INVALID_IDS_MESSAGE) from err
+    max_timeout = settings.AUTOREDUCE_WATCH_MAX_TIMEOUT
+    kwargs["timeout"] = params.get("timeout", str(max_timeout // 2))
+    if not kwargs["timeout"].isdigit() or int(kwargs["timeout"]) > max_timeout:
+        raise ValueError(f"'timeout' must be a number of seconds between 0 and {max_timeout}")
+    kwargs["timeout"] = int(kwargs["timeout"])
+    return kwargs
+
+
+@async_api_view("GET")
+async def run_events(request, _data: dict, instrument: str):
+    """
+    Waits for the status transitions of the runs of the instrument, and returns them as soon as there are any.
+
+    Query parameters:
+        cursor: The cursor of the previous response, so that no transition is missed between two requests.
+                Without it only the transitions from now on are returned
+        ids: Only the transitions of the reduction runs with these comma separated IDs
+        timeout: The number of seconds after which the response has no events, if none has happened
+
+    Returns:
+        The events, the cursor of the next request, and whether some events after the given cursor
+        were discarded from the history of the watcher before they could be returned. A 503 if too many
+        requests are waiting already
+    """
+    try:
+        kwargs = parse_events_query(request.GET)
+    except ValueError as err:
+        return error_response(str(err))
+    try:
+        events, cursor, missed = await run_watcher.wait(instrument.upper(), **kwargs)
+    except TooManyWaiters as err:
+        return error_response(str(err), status=503)
+    return EncodedResponse({"events": events, "cursor": cursor, "missed": missed})
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """The ASGI handler of Django, producing the parts of the streamed responses outside of the event loop."""
+
+    async def send_response(self, response, send):
+        """Sends the response, producing each part of a streamed response in the executor of the views."""
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+        headers = [(header.encode("ascii"), value.encode("latin1")) for header, value in response.items()]
+        headers.extend(
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip()) for cookie in response.cookies.values())
+        try:
+            await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+            parts = iter(response)
+            part = await _next_part(parts, _END)
+            while part is not _END:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                part = await _next_part(parts, _END)
+            await send({"type": "http.response.body"})
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
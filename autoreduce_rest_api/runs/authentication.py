@@ -0,0 +1,48 @@
+"""
+Token authentication that caches the tokens it has checked, so that authenticating a request
+does not query the database while its token is cached.
+
+A cached token is invalidated when its Token or user is saved or deleted by this process.
+Changes made by other processes, such as the web app, are seen once the token expires from
+the cache, after AUTOREDUCE_TOKEN_CACHE_TTL seconds.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from autoreduce_rest_api.runs.cache import token_cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that checks the database only for the tokens that are not cached."""
+
+    def authenticate_credentials(self, key):
+        user_token = token_cache.get(key)
+        if user_token is None:
+            # raises AuthenticationFailed for unknown tokens and inactive users, which are not cached
+            user_token = super().authenticate_credentials(key)
+            token_cache.set(key, user_token)
+        return user_token
+
+
+def invalidate_token(instance: Token, **_kwargs):
+    """Removes a Token that has been changed or deleted from the cache."""
+    token_cache.invalidate([instance.key])
+
+
+def invalidate_user_tokens(instance, **_kwargs):
+    """
+    Removes the tokens of a user that has been changed from the cache, so that a user that is
+    deactivated cannot authenticate. Deleting a user deletes its tokens, which invalidates them.
+    """
+    token_cache.invalidate(list(Token.objects.filter(user_id=instance.pk).values_list("key", flat=True)))
+
+
+def connect_signals():
+    """Connects the receivers that invalidate the cached tokens, called once the apps are ready."""
+    post_save.connect(invalidate_token, sender=Token, dispatch_uid="autoreduce_rest_api.invalidate_token_save")
+    post_delete.connect(invalidate_token, sender=Token, dispatch_uid="autoreduce_rest_api.invalidate_token_delete")
+    post_save.connect(invalidate_user_tokens,
+                      sender=get_user_model(),
+                      dispatch_uid="autoreduce_rest_api.invalidate_user_tokens")
@@ -0,0 +1,114 @@
+"""
+Submission of runs for several instruments in a single request.
+"""
+from typing import Dict, List, Optional
+
+from autoreduce_rest_api.runs.metrics import time_stage
+from autoreduce_rest_api.runs.publishing import request_publisher
+from autoreduce_rest_api.runs.run_ranges import expand_runs
+from autoreduce_rest_api.runs.script_store import resolve_reduction_script
+from autoreduce_rest_api.runs.submission import DEFAULT_SOFTWARE, RunResult, iter_submissions, prefetch_run_data
+
+
+def validate_entry(entry) -> Optional[str]:  # pylint:disable=too-many-return-statements
+    """
+    Checks that a bulk entry is well formed.
+
+    Returns:
+        A message describing the first problem found, or None if the entry is valid
+    """
+    if not isinstance(entry, dict):
+        return "Entry must be an object"
+    if not isinstance(entry.get("instrument"), str) or not entry["instrument"]:
+        return "'instrument' must be a non-empty string"
+    if "runs" not in entry:
+        return "No 'runs' key specified"
+    try:
+        expand_runs(entry["runs"])
+    except ValueError as err:
+        return str(err)
+    for key, expected_type in (("reduction_arguments", dict), ("software", dict), ("user_id", int),
+                               ("description", str), ("reduction_script", str), ("reduction_script_hash", str)):
+        if entry.get(key) is not None and not isinstance(entry[key], expected_type):
+            return f"'{key}' must be of type {expected_type.__name__}"
+    try:
+        resolve_reduction_script(entry)
+    except ValueError as err:
+        return str(err)
+    software = entry.get("software")
+    if software is not None and not {"name", "version"} <= set(software):
+        return "'software' must have a 'name' and a 'version'"
+    return None
+
+
+def validate_entries(entries) -> Dict[int, str]:
+    """
+    Checks all of the entries of a bulk request.
+
+    Returns:
+        The error message of each invalid entry, keyed by its index
+    """
+    errors = {}
+    for index, entry in enumerate(entries):
+        error = validate_entry(entry)
+        if error is not None:
+            errors[index] = error
+    return errors
+
+
+def submit_entries(entries: List[dict]) -> List[dict]:
+    """
+    Submits the runs of each entry. The runs already in the database are retrieved for all
+    the entries at once, so that they are not queried again run by run, and the messages of all
+    the entries are published through one publisher, which waits for their delivery once.
+
+    Args:
+        entries: Entries that have passed validate_entries
+
+    Returns:
+        The submitted and failed runs of each entry, or its error, in the order of the entries
+    """
+    entry_runs = [list(expand_runs(entry["runs"])) for entry in entries]
+    instrument_runs = {}
+    for entry, runs in zip(entries, entry_runs):
+        instrument_runs.setdefault(entry["instrument"].upper(), set()).update(runs)
+    known_runs = prefetch_run_data(instrument_runs)
+    try:
+        publisher = request_publisher()
+    except RuntimeError as err:
+        return [{"instrument": entry["instrument"].upper(), "error": str(err)} for entry in entries]
+
+    results = []
+    for entry, runs in zip(entries, entry_runs):
+        instrument = entry["instrument"].upper()
+        try:
+            run_results = list(
+                iter_submissions(instrument,
+                                 runs,
+                                 software=entry.get("software") or DEFAULT_SOFTWARE,
+                                 reduction_script=resolve_reduction_script(entry),
+                                 reduction_arguments=entry.get("reduction_arguments") or {},
+                                 user_id=entry.get("user_id", -1),
+                                 description=entry.get("description", ""),
+                                 known_runs=known_runs.get(instrument),
+                                 publisher=publisher))
+        except (RuntimeError, ValueError) as err:
+            # a ValueError if its script has been evicted from the store since the entry was validated
+            results.append({"instrument": instrument, "error": str(err)})
+            continue
+        results.append({
+            "instrument":
+            instrument,
+            "submitted_runs": [result.message for result in run_results if result.status == RunResult.SUBMITTED],
+            "failed_runs": [result.to_dict() for result in run_results if result.status == RunResult.FAILED],
+        })
+    try:
+        with time_stage("flush"):
+            publisher.flush()
+    except RuntimeError as err:
+        # the messages of the entries are not known to have been delivered, as when an entry fails on its own
+        results = [{
+            "instrument": result["instrument"],
+            "error": str(err)
+        } if result.get("submitted_runs") else result for result in results]
+    return results
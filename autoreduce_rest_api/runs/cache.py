@@ -0,0 +1,256 @@
+"""
+Caches for values that are expensive to look up and rarely change, such as the data location
+and RB number of a run, or the user of an authentication token.
+
+Two backends are available: a process-local one with LRU eviction, and one that
+stores the values in a Django cache so that they are shared between processes.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LocalCache:
+    """Thread-safe in-process cache whose entries expire after a TTL and are evicted least recently used first."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        """
+        Args:
+            max_entries: Number of entries after which the least recently used entries are evicted
+            ttl: Number of seconds after which an entry expires
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Returns the value stored for the key, or None if there is none or it has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Stores the value for the key, evicting the least recently used entries if the cache is full."""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        """Removes the key from the cache, if it is present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_matching(self, predicate) -> int:
+        """
+        Removes all the keys for which the predicate is true.
+
+        Returns:
+            The number of entries removed
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        """Removes all the entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class BackendCache:
+    """Base of the caches that can use either backend, counting their hits and misses."""
+
+    def __init__(self, max_entries: int, ttl: float, backend: str = "local", alias: str = "default"):
+        """
+        Args:
+            max_entries: Number of entries kept by the local backend
+            ttl: Number of seconds after which an entry expires
+            backend: "local" to keep the entries in this process, "django" to use a Django cache
+                     or "none" to disable the cache
+            alias: The Django cache used by the "django" backend
+        """
+        if backend not in ("local", "django", "none"):
+            raise ValueError(f"Unknown {type(self).__name__} backend '{backend}'")
+        self.backend = backend
+        self.ttl = ttl
+        self._local = LocalCache(max_entries, ttl)
+        self._alias = alias
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Whether values are stored in the cache at all."""
+        return self.backend != "none"
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def clear(self):
+        """Removes all entries from the local backend and resets the counters."""
+        self._local.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters, and the number of entries held by the local backend."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.backend,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._local) if self.backend == "local" else None,
+            }
+
+
+class RunMetadataCache(BackendCache):
+    """
+    Caches the data location, RB number and title of runs, keyed by instrument and run number,
+    and counts the hits and misses.
+    """
+
+    def _django_key(self, instrument: str, run_number) -> str:
+        """
+        Returns the key used in the Django cache. The key contains the instrument's generation,
+        so that all of an instrument's runs can be invalidated by incrementing it.
+        """
+        return f"autoreduce_rest_api:run:{instrument}:{self._generation(instrument)}:{run_number}"
+
+    def _generation(self, instrument: str) -> int:
+        """Returns the current generation of the instrument's entries in the Django cache."""
+        return caches[self._alias].get_or_set(f"autoreduce_rest_api:run-generation:{instrument}", 0, timeout=None)
+
+    def get(self, instrument: str, run_number) -> Optional[tuple]:
+        """Returns the cached data location, RB number and title of the run, or None if it is not cached."""
+        if not self.enabled:
+            return None
+        if self.backend == "django":
+            value = caches[self._alias].get(self._django_key(instrument, run_number))
+        else:
+            value = self._local.get((instrument, run_number))
+        self._count(value is not None)
+        return tuple(value) if value is not None else None
+
+    def set(self, instrument: str, run_number, value: tuple):
+        """Caches the data location, RB number and title of the run."""
+        if not self.enabled:
+            return
+        if self.backend == "django":
+            caches[self._alias].set(self._django_key(instrument, run_number), value, timeout=self.ttl)
+        else:
+            self._local.set((instrument, run_number), value)
+
+    def invalidate(self, instrument: str, run_numbers: Optional[list] = None):
+        """
+        Removes runs from the cache so that they are looked up again on their next submission.
+
+        Args:
+            instrument: The instrument whose runs are removed
+            run_numbers: The runs to remove. If None, all of the instrument's runs are removed
+        """
+        if self.backend == "django":
+            cache = caches[self._alias]
+            if run_numbers is None:
+                generation_key = f"autoreduce_rest_api:run-generation:{instrument}"
+                cache.get_or_set(generation_key, 0, timeout=None)
+                cache.incr(generation_key)
+            else:
+                cache.delete_many([self._django_key(instrument, run_number) for run_number in run_numbers])
+        elif run_numbers is None:
+            self._local.delete_matching(lambda key: key[0] == instrument)
+        else:
+            for run_number in run_numbers:
+                self._local.delete((instrument, run_number))
+
+
+class KeyedCache(BackendCache):
+    """Caches values by a string key, such as a secret, that is hashed before it is sent to a Django cache."""
+    # distinguishes the keys of each subclass in the Django cache
+    prefix = "keyed"
+
+    def _django_key(self, key: str) -> str:
+        """Returns the key used in the Django cache, which holds a digest of the key rather than the key."""
+        return f"autoreduce_rest_api:{self.prefix}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the value cached for the key, or None if it is not cached."""
+        if not self.enabled:
+            return None
+        if self.backend == "django":
+            value = caches[self._alias].get(self._django_key(key))
+        else:
+            value = self._local.get(key)
+        self._count(value is not None)
+        return value
+
+    def set(self, key: str, value: Any):
+        """Caches the value for the key."""
+        if not self.enabled:
+            return
+        if self.backend == "django":
+            caches[self._alias].set(self._django_key(key), value, timeout=self.ttl)
+        else:
+            self._local.set(key, value)
+
+    def invalidate(self, keys: list):
+        """Removes the keys from the cache."""
+        if self.backend == "django":
+            caches[self._alias].delete_many([self._django_key(key) for key in keys])
+        else:
+            for key in keys:
+                self._local.delete(key)
+
+
+class TokenCache(KeyedCache):
+    """Caches the user and Token of authentication token keys, and counts the hits and misses."""
+    prefix = "token"
+
+
+class IdempotencyCache(KeyedCache):
+    """Caches the responses of the requests made with an Idempotency-Key, see autoreduce_rest_api.runs.idempotency."""
+    prefix = "idempotency"
+
+
+run_metadata_cache = RunMetadataCache(max_entries=settings.AUTOREDUCE_RUN_CACHE_SIZE,
+                                      ttl=settings.AUTOREDUCE_RUN_CACHE_TTL,
+                                      backend=settings.AUTOREDUCE_RUN_CACHE_BACKEND,
+                                      alias=settings.AUTOREDUCE_RUN_CACHE_ALIAS)
+
+token_cache = TokenCache(max_entries=settings.AUTOREDUCE_TOKEN_CACHE_SIZE,
+                         ttl=settings.AUTOREDUCE_TOKEN_CACHE_TTL,
+                         backend=settings.AUTOREDUCE_TOKEN_CACHE_BACKEND,
+                         alias=settings.AUTOREDUCE_TOKEN_CACHE_ALIAS)
+
+idempotency_cache = IdempotencyCache(max_entries=settings.AUTOREDUCE_IDEMPOTENCY_CACHE_SIZE,
+                                     ttl=settings.AUTOREDUCE_IDEMPOTENCY_CACHE_TTL,
+                                     backend=settings.AUTOREDUCE_IDEMPOTENCY_CACHE_BACKEND,
+                                     alias=settings.AUTOREDUCE_IDEMPOTENCY_CACHE_ALIAS)
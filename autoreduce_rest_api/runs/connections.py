@@ -0,0 +1,147 @@
+"""
+Management of the database connections of the API process, and the query budget of each request.
+
+Connections are kept open for AUTOREDUCE_DB_CONN_MAX_AGE seconds, Django's CONN_MAX_AGE, so that
+requests reuse the connection of their thread rather than each paying for the setup of a new one.
+A connection that the database has dropped in the meantime would fail the request that reuses it,
+so with AUTOREDUCE_DB_HEALTH_CHECKS the connections are checked before each request and closed if
+they are no longer usable, for the request to open a new one. This is what CONN_HEALTH_CHECKS does
+from Django 4.1.
+
+QueryBudgetMiddleware counts the queries of each request, and the time spent in them, including those
+made by the threads that look the runs up, and logs the requests that exceed AUTOREDUCE_QUERY_BUDGET
+queries or AUTOREDUCE_QUERY_TIME_BUDGET milliseconds, to find the N+1 patterns of the submissions.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+_budget: contextvars.ContextVar = contextvars.ContextVar("query_budget", default=None)
+
+
+def close_unusable_connections(**_kwargs):
+    """Closes the open connections of this thread that are no longer usable, unless they are in a transaction."""
+    if not settings.AUTOREDUCE_DB_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block and not connection.is_usable():
+            connection.close()
+
+
+class QueryBudget:
+    """The number of queries made for a request and the time spent in them, from any thread."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, duration: float):
+        """Counts a query that took the duration, in seconds."""
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+
+    def exceeded(self) -> bool:
+        """Returns whether the request made more queries, or spent longer in them, than its budget."""
+        return self.count > settings.AUTOREDUCE_QUERY_BUDGET or \
+            self.duration * 1000 > settings.AUTOREDUCE_QUERY_TIME_BUDGET
+
+
+def count_query(execute, sql, params, many, context):
+    """Execute wrapper that counts the query in the budget of the current request, if there is one."""
+    budget: Optional[QueryBudget] = _budget.get()
+    if budget is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        budget.add(time.perf_counter() - start)
+
+
+def add_query_counter(connection, **_kwargs):
+    """Installs count_query on a connection when it connects, which a persistent connection does once."""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def report(request, budget: QueryBudget):
+    """Logs the queries of the request if they exceeded the budget."""
+    if budget.exceeded():
+        logger.warning("%s %s made %d queries taking %.0f ms, over the budget of %d queries and %.0f ms",
+                       request.method, request.get_full_path(), budget.count, budget.duration * 1000,
+                       settings.AUTOREDUCE_QUERY_BUDGET, settings.AUTOREDUCE_QUERY_TIME_BUDGET)
+
+
+class QueryBudgetMiddleware(MiddlewareMixin):
+    """
+    Counts the queries of each request, up to the last chunk of a streaming response, and logs the
+    requests that exceed the budget.
+
+    The threads that a view starts only count towards the budget if they run in a copy of the context
+    of the request, as the lookup threads of the submissions and sync_to_async do. The middleware is
+    async capable, as Django would otherwise handle the async views one at a time in a single thread.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        budget = QueryBudget()
+        token = _budget.set(budget)
+        try:
+            response = self.get_response(request)
+        finally:
+            _budget.reset(token)
+        return self.counted_response(request, response, budget)
+
+    async def __acall__(self, request):
+        budget = QueryBudget()
+        token = _budget.set(budget)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _budget.reset(token)
+        return self.counted_response(request, response, budget)
+
+    def counted_response(self, request, response, budget: QueryBudget):
+        """Reports the queries of the response, or once it has been sent if it streams."""
+        if response.streaming:
+            response.streaming_content = self.counted(response.streaming_content, request, budget)
+        else:
+            report(request, budget)
+        return response
+
+    @staticmethod
+    def counted(content: Iterable[bytes], request, budget: QueryBudget):
+        """Sends the content, counting the queries made to produce each chunk, and reports them at the end."""
+        chunks = iter(content)
+        try:
+            while True:
+                token = _budget.set(budget)
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    _budget.reset(token)
+                yield chunk
+        finally:
+            report(request, budget)
+
+
+def connect_signals():
+    """Checks the connections before each request, and counts the queries of every connection."""
+    request_started.connect(close_unusable_connections)
+    connection_created.connect(add_query_counter)
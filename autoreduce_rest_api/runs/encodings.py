@@ -0,0 +1,346 @@
+"""
+Compressed and MessagePack request and response bodies.
+
+The bodies of the run endpoints were always plain JSON, so the clients submitting thousands of runs,
+with their reduction arguments and scripts, sent and received large bodies that were slow to parse on
+both ends. Clients can now choose, through the standard headers:
+
+- Content-Encoding: gzip or zstd, to send a compressed body. The body is decompressed as the parser
+  reads it, rather than being read in full first, and is rejected with a 413 once it decodes to more
+  than AUTOREDUCE_MAX_DECODED_BODY_SIZE bytes. Any other encoding is rejected with a 415.
+- Content-Type: application/msgpack, to send a MessagePack body, which is unpacked as it is read.
+- Accept: application/msgpack, to receive the responses built with EncodedResponse as MessagePack
+  rather than JSON. The newline delimited JSON streams are not affected.
+- Accept-Encoding: zstd or gzip, to receive the responses of AUTOREDUCE_COMPRESS_MIN_SIZE bytes or more
+  compressed. Streaming responses are compressed a chunk at a time, so that each line is still sent
+  as soon as it is produced.
+
+benchmarks/bench_encodings.py compares the size and the parsing and serialisation time of each of them.
+"""
+import asyncio
+import contextvars
+import gzip
+import io
+import json
+import zlib
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import msgpack
+import zstandard
+from django.conf import settings
+from django.core.handlers.wsgi import LimitedStream
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http.response import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import exceptions
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+# the supported content codings, by order of preference of the server for the responses
+GZIP = "gzip"
+ZSTD = "zstd"
+COMPRESSIONS = (ZSTD, GZIP)
+IDENTITY = "identity"
+
+# number of bytes read from the request at a time by the decoders
+CHUNK_SIZE = 65536
+
+UNSUPPORTED_ENCODING_MESSAGE = f"Content-Encoding must be one of {', '.join(COMPRESSIONS)} or {IDENTITY}"
+TRAILING_DATA_MESSAGE = "The MessagePack body holds more than one object"
+
+# the media type of the responses of the request being handled, see EncodedResponse
+_media_type: contextvars.ContextVar = contextvars.ContextVar("response_media_type", default=JSON_CONTENT_TYPE)
+
+_json_encoder = DjangoJSONEncoder()
+
+
+class RequestTooLarge(exceptions.APIException):
+    status_code = 413
+    default_detail = "The request body is too large once decoded."
+    default_code = "request_too_large"
+
+
+def qualities(header: str) -> Dict[str, Tuple[float, int]]:
+    """Returns the quality of each value of an Accept or Accept-Encoding header, and its position in the header."""
+    values = {}
+    for position, item in enumerate(header.lower().split(",")):
+        value, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, number = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        values.setdefault(value.strip(), (quality, position))
+    return values
+
+
+def preferred(header: str, choices: Sequence[str]) -> Optional[str]:
+    """
+    Returns the choice that an Accept or Accept-Encoding header prefers, or None if it accepts none of them.
+
+    The choices with the highest quality are preferred, then those named rather than matched by a wildcard,
+    then those listed first in the header, then those listed first in the choices.
+    """
+    values = qualities(header)
+    best, best_rank = None, None
+    for choice in choices:
+        for specificity, key in enumerate((choice, f"{choice.split('/')[0]}/*", "*/*", "*")):
+            if key in values:
+                quality, position = values[key]
+                rank = (quality, -specificity, -position)
+                if quality > 0 and (best_rank is None or rank > best_rank):
+                    best, best_rank = choice, rank
+                break
+    return best
+
+
+def encode(data, media_type: str) -> bytes:
+    """Returns the data encoded as the media type, which is JSON unless it is MessagePack."""
+    if media_type == MSGPACK_CONTENT_TYPE:
+        # the types that are not native to MessagePack, such as dates, are given as in the JSON
+        return msgpack.packb(data, default=_json_encoder.default)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class EncodedResponse(HttpResponse):
+    """
+    Takes the place of JsonResponse, encoding the data as MessagePack if the Accept header of the request
+    asked for it, and as JSON otherwise. The data must be a dictionary, as for a JsonResponse.
+    """
+
+    def __init__(self, data: dict, **kwargs):
+        if not isinstance(data, dict):
+            raise TypeError("The data of an EncodedResponse must be a dictionary")
+        media_type = _media_type.get()
+        kwargs.setdefault("content_type", media_type)
+        super().__init__(content=encode(data, media_type), **kwargs)
+        patch_vary_headers(self, ("Accept", ))
+
+
+def unpack(stream):
+    """
+    Unpacks a single MessagePack object from the stream, reading it a chunk at a time.
+
+    Raises:
+        ParseError: if the stream does not hold exactly one valid object
+        RequestTooLarge: if the object is larger than AUTOREDUCE_MAX_DECODED_BODY_SIZE bytes
+    """
+    unpacker = msgpack.Unpacker(stream, read_size=CHUNK_SIZE, max_buffer_size=settings.AUTOREDUCE_MAX_DECODED_BODY_SIZE)
+    try:
+        data = unpacker.unpack()
+    except msgpack.BufferFull as err:
+        raise RequestTooLarge() from err
+    except (ValueError, TypeError, msgpack.UnpackException) as err:
+        raise exceptions.ParseError(f"MessagePack parse error - {err}") from err
+    if unpacker.read_bytes(1):
+        raise exceptions.ParseError(TRAILING_DATA_MESSAGE)
+    return data
+
+
+class MessagePackParser(BaseParser):
+    """Parses MessagePack bodies, unpacking them as they are read rather than once they have been read in full."""
+
+    media_type = MSGPACK_CONTENT_TYPE
+
+    def parse(self, stream, _media_type=None, _parser_context=None):
+        return unpack(stream)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders the DRF responses, such as the errors raised by the authentication and the parsers, as MessagePack.
+    The views respond with EncodedResponses instead, but need the renderer for DRF to accept the media type.
+    """
+
+    media_type = MSGPACK_CONTENT_TYPE
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, _accepted_media_type=None, _renderer_context=None):
+        return b"" if data is None else encode(data, self.media_type)
+
+
+def parse_body(request):
+    """
+    Parses the body of a request that is not handled by DRF, with the parser of its content type,
+    JSON unless it is MessagePack. The ASGI handler receives the whole body before calling the view,
+    so it is decoded in full, then parsed.
+
+    Returns:
+        The parsed body, or an empty dictionary if there is none
+
+    Raises:
+        ParseError: if the body cannot be decoded or parsed
+        RequestTooLarge: if the body is too large once decoded
+    """
+    body = request.body
+    if not body:
+        return {}
+    parser = MessagePackParser() if request.content_type == MSGPACK_CONTENT_TYPE else JSONParser()
+    return parser.parse(io.BytesIO(body), request.content_type)
+
+
+class DecodedStream:
+    """
+    Reads the body of a request through the decoders of its content codings, a chunk at a time,
+    up to a number of decoded bytes.
+    """
+
+    def __init__(self, stream, encodings: Sequence[str], max_size: int):
+        """
+        Args:
+            stream: The body of the request, as sent
+            encodings: The content codings of the body, in the order they were applied
+            max_size: Number of decoded bytes above which RequestTooLarge is raised
+        """
+        for encoding in reversed(encodings):
+            if encoding == GZIP:
+                stream = gzip.GzipFile(fileobj=stream, mode="rb")
+            else:
+                stream = zstandard.ZstdDecompressor().stream_reader(stream,
+                                                                    read_size=CHUNK_SIZE,
+                                                                    read_across_frames=True)
+        self._stream = stream
+        self._encodings = encodings
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        """Returns up to size decoded bytes, or all of the rest of them if size is not given."""
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(CHUNK_SIZE), b""))
+        try:
+            data = self._stream.read(size)
+        except (OSError, EOFError, zlib.error, zstandard.ZstdError) as err:
+            raise exceptions.ParseError(f"Cannot decode the {', '.join(self._encodings)} body - {err}") from err
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestTooLarge()
+        return data
+
+
+def content_encodings(request) -> Sequence[str]:
+    """Returns the content codings of the request's body, in the order they were applied, without identity."""
+    header = request.META.get("HTTP_CONTENT_ENCODING", "").lower()
+    return [encoding.strip() for encoding in header.split(",") if encoding.strip() not in ("", IDENTITY)]
+
+
+def compressor(encoding: str):
+    """
+    Returns a compression object for the content coding, with the mode of its flush
+    that ends the current block without ending the stream.
+    """
+    if encoding == GZIP:
+        # 16 + MAX_WBITS writes the gzip header and trailer around the deflate stream
+        return zlib.compressobj(settings.AUTOREDUCE_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS), zlib.Z_SYNC_FLUSH
+    compression = zstandard.ZstdCompressor(level=settings.AUTOREDUCE_ZSTD_LEVEL).compressobj()
+    return compression, zstandard.COMPRESSOBJ_FLUSH_BLOCK
+
+
+def compress(encoding: str, content: bytes) -> bytes:
+    """Returns the content compressed with the content coding."""
+    compression, _ = compressor(encoding)
+    return compression.compress(content) + compression.flush()
+
+
+def compress_sequence(encoding: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compresses the chunks of a streaming response, flushing after each so that it is sent at once."""
+    compression, flush_mode = compressor(encoding)
+    for chunk in chunks:
+        compressed = compression.compress(chunk) + compression.flush(flush_mode)
+        if compressed:
+            yield compressed
+    yield compression.flush()
+
+
+class ContentEncodingMiddleware(MiddlewareMixin):
+    """
+    Decodes the compressed request bodies as they are read, chooses the media type of the EncodedResponses
+    and compresses the responses, as the request's headers ask.
+
+    Should come before the middleware that reads or changes the content of the responses. The middleware
+    is async capable, for the media type chosen to reach the views run by sync_to_async.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        error = self.decode_request(request)
+        if error is not None:
+            return error
+        token = _media_type.set(response_media_type(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _media_type.reset(token)
+        return self.compress_response(request, response)
+
+    async def __acall__(self, request):
+        error = self.decode_request(request)
+        if error is not None:
+            return error
+        token = _media_type.set(response_media_type(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _media_type.reset(token)
+        return self.compress_response(request, response)
+
+    @staticmethod
+    def decode_request(request) -> Optional[HttpResponse]:
+        """Has the body of the request decoded as it is read, or returns a 415 if its encoding is not supported."""
+        encodings = content_encodings(request)
+        if not encodings:
+            return None
+        if any(encoding not in COMPRESSIONS for encoding in encodings):
+            return JsonResponse({"error": UNSUPPORTED_ENCODING_MESSAGE}, status=415)
+        # pylint:disable=protected-access
+        stream = request._stream
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+        if length:
+            # the decoders read ahead a chunk at a time, which must stop at the end of the body, as the WSGI
+            # streams do but the body files of the ASGI requests do not
+            stream = LimitedStream(stream, length)
+        request._stream = DecodedStream(stream, encodings, settings.AUTOREDUCE_MAX_DECODED_BODY_SIZE)
+        return None
+
+    @staticmethod
+    def compress_response(request, response):
+        """Compresses the response with the content coding that the request prefers, if any."""
+        if not response.streaming and len(response.content) < settings.AUTOREDUCE_COMPRESS_MIN_SIZE:
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding", ))
+        encoding = preferred(request.META.get("HTTP_ACCEPT_ENCODING", ""), COMPRESSIONS)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(encoding, response.streaming_content)
+        else:
+            compressed = compress(encoding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+        # the compressed body is not byte for byte the one that a strong ETag identifies
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
+
+
+def response_media_type(request) -> str:
+    """Returns the media type of the EncodedResponses to the request, JSON unless it prefers MessagePack."""
+    media_type = preferred(request.META.get("HTTP_ACCEPT", ""), (JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE))
+    return media_type or JSON_CONTENT_TYPE
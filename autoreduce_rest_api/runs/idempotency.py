@@ -0,0 +1,203 @@
+"""
+Idempotency-Key support for the submission views.
+
+A client that retries a request with the same Idempotency-Key header gets the response to the first
+request back, marked with an Idempotent-Replayed header, instead of having its runs submitted again.
+Keys are scoped to the user and the URL, and reusing a key with a different body is rejected.
+
+A request whose key is already being handled waits for the first request to finish and shares its
+response, for up to AUTOREDUCE_IDEMPOTENCY_WAIT_TIMEOUT seconds after which it is rejected with a 409.
+The wait holds a server thread under WSGI, so it is only a few seconds by default. With the "django"
+backend, completed responses are recognised by every process, but requests in flight are only coalesced
+within a process.
+
+The sync views are decorated with idempotent, and the asynchronous views go through the same steps in
+async_views.idempotent_response, waiting on the event loop rather than in a thread.
+"""
+import hashlib
+import json
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from functools import wraps
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.http.response import HttpResponse
+
+from autoreduce_rest_api.runs.cache import idempotency_cache
+from autoreduce_rest_api.runs.encodings import EncodedResponse
+
+MAX_KEY_LENGTH = 255
+INVALID_KEY_MESSAGE = f"Idempotency-Key must be between 1 and {MAX_KEY_LENGTH} characters long"
+KEY_REUSED_MESSAGE = "Idempotency-Key has already been used for a request with a different body"
+NOT_COMPLETED_MESSAGE = "The first request with this Idempotency-Key did not complete, it can be retried"
+IN_PROGRESS_MESSAGE = "The first request with this Idempotency-Key is still in progress, retry later"
+
+# headers stored with the status and content of a response, to be replayed
+STORED_HEADERS = ("Content-Type", "Location", "Retry-After")
+
+_in_flight: Dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def idempotent(view_method):
+    """Decorates the POST method of a view, so that it handles each Idempotency-Key once."""
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        return handle(request, key, lambda: view_method(self, request, *args, **kwargs))
+
+    return wrapper
+
+
+def fingerprint(data) -> str:
+    """Returns a digest of the request's data, to recognise a key that is reused for another request."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def error_response(message: str, status: int) -> HttpResponse:
+    """Returns an error in the media type negotiated for the request, as the views do."""
+    return EncodedResponse({"error": message}, status=status)
+
+
+def key_scope(request, key: str) -> Optional[str]:
+    """Returns the scope of the key, to the user and the URL of the request, or None if the key is not valid."""
+    if not 0 < len(key) <= MAX_KEY_LENGTH:
+        return None
+    return f"{request.user.pk}:{request.path}:{key}"
+
+
+def claim(scope: str) -> Tuple[Future, bool]:
+    """
+    Returns the future of the response to the key, and whether this request is the first with the key in flight,
+    in which case it must pass the future to finish, or to keep with its response.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(scope)
+        if future is not None:
+            return future, False
+        future = _in_flight[scope] = Future()
+        return future, True
+
+
+def replay_stored(scope: str, future: Future, request_fingerprint: str) -> Optional[HttpResponse]:
+    """Returns the stored response to the key of the first request, finishing it, or None if there is none."""
+    # checked once the key is registered as in flight, as responses are stored before their key is released
+    stored = idempotency_cache.get(scope)
+    if stored is None:
+        return None
+    finish(scope, future, stored)
+    return replay(stored, request_fingerprint)
+
+
+def keep(response: HttpResponse, scope: str, future: Future, request_fingerprint: str) -> HttpResponse:
+    """Stores the response to the key of the first request, once it has been sent if it is streamed."""
+    if response.streaming:
+        response.streaming_content = StoredContent(response.streaming_content, scope, future,
+                                                   stored_response(request_fingerprint, response, b""))
+        return response
+    finish(scope, future, stored_response(request_fingerprint, response, response.content))
+    return response
+
+
+def handle(request, key: str, get_response: Callable[[], HttpResponse]) -> HttpResponse:
+    """
+    Returns the stored response to the key if there is one, waits for the response if the key
+    is in flight, or otherwise gets the response and stores it.
+    """
+    scope = key_scope(request, key)
+    if scope is None:
+        return error_response(INVALID_KEY_MESSAGE, 400)
+    request_fingerprint = fingerprint(request.data)
+
+    future, first = claim(scope)
+    if not first:
+        try:
+            stored = future.result(timeout=settings.AUTOREDUCE_IDEMPOTENCY_WAIT_TIMEOUT)
+        except FutureTimeoutError:
+            return error_response(IN_PROGRESS_MESSAGE, 409)
+        return replay(stored, request_fingerprint)
+
+    response = replay_stored(scope, future, request_fingerprint)
+    if response is not None:
+        return response
+    try:
+        response = get_response()
+    except BaseException:
+        finish(scope, future, None)
+        raise
+    return keep(response, scope, future, request_fingerprint)
+
+
+def stored_response(request_fingerprint: str, response: HttpResponse, content: bytes) -> dict:
+    """Returns what is stored of a response to be replayed."""
+    return {
+        "fingerprint": request_fingerprint,
+        "status": response.status_code,
+        "content": content,
+        "headers": {header: response[header]
+                    for header in STORED_HEADERS if response.has_header(header)},
+    }
+
+
+class StoredContent:
+    """
+    The content of a streaming response, which is stored once all of it has been sent,
+    and whose key is released once it has been sent or closed.
+    """
+
+    def __init__(self, content: Iterable[bytes], scope: str, future: Future, stored: dict):
+        self._content = content
+        self._scope = scope
+        self._future = future
+        self._stored = stored
+        self._finished = False
+
+    def __iter__(self):
+        chunks = []
+        complete = False
+        try:
+            for chunk in self._content:
+                chunks.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            # a stream that was not read to the end, e.g. as the client disconnected, is not replayed
+            self._finish({**self._stored, "content": b"".join(chunks)} if complete else None)
+
+    def close(self):
+        """Releases the key, which StreamingHttpResponse does even if the content was never iterated."""
+        self._finish(None)
+
+    def _finish(self, stored: Optional[dict]):
+        if not self._finished:
+            self._finished = True
+            finish(self._scope, self._future, stored)
+
+
+def finish(scope: str, future: Future, stored: Optional[dict]):
+    """
+    Stores the response, unless it is a server error or a rejection by the throttling that may not
+    happen again, and passes it to the requests waiting on the key. None is passed if there was no response.
+    """
+    if stored is not None and stored["status"] < 500 and stored["status"] != 429:
+        idempotency_cache.set(scope, stored)
+    with _in_flight_lock:
+        del _in_flight[scope]
+    future.set_result(stored)
+
+
+def replay(stored: Optional[dict], request_fingerprint: str) -> HttpResponse:
+    """Returns the stored response again, or an error if it cannot be replayed to this request."""
+    if stored is None:
+        return error_response(NOT_COMPLETED_MESSAGE, 409)
+    if stored["fingerprint"] != request_fingerprint:
+        return error_response(KEY_REUSED_MESSAGE, 422)
+    response = HttpResponse(stored["content"], status=stored["status"])
+    for header, value in stored["headers"].items():
+        response[header] = value
+    response["Idempotent-Replayed"] = "true"
+    return response
@@ -0,0 +1,69 @@
+"""
+Index of the instruments of the database, which the requests check the instrument of their URL against.
+
+The instrument of a request is any name a client puts in the URL, so it is looked up in this index, loaded
+with a single query and cached for AUTOREDUCE_INSTRUMENT_INDEX_TTL seconds, before it is trusted: by the
+plans of the submissions and removals (see planning), and before it is used as a label of the metrics.
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from autoreduce_db.reduction_viewer.models import Instrument
+from autoreduce_utils.settings import SCRIPTS_DIRECTORY
+
+
+def reduce_vars_directory(instrument: str) -> str:
+    """Returns the directory of the reduction scripts of the instrument."""
+    return SCRIPTS_DIRECTORY % instrument
+
+
+class InstrumentIndex:
+    """
+    Thread-safe index of the instruments of the database, and of whether they have a reduce_vars.py,
+    loaded with a single query and reloaded once it is older than its TTL.
+    """
+
+    def __init__(self, ttl: float):
+        """
+        Args:
+            ttl: Number of seconds after which the index is reloaded
+        """
+        self.ttl = ttl
+        self._instruments: Optional[Dict[str, dict]] = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load() -> Dict[str, dict]:
+        return {
+            name.upper(): {
+                "active": is_active,
+                "paused": is_paused,
+                "reduce_vars": os.path.isfile(os.path.join(reduce_vars_directory(name.upper()), "reduce_vars.py")),
+            }
+            for name, is_active, is_paused in Instrument.objects.values_list("name", "is_active", "is_paused")
+        }
+
+    def get(self, instrument: str) -> Optional[dict]:
+        """
+        Returns whether the instrument is active and paused, and has a reduce_vars.py,
+        or None if it is not in the database.
+        """
+        with self._lock:
+            # loaded under the lock, so that the requests that find it expired do not all reload it
+            if self._instruments is None or self._expires <= time.monotonic():
+                self._instruments = self._load()
+                self._expires = time.monotonic() + self.ttl
+            return self._instruments.get(instrument.upper())
+
+    def clear(self):
+        """Has the index reloaded on next use."""
+        with self._lock:
+            self._instruments = None
+
+
+instrument_index = InstrumentIndex(ttl=settings.AUTOREDUCE_INSTRUMENT_INDEX_TTL)
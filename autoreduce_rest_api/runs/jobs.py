@@ -0,0 +1,185 @@
+"""
+Background jobs that let a request return straight away while its runs are submitted
+on a bounded pool of worker threads.
+"""
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from autoreduce_rest_api.runs.submission import RunResult
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when the maximum number of unfinished jobs has been reached."""
+
+
+class Job:
+    """
+    Tracks the progress of the runs submitted by a single request.
+
+    Attributes:
+        job_id: Unique identifier of the job
+        instrument: The instrument that the runs are submitted for
+        status: One of PENDING, RUNNING, COMPLETED or FAILED
+        runs: The state of each run, keyed by run number, in submission order
+        results: The messages that were published for the submitted runs
+        error: The error that stopped the job, if it failed as a whole
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    def __init__(self, instrument: str, runs: Iterable[int]):
+        self.job_id = uuid.uuid4().hex
+        self.instrument = instrument
+        self.status = Job.PENDING
+        self.runs = OrderedDict((run, {"status": Job.PENDING}) for run in runs)
+        self.results = []
+        self.error = None
+        self.created = timezone.now()
+        self.started = None
+        self.finished = None
+        self._done_callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        """Whether the job has finished, either successfully or not."""
+        return self.status in (Job.COMPLETED, Job.FAILED)
+
+    def add_done_callback(self, callback: Callable[[], None]):
+        """Calls the callback once the job has finished, straight away if it already has."""
+        with self._lock:
+            if not self.done:
+                self._done_callbacks.append(callback)
+                return
+        callback()
+
+    def call_done_callbacks(self):
+        """Calls the callbacks added by add_done_callback, once the job has finished."""
+        with self._lock:
+            callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:  # pylint:disable=broad-except
+                logger.exception("A callback of submission job %s failed", self.job_id)
+
+    def record(self, result: RunResult):
+        """Records the outcome of one of the job's runs."""
+        with self._lock:
+            self.runs[result.run_number] = {
+                key: value
+                for key, value in result.to_dict().items() if key != "run_number"
+            }
+            if result.message is not None:
+                self.results.append(result.message)
+
+    def to_dict(self) -> dict:
+        """Returns a JSON serialisable representation of the job."""
+        with self._lock:
+            finished_runs = sum(1 for state in self.runs.values() if state["status"] != Job.PENDING)
+            return {
+                "job_id": self.job_id,
+                "instrument": self.instrument,
+                "status": self.status,
+                "created": self.created.isoformat(),
+                "started": self.started.isoformat() if self.started else None,
+                "finished": self.finished.isoformat() if self.finished else None,
+                "progress": {
+                    "total": len(self.runs),
+                    "finished": finished_runs,
+                },
+                "runs": [{
+                    "run_number": run_number,
+                    **state
+                } for run_number, state in self.runs.items()],
+                "submitted_runs": list(self.results),
+                "error": self.error,
+            }
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool and keeps a bounded history of them,
+    so that their status can be queried after the request that created them.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, max_retained: int):
+        """
+        Args:
+            max_workers: Number of jobs that can be processed at the same time
+            max_pending: Number of unfinished jobs (queued or running) after which new jobs are rejected
+            max_retained: Number of jobs kept in memory. Once reached, the oldest finished jobs are discarded
+        """
+        self.max_pending = max_pending
+        self.max_retained = max_retained
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="submission-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, job: Job, func: Callable[[Job], None]) -> Job:
+        """
+        Queues the job for execution.
+
+        Args:
+            job: The job to queue
+            func: Called with the job from a worker thread. It is expected to update the job's runs.
+
+        Raises:
+            JobQueueFull: if there are already too many unfinished jobs
+        """
+        with self._lock:
+            unfinished = sum(1 for queued_job in self._jobs.values() if not queued_job.done)
+            if unfinished >= self.max_pending:
+                raise JobQueueFull("Too many submission jobs are in progress, try again later")
+            self._jobs[job.job_id] = job
+            self._evict()
+
+        self._executor.submit(self._execute, job, func)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Returns the job with the given ID, or None if it is unknown or has been discarded."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _evict(self):
+        """Discards the oldest finished jobs above the retention limit."""
+        excess = len(self._jobs) - self.max_retained
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _execute(job: Job, func: Callable[[Job], None]):
+        """Runs the job in a worker thread and records its outcome."""
+        close_old_connections()
+        job.status = Job.RUNNING
+        job.started = timezone.now()
+        try:
+            func(job)
+            job.status = Job.COMPLETED
+        except Exception as err:  # pylint:disable=broad-except
+            logger.exception("Submission job %s failed", job.job_id)
+            job.error = str(err)
+            job.status = Job.FAILED
+        finally:
+            job.finished = timezone.now()
+            job.call_done_callbacks()
+            # connections are per-thread, the worker's would otherwise stay open until the process exits
+            connections.close_all()
+
+
+job_manager = JobManager(max_workers=settings.AUTOREDUCE_JOB_WORKERS,
+                         max_pending=settings.AUTOREDUCE_JOB_MAX_PENDING,
+                         max_retained=settings.AUTOREDUCE_JOB_RETENTION)
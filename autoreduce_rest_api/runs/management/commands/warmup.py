@@ -0,0 +1,15 @@
+"""Loads the submissions before the server starts serving, see autoreduce_rest_api.runs.scripts."""
+from django.core.management.base import BaseCommand, CommandError
+
+from autoreduce_rest_api.runs.scripts import warm_up
+
+
+class Command(BaseCommand):
+    help = "Loads the modules of the submissions and creates the Kafka producer, for hurricane to run before serving"
+
+    def handle(self, *args, **_options):
+        try:
+            duration = warm_up()
+        except RuntimeError as err:
+            raise CommandError(str(err)) from err
+        self.stdout.write(f"Warmed up in {duration * 1000:.0f} ms")
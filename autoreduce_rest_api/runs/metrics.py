@@ -0,0 +1,120 @@
+"""
+Prometheus metrics of the run endpoints.
+
+The metrics are registered in prometheus_client's default registry, which hurricane serves
+at /metrics on its probe port, along with its own metrics.
+
+Request metrics are recorded by MetricsMiddleware, labelled by view, method and instrument. The instrument
+is taken from the URL, so it is only used as a label once the request has been authenticated and if it is in
+the instrument table, and is otherwise labelled "other", for clients not to add a series for every name.
+STAGE_DURATION times each stage of handling the runs: the calls made into autoreduce_scripts,
+and within the run lookups the database, ICAT and datafile reads (see instrument_scripts).
+STARTUP_DURATION records how long each step of loading the submissions took (see runs.scripts).
+"""
+import time
+from functools import wraps
+
+from django.utils.deprecation import MiddlewareMixin
+from prometheus_client import Counter, Gauge, Histogram
+
+from autoreduce_rest_api.runs.instruments import instrument_index
+
+# ICAT lookups and the removal of many runs take much longer than the default buckets allow for
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REQUESTS = Counter("autoreduce_rest_api_requests_total", "Requests handled by the run endpoints",
+                   ["view", "method", "instrument", "status"])
+REQUEST_DURATION = Histogram("autoreduce_rest_api_request_duration_seconds",
+                             "Time taken to return the response of a run endpoint, up to the first line if it streams",
+                             ["view", "method", "instrument"],
+                             buckets=BUCKETS)
+IN_FLIGHT = Gauge("autoreduce_rest_api_requests_in_flight", "Requests being handled by the run endpoints", ["view"])
+THROTTLED = Counter("autoreduce_rest_api_throttled_requests_total",
+                    "Submissions rejected by the throttling, by the limit they reached", ["reason"])
+STAGE_DURATION = Histogram("autoreduce_rest_api_stage_duration_seconds",
+                           "Time taken by each stage of handling the runs", ["stage"],
+                           buckets=BUCKETS)
+STARTUP_DURATION = Gauge("autoreduce_rest_api_startup_duration_seconds",
+                         "Time taken by each step of loading the submissions, and by the whole warm-up", ["step"])
+
+# the instrument label of the requests made for an instrument that is not known
+OTHER_INSTRUMENT = "other"
+
+# the functions get_run_data calls, timed as stages of the lookup
+SCRIPT_STAGES = {
+    "get_run_data_from_database": "database",
+    "get_run_data_from_icat": "icat",
+    "read_from_datafile": "datafile",
+}
+
+
+def time_stage(stage: str):
+    """Returns a context manager, also usable as a decorator, that records the time taken by the stage."""
+    return STAGE_DURATION.labels(stage).time()
+
+
+def instrument_scripts(manual_submission):
+    """
+    Times the calls that manual_submission.get_run_data makes, by replacing the functions in the module
+    with timed wrappers. Called once the module has been loaded; calling it again has no effect.
+    """
+    for name, stage in SCRIPT_STAGES.items():
+        func = getattr(manual_submission, name)
+        if getattr(func, "timed_stage", None) == stage:
+            continue
+        setattr(manual_submission, name, timed_function(func, stage))
+
+
+def timed_function(func, stage: str):
+    """Returns a wrapper of the function that records the time taken by each call as the stage."""
+
+    @wraps(func)
+    def timed(*args, **kwargs):
+        with time_stage(stage):
+            return func(*args, **kwargs)
+
+    timed.timed_stage = stage
+    return timed
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Records the number, duration and status of the requests made to the run endpoints, and how many
+    are in flight. Requests that do not resolve to a view are not recorded, to keep the labels bounded.
+
+    Should be the first middleware, so that the time spent in the others is included.
+    """
+
+    def process_request(self, request):
+        """Starts timing the request."""
+        request.metrics_start = time.perf_counter()
+
+    def process_view(self, request, _view_func, _view_args, view_kwargs):
+        """Labels the request with its view and method, and counts it as in flight."""
+        view = request.resolver_match.url_name or ""
+        request.metrics_labels = (view, request.method, view_kwargs.get("instrument", ""))
+        IN_FLIGHT.labels(view).inc()
+
+    def process_response(self, request, response):
+        """Records the request, if it resolved to a view, labelled with its instrument if it is known."""
+        labels = getattr(request, "metrics_labels", None)
+        if labels is not None:
+            view, method, instrument = labels
+            labels = (view, method, instrument_label(request, instrument))
+            IN_FLIGHT.labels(view).dec()
+            REQUEST_DURATION.labels(*labels).observe(time.perf_counter() - request.metrics_start)
+            REQUESTS.labels(*labels, response.status_code).inc()
+        return response
+
+
+def instrument_label(request, instrument: str) -> str:
+    """
+    Returns the instrument of the URL as a label if the request was authenticated, which the views have
+    done by the time the response is recorded, and the instrument is in the instrument table.
+    """
+    if not instrument:
+        return ""
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated or instrument_index.get(instrument) is None:
+        return OTHER_INSTRUMENT
+    return instrument.upper()
@@ -0,0 +1,119 @@
+"""
+Plans of the run submissions and removals, made without submitting or removing anything.
+
+Problems with a request were only found by submitting its runs: with an unknown instrument, or one
+without its reduce_vars.py, every run went to ICAT before failing. A plan checks the request against
+what is already known instead, without ICAT, the datafiles or Kafka, and reports what would be
+submitted or removed, for the client to reject or trim the request before making it:
+
+- the instrument must be in the instrument table, which is cached by the instrument index (see
+  instruments), and for a submission have a reduce_vars.py in its directory under SCRIPTS_DIRECTORY.
+  An instrument that is not active, or is paused, is reported as a warning
+- the runs already in the database are found with bulk queries, by prefetch_run_data for a submission
+  and by find_reduction_runs for a removal. The runs of a submission that are not in the database are
+  also looked for in the run metadata cache, and those that are in neither would be looked up in ICAT,
+  which alone can tell whether they would be submitted
+
+A plan is returned by a POST or DELETE to /api/plan/runs/<instrument> or /api/plan/runs/batch/<instrument>,
+which take the same data as the run views, and by the run views themselves if their data has "dry_run": true.
+"""
+from collections import Counter
+from typing import List
+
+from django.conf import settings
+
+from autoreduce_rest_api.runs.cache import run_metadata_cache
+from autoreduce_rest_api.runs.instruments import instrument_index, reduce_vars_directory
+from autoreduce_rest_api.runs.removal import NOT_FOUND, find_reduction_runs
+from autoreduce_rest_api.runs.submission import EMPTY_BATCH_MESSAGE, MISMATCHING_RB_NUMBERS_MESSAGE, prefetch_run_data
+
+# what would happen to each run
+SUBMIT = "submit"
+LOOKUP = "lookup"
+REMOVE = "remove"
+
+UNKNOWN_INSTRUMENT_MESSAGE = "Unknown instrument {instrument}"
+NO_REDUCE_VARS_MESSAGE = "No reduce_vars.py found in {directory}"
+INACTIVE_MESSAGE = "{instrument} is not active, its runs will not be reduced"
+PAUSED_MESSAGE = "{instrument} is paused, its runs will not be reduced until it is resumed"
+
+
+def check_instrument(instrument: str, submission: bool) -> tuple:
+    """
+    Checks the instrument against the instrument index.
+
+    Returns:
+        The errors, which would make the request fail, and the warnings
+    """
+    info = instrument_index.get(instrument)
+    if info is None:
+        return [UNKNOWN_INSTRUMENT_MESSAGE.format(instrument=instrument)], []
+    errors, warnings = [], []
+    if submission and not info["reduce_vars"]:
+        errors.append(NO_REDUCE_VARS_MESSAGE.format(directory=reduce_vars_directory(instrument)))
+    if not info["active"]:
+        warnings.append(INACTIVE_MESSAGE.format(instrument=instrument))
+    if info["paused"]:
+        warnings.append(PAUSED_MESSAGE.format(instrument=instrument))
+    return errors, warnings
+
+
+def plan(instrument: str, action: str, batch: bool, runs: List[dict], errors: List[str], warnings: List[str]) -> dict:
+    """Returns the plan of the request, with the number of runs of each status."""
+    return {
+        "instrument": instrument,
+        "action": action,
+        "batch": batch,
+        "errors": errors,
+        "warnings": warnings,
+        "counts": dict(Counter(run["status"] for run in runs)),
+        "runs": runs,
+    }
+
+
+def plan_submission(instrument: str, runs: List, batch: bool = False) -> dict:
+    """
+    Plans the submission of the runs, as a batch if batch is True.
+
+    Returns:
+        The errors and warnings of the request, and whether each run would be submitted with the RB number
+        it is known with, or needs to be looked up in ICAT
+    """
+    instrument = instrument.upper()
+    errors, warnings = check_instrument(instrument, submission=True)
+    known_runs = prefetch_run_data({instrument: runs}).get(instrument, {})
+    planned = []
+    for run_number in runs:
+        run_data = known_runs.get(run_number) or run_metadata_cache.get(instrument, run_number)
+        if run_data is None:
+            planned.append({"run_number": run_number, "status": LOOKUP})
+        else:
+            planned.append({"run_number": run_number, "status": SUBMIT, "rb_number": run_data[1]})
+    if batch and not runs:
+        errors.append(EMPTY_BATCH_MESSAGE)
+    if batch and len({run["rb_number"] for run in planned if "rb_number" in run}) > 1:
+        errors.append(MISMATCHING_RB_NUMBERS_MESSAGE)
+    return plan(instrument, SUBMIT, batch, planned, errors, warnings)
+
+
+def plan_removal(instrument: str, runs: List, batch: bool = False) -> dict:
+    """
+    Plans the removal of the runs, or of the batch runs with these primary keys if batch is True.
+
+    Returns:
+        The errors and warnings of the request, and whether each run would be removed, with its versions
+    """
+    instrument = instrument.upper()
+    errors, warnings = check_instrument(instrument, submission=False)
+    found = find_reduction_runs(instrument, runs, batch, settings.AUTOREDUCE_REMOVAL_CHUNK_SIZE)
+    planned = []
+    for run in runs:
+        if found[run]:
+            planned.append({
+                "run_number": run,
+                "status": REMOVE,
+                "versions": sorted(version for _, version in found[run])
+            })
+        else:
+            planned.append({"run_number": run, "status": NOT_FOUND})
+    return plan(instrument, REMOVE, batch, planned, errors, warnings)
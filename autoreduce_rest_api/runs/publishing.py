@@ -0,0 +1,275 @@
+"""
+Publishing of the messages of the submitted runs to Kafka.
+
+manual_submission.login_queue creates a Kafka producer for each submission, and its Publisher flushes
+the producer after each message, so every request paid for the setup of a producer and every run for
+a round trip to the brokers. Instead the process owns a single producer, created by the warmup command
+or on first use, and drained when the process exits, which the requests share as it is thread safe.
+
+Each request publishes through a RequestPublisher of its own, which queues its messages without
+waiting for them and flushes once after the last of them. The producer sends the messages queued by
+the requests in batches of up to AUTOREDUCE_KAFKA_BATCH_SIZE messages, waiting up to
+AUTOREDUCE_KAFKA_LINGER_MS milliseconds for a batch to fill, so the cost of publishing grows with the
+messages sent rather than with the number of requests.
+
+The "memory" backend replaces Kafka with a MemoryBroker, which keeps the messages in the process,
+for the tests and benchmarks.
+"""
+import atexit
+import logging
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import confluent_kafka
+from django.conf import settings
+
+from autoreduce_utils.clients.kafka_utils import kafka_config_from_env
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryMessage:
+    """A message delivered by the MemoryBroker, with the accessors of confluent_kafka.Message."""
+
+    def __init__(self, topic: str, value: bytes, key: Optional[str] = None):
+        self._topic = topic
+        self._value = value
+        self._key = key
+
+    def topic(self) -> str:
+        """Returns the topic the message was published to."""
+        return self._topic
+
+    def value(self) -> bytes:
+        """Returns the payload of the message."""
+        return self._value
+
+    def key(self) -> Optional[str]:
+        """Returns the key of the message."""
+        return self._key
+
+
+class MemoryBroker:
+    """
+    Stands in for a Kafka producer and its brokers, keeping the messages it delivers in memory.
+
+    The messages are queued until the broker is flushed, which takes flush_latency seconds,
+    plus byte_latency seconds for each byte delivered, to stand in for the round trip to the brokers.
+    As with Kafka, a flush also waits for the messages that other threads are flushing.
+    """
+
+    def __init__(self, flush_latency: float = 0.0, byte_latency: float = 0.0):
+        self.flush_latency = flush_latency
+        self.byte_latency = byte_latency
+        self.messages: List[MemoryMessage] = []
+        self.bytes_sent = 0
+        self.flushes = 0
+        self._queue: List[Tuple[MemoryMessage, Optional[Callable]]] = []
+        self._in_flight = 0
+        self._lock = threading.Condition()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._queue) + self._in_flight
+
+    def produce(self, topic: str, value=None, key=None, callback: Optional[Callable] = None):
+        """Queues a message, calling back with it once it has been delivered."""
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            self._queue.append((MemoryMessage(topic, value, key), callback))
+
+    def poll(self, _timeout: Optional[float] = None) -> int:
+        """Serves no callbacks, as the messages are only delivered when the broker is flushed."""
+        return 0
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        """Delivers the queued messages, and returns the number that were not delivered within the timeout."""
+        with self._lock:
+            queue, self._queue = self._queue, []
+            self._in_flight += len(queue)
+        size = sum(len(message.value() or b"") for message, _ in queue)
+        if queue and (self.flush_latency or self.byte_latency):
+            time.sleep(self.flush_latency + size * self.byte_latency)
+        for message, callback in queue:
+            if callback is not None:
+                callback(None, message)
+        with self._lock:
+            self.messages.extend(message for message, _ in queue)
+            self.bytes_sent += size
+            if queue:
+                self.flushes += 1
+            self._in_flight -= len(queue)
+            self._lock.notify_all()
+            self._lock.wait_for(lambda: not self._in_flight, timeout)
+            return len(self._queue) + self._in_flight
+
+    def clear(self):
+        """Forgets the messages that were delivered."""
+        with self._lock:
+            self.messages.clear()
+            self.bytes_sent = 0
+            self.flushes = 0
+
+
+class SharedProducer:
+    """The producer shared by the requests of the process, created on first use."""
+
+    def __init__(self, backend: str = "kafka"):
+        """
+        Args:
+            backend: "kafka" to publish to the brokers configured by the KAFKA_* environment variables,
+                     or "memory" to publish to a MemoryBroker
+        """
+        if backend not in ("kafka", "memory"):
+            raise ValueError(f"Unknown {type(self).__name__} backend '{backend}'")
+        self.backend = backend
+        self._producer = None
+        self._drain_at_exit = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the producer, creating it if this is the first use, in which case it will be drained
+        when the process exits.
+
+        Raises:
+            RuntimeError: if the producer cannot be created
+        """
+        with self._lock:
+            if self._producer is None:
+                self._producer = self._create()
+                if not self._drain_at_exit:
+                    self._drain_at_exit = True
+                    atexit.register(self.drain)
+            return self._producer
+
+    def _create(self):
+        if self.backend == "memory":
+            return MemoryBroker()
+        # the batching settings can be overridden by the environment, as the rest of the configuration
+        config = {
+            "linger.ms": settings.AUTOREDUCE_KAFKA_LINGER_MS,
+            "batch.num.messages": settings.AUTOREDUCE_KAFKA_BATCH_SIZE,
+            **kafka_config_from_env()
+        }
+        try:
+            return confluent_kafka.Producer(config)
+        except confluent_kafka.KafkaException as err:
+            raise RuntimeError(f"Cannot create the Kafka producer: {err}") from err
+
+    def replace(self, producer=None):
+        """Drains the producer and replaces it, with a new one on next use if none is given."""
+        self.drain()
+        with self._lock:
+            self._producer = producer
+
+    def drain(self, timeout: Optional[float] = None) -> int:
+        """
+        Waits for the messages queued by the producer to be delivered.
+
+        Args:
+            timeout: The number of seconds to wait for, defaults to AUTOREDUCE_KAFKA_DRAIN_TIMEOUT
+
+        Returns:
+            The number of messages that were not delivered in time
+        """
+        with self._lock:
+            producer = self._producer
+        if producer is None:
+            return 0
+        remaining = producer.flush(settings.AUTOREDUCE_KAFKA_DRAIN_TIMEOUT if timeout is None else timeout)
+        if remaining:
+            logger.error("%d messages were not delivered before the Kafka producer was drained", remaining)
+        return remaining
+
+
+kafka_producer = SharedProducer(backend=settings.AUTOREDUCE_KAFKA_BACKEND)
+
+
+class RequestPublisher:
+    """
+    Publishes the messages of a request through the shared producer.
+
+    It has the publish method of autoreduce_utils' Publisher, which manual_submission.submit_run calls,
+    but queues the messages without waiting for them to be delivered. flush waits for all of them at once.
+    """
+
+    def __init__(self, producer):
+        self._producer = producer
+        self._pending = 0
+        self._errors: List[str] = []
+        self._lock = threading.Lock()
+
+    def _delivered(self, err, _message):
+        """Delivery callback of the messages, served by whichever thread polls or flushes the producer."""
+        with self._lock:
+            self._pending -= 1
+            if err is not None:
+                self._errors.append(str(err))
+
+    def publish(self, topic: str, messages, key=None):
+        """
+        Queues the messages to be published to the topic.
+
+        Args:
+            topic: The topic to publish to
+            messages: A message, or a list of them, with a json method returning its payload
+            key: The key of the messages
+
+        Raises:
+            RuntimeError: if the producer does not accept a message
+        """
+        if not isinstance(messages, list):
+            messages = [messages]
+        for message in messages:
+            value = message.json()
+            with self._lock:
+                self._pending += 1
+            try:
+                self._produce(topic, value, key)
+            except (BufferError, confluent_kafka.KafkaException) as err:
+                with self._lock:
+                    self._pending -= 1
+                raise RuntimeError(f"Cannot publish to {topic}: {err}") from err
+
+    def _produce(self, topic: str, value, key):
+        try:
+            self._producer.produce(topic, value, key, callback=self._delivered)
+        except BufferError:
+            # the queue of the producer is full, so wait for some of it to be delivered before trying again
+            self._producer.poll(1)
+            self._producer.produce(topic, value, key, callback=self._delivered)
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Waits for the messages that were published to be delivered.
+
+        Args:
+            timeout: The number of seconds to wait for, defaults to AUTOREDUCE_KAFKA_FLUSH_TIMEOUT
+
+        Raises:
+            RuntimeError: if any of the messages was not delivered
+        """
+        timeout = settings.AUTOREDUCE_KAFKA_FLUSH_TIMEOUT if timeout is None else timeout
+        with self._lock:
+            pending = self._pending
+        if pending:
+            self._producer.flush(timeout)
+        with self._lock:
+            pending, errors = self._pending, list(self._errors)
+        if errors:
+            raise RuntimeError(f"{len(errors)} of the messages could not be delivered: {errors[0]}")
+        if pending:
+            raise RuntimeError(f"{pending} of the messages were not delivered within {timeout} seconds")
+
+
+def request_publisher() -> RequestPublisher:
+    """
+    Returns a publisher for the messages of a request.
+
+    Raises:
+        RuntimeError: if the shared producer cannot be created
+    """
+    return RequestPublisher(kafka_producer.get())
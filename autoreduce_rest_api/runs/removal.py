@@ -0,0 +1,120 @@
+"""
+Removes runs from the database in bulk.
+
+manual_remove.main looks up each run, then deletes each of its versions along with their run numbers
+and locations, one query at a time. Here the reduction runs are found with a query per chunk of the
+requested runs, then deleted a chunk at a time, each chunk in its own transaction, so that the number
+of queries grows with the number of chunks rather than with the number of runs and versions.
+
+The runs are matched as manual_remove matches them with delete_all_versions: every version of a run
+number of the instrument is removed, or for a batch removal the batch run of the instrument with that
+primary key. The reduction runs are deleted with the same conditions as they were found with.
+"""
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from autoreduce_db.reduction_viewer.models import ReductionRun, RunNumber
+
+logger = logging.getLogger(__name__)
+
+REMOVED = "removed"
+NOT_FOUND = "not_found"
+FAILED = "failed"
+
+
+def chunks(items: list, size: int) -> Iterator[list]:
+    """Yields consecutive slices of the items with at most size items each."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def find_reduction_runs(instrument: str, runs: List[int], batch: bool,
+                        chunk_size: int) -> Dict[int, List[Tuple[int, int]]]:
+    """
+    Finds the reduction runs to remove for each of the runs, with a query per chunk of runs.
+
+    Returns:
+        The primary key and version of each reduction run found, keyed by the requested run,
+        the latest reduction run first
+    """
+    found = defaultdict(list)
+    for chunk in chunks(runs, chunk_size):
+        if batch:
+            records = ReductionRun.objects \
+                .filter(pk__in=chunk, instrument__name=instrument, batch_run=True) \
+                .values_list("pk", "pk", "run_version")
+        else:
+            records = RunNumber.objects \
+                .filter(run_number__in=chunk, reduction_run__instrument__name=instrument) \
+                .order_by("-reduction_run__created") \
+                .values_list("run_number", "reduction_run_id", "reduction_run__run_version")
+        for run, reduction_run_id, run_version in records:
+            found[run].append((reduction_run_id, run_version))
+    return found
+
+
+def delete_reduction_runs(instrument: str, reduction_run_ids: List[int], batch: bool,
+                          chunk_size: int) -> Dict[int, str]:
+    """
+    Deletes the reduction runs of the instrument, or its batch runs if batch is True, and the records that
+    depend on them, a chunk at a time. A chunk that cannot be deleted is rolled back on its own and does not
+    stop the others.
+
+    Returns:
+        The error of each reduction run that could not be deleted, keyed by its primary key
+    """
+    reduction_runs = ReductionRun.objects.filter(instrument__name=instrument)
+    if batch:
+        reduction_runs = reduction_runs.filter(batch_run=True)
+    errors = {}
+    for chunk in chunks(reduction_run_ids, chunk_size):
+        try:
+            with transaction.atomic():
+                reduction_runs.filter(pk__in=chunk).delete()
+        except DatabaseError as err:
+            logger.error("Could not delete the reduction runs %s: %s", chunk, err)
+            errors.update((reduction_run_id, str(err)) for reduction_run_id in chunk)
+    return errors
+
+
+def remove_runs_in_bulk(instrument: str,
+                        runs: Iterable[int],
+                        batch: bool = False,
+                        chunk_size: Optional[int] = None) -> List[dict]:
+    """
+    Removes every version of the runs from the database.
+
+    Args:
+        instrument: The name of the instrument of the runs
+        runs: The run numbers to remove, or if batch is True the primary keys of the batch runs of the instrument
+        batch: Whether the runs are batch runs
+        chunk_size: The number of runs looked up, and of reduction runs deleted, at once.
+                    Defaults to the AUTOREDUCE_REMOVAL_CHUNK_SIZE setting
+
+    Returns:
+        For each run, in the order of the runs, its status and the versions that were found
+    """
+    chunk_size = chunk_size or settings.AUTOREDUCE_REMOVAL_CHUNK_SIZE
+    instrument = instrument.upper()
+    runs = list(runs)
+    found = find_reduction_runs(instrument, runs, batch, chunk_size)
+    # a batch run is found once for each of the requested runs that it covers
+    reduction_run_ids = list(dict.fromkeys(reduction_run_id for run in runs for reduction_run_id, _ in found[run]))
+    errors = delete_reduction_runs(instrument, reduction_run_ids, batch, chunk_size)
+
+    report = []
+    for run in runs:
+        if not found[run]:
+            report.append({"run_number": run, "status": NOT_FOUND})
+            continue
+        result = {"run_number": run, "status": REMOVED, "versions": sorted(version for _, version in found[run])}
+        error = next((errors[reduction_run_id] for reduction_run_id, _ in found[run] if reduction_run_id in errors),
+                     None)
+        if error is not None:
+            result.update(status=FAILED, error=error)
+        report.append(result)
+    return report
@@ -0,0 +1,212 @@
+"""
+Lists the reduction runs of an instrument, for GET requests to /api/runs/<instrument>.
+
+The runs are returned newest first, a page at a time. Each page links to the next with a cursor holding
+the last primary key of the page, so that a page is found through the index however deep it is, and
+runs created between two requests do not shift the pages.
+
+Responses carry an ETag and a Last-Modified date derived from the number of runs that match the query
+and the latest time one of them was updated. A poller that sends them back gets a 304 for the cost of
+that single aggregate query, until a run is created, updated through the ORM or removed.
+"""
+import base64
+import binascii
+import hashlib
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.http import QueryDict
+
+from autoreduce_db.reduction_viewer.models import ReductionRun, RunNumber, Status
+
+from autoreduce_rest_api.runs.run_ranges import parse_runs, too_many_runs_message
+
+# the fields that can be selected, with the column each is read from
+FIELDS = {
+    "id": "id",
+    "run_version": "run_version",
+    "status": "status__value",
+    "run_title": "run_title",
+    "run_description": "run_description",
+    "batch_run": "batch_run",
+    "started_by": "started_by",
+    "rb_number": "experiment__reference_number",
+    "created": "created",
+    "started": "started",
+    "finished": "finished",
+    "last_updated": "last_updated",
+}
+# selected with a query of their own, as a run has several
+RUN_NUMBERS_FIELD = "run_numbers"
+STATUSES = dict(Status.STATUS_CHOICES)
+
+INVALID_CURSOR_MESSAGE = "Invalid cursor, use the 'next' link of the previous page"
+INVALID_FIELDS_MESSAGE = f"'fields' must be a comma separated list of {', '.join([*FIELDS, RUN_NUMBERS_FIELD])}"
+INVALID_STATUS_MESSAGE = f"'status' must be a comma separated list of {', '.join(STATUSES.values())}"
+
+
+def encode_cursor(pk: int) -> str:
+    """Returns the cursor of the page that follows the run with the primary key."""
+    return base64.urlsafe_b64encode(str(pk).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Returns the primary key held by the cursor.
+
+    Raises:
+        ValueError: if the cursor was not returned by encode_cursor
+    """
+    try:
+        pk = int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, UnicodeError, ValueError) as err:
+        raise ValueError(INVALID_CURSOR_MESSAGE) from err
+    if pk < 1:
+        raise ValueError(INVALID_CURSOR_MESSAGE)
+    return pk
+
+
+def run_number_filter(runs: str) -> Q:
+    """
+    Returns the filter of the run numbers covered by a range expression. Each contiguous range is
+    a single condition, however long, while the runs of a range with a step are listed.
+
+    Raises:
+        ValueError: if the expression is not valid, or lists more than AUTOREDUCE_MAX_RUNS runs
+    """
+    ranges = parse_runs(runs)
+    if sum(len(run_range) for run_range in ranges if run_range.step != 1) > settings.AUTOREDUCE_MAX_RUNS:
+        raise ValueError(too_many_runs_message(settings.AUTOREDUCE_MAX_RUNS))
+    condition = Q()
+    for run_range in ranges:
+        if run_range.step == 1:
+            condition |= Q(run_number__range=(run_range.start, run_range[-1]))
+        else:
+            condition |= Q(run_number__in=list(run_range))
+    return condition
+
+
+class RunListQuery:
+    """
+    The runs asked for by the query parameters of a GET request.
+
+    Query parameters:
+        runs: Only the runs with these run numbers, as a range expression such as "100-200,210"
+        status: Only the runs with one of these comma separated statuses, e.g. "Queued,Processing"
+        fields: The comma separated fields returned for each run, all of them by default
+        limit: The number of runs in a page
+        cursor: The position of the page, taken from the 'next' link of the previous page
+
+    Raises:
+        ValueError: if any of the parameters is not valid
+    """
+
+    def __init__(self, instrument: str, params: QueryDict):
+        self.params = params
+        self.fields = self._parse_fields(params.get("fields"))
+        self.limit = self._parse_limit(params.get("limit"))
+        self.cursor = decode_cursor(params["cursor"]) if params.get("cursor") else None
+
+        runs = ReductionRun.objects.filter(instrument__name=instrument.upper())
+        if params.get("runs"):
+            runs = runs.filter(
+                pk__in=RunNumber.objects.filter(run_number_filter(params["runs"])).values("reduction_run_id"))
+        if params.get("status"):
+            runs = runs.filter(status__value__in=self._parse_statuses(params["status"]))
+        self.runs = runs
+
+    @staticmethod
+    def _parse_fields(fields: Optional[str]) -> list:
+        if not fields:
+            return [*FIELDS, RUN_NUMBERS_FIELD]
+        fields = [field.strip() for field in fields.split(",")]
+        if not all(field in FIELDS or field == RUN_NUMBERS_FIELD for field in fields):
+            raise ValueError(INVALID_FIELDS_MESSAGE)
+        return list(dict.fromkeys(fields))
+
+    @staticmethod
+    def _parse_limit(limit: Optional[str]) -> int:
+        if limit is None:
+            return settings.AUTOREDUCE_RUN_LIST_PAGE_SIZE
+        max_limit = settings.AUTOREDUCE_RUN_LIST_MAX_PAGE_SIZE
+        if not limit.isdigit() or not 0 < int(limit) <= max_limit:
+            raise ValueError(f"'limit' must be between 1 and {max_limit}")
+        return int(limit)
+
+    @staticmethod
+    def _parse_statuses(statuses: str) -> list:
+        values = {verbose.lower(): value for value, verbose in STATUSES.items()}
+        try:
+            return [values[status.strip().lower()] for status in statuses.split(",")]
+        except KeyError as err:
+            raise ValueError(INVALID_STATUS_MESSAGE) from err
+
+    def state(self) -> dict:
+        """Returns the number of matching runs and the latest time one of them was updated."""
+        return self.runs.aggregate(count=Count("pk"), last_updated=Max("last_updated"))
+
+    def page(self, path: str) -> dict:
+        """
+        Returns the runs of the page, and the link to the next page or None if this is the last one.
+        Only the selected fields are read from the database.
+        """
+        columns = [FIELDS[field] for field in self.fields if field in FIELDS]
+        runs = self.runs.select_related(*{column.split("__")[0] for column in columns if "__" in column}) \
+            .only("id", *columns) \
+            .order_by("-pk")
+        if self.cursor is not None:
+            runs = runs.filter(pk__lt=self.cursor)
+        runs = list(runs[:self.limit + 1])
+        next_link = None
+        if len(runs) > self.limit:
+            runs = runs[:self.limit]
+            params = self.params.copy()
+            params["cursor"] = encode_cursor(runs[-1].pk)
+            next_link = f"{path}?{params.urlencode()}"
+
+        run_numbers = {}
+        if RUN_NUMBERS_FIELD in self.fields:
+            for reduction_run_id, run_number in RunNumber.objects \
+                    .filter(reduction_run_id__in=[run.pk for run in runs]) \
+                    .order_by("run_number") \
+                    .values_list("reduction_run_id", "run_number"):
+                run_numbers.setdefault(reduction_run_id, []).append(run_number)
+        return {"runs": [self._run_dict(run, run_numbers) for run in runs], "next": next_link}
+
+    def _run_dict(self, run: ReductionRun, run_numbers: dict) -> dict:
+        result = {}
+        for field in self.fields:
+            if field == RUN_NUMBERS_FIELD:
+                result[field] = run_numbers.get(run.pk, [])
+                continue
+            value = run
+            for attribute in FIELDS[field].split("__"):
+                value = getattr(value, attribute)
+            result[field] = STATUSES.get(value, value) if field == "status" else value
+        return result
+
+
+def get_state(request, instrument: str) -> Optional[dict]:
+    """Returns the state of the runs asked for by the request, or None if the request is not valid."""
+    if not hasattr(request, "run_list_state"):
+        try:
+            request.run_list_state = RunListQuery(instrument, request.GET).state()
+        except ValueError:
+            request.run_list_state = None
+    return request.run_list_state
+
+
+def run_list_etag(request, instrument: str) -> Optional[str]:
+    """Returns the ETag of the response to the request, which changes whenever the matching runs change."""
+    state = get_state(request, instrument)
+    if state is None:
+        return None
+    last_updated = state["last_updated"].isoformat() if state["last_updated"] else ""
+    return hashlib.sha256(f"{request.get_full_path()}|{state['count']}|{last_updated}".encode()).hexdigest()
+
+
+def run_list_last_modified(request, instrument: str):
+    """Returns the latest time one of the runs asked for by the request was updated."""
+    state = get_state(request, instrument)
+    return state["last_updated"] if state is not None else None
@@ -0,0 +1,106 @@
+"""
+Expansion of the run numbers given in a request.
+
+The 'runs' of a request can be a run number, a range expression, or a list of either. A range expression
+is a comma separated list of run numbers, ranges and ranges with a step, e.g. "63125-64000,64010,64020-64100:2".
+
+The expression is checked, and the number of runs it covers is counted, before any run is expanded, so
+that an invalid or oversized request is rejected as a whole. The runs are then generated one at a time,
+in the order given and without duplicates.
+"""
+import re
+from typing import Iterator, List, Optional
+
+from django.conf import settings
+
+# a run number, or a start and inclusive end with an optional step
+RANGE_PATTERN = re.compile(r"^\s*(\d+)\s*(?:-\s*(\d+)\s*(?::\s*(\d+)\s*)?)?$")
+INVALID_RUNS_MESSAGE = "'runs' must be a run number, a range expression or a non-empty list of either"
+
+
+def invalid_range_message(expression: str) -> str:
+    """Returns the message describing why a range expression is invalid."""
+    return (f"Invalid run range '{expression}', expected run numbers or ranges separated by commas, "
+            "such as 100,105-110 or 200-300:2")
+
+
+def too_many_runs_message(max_runs: int) -> str:
+    """Returns the message of a request with more runs than allowed."""
+    return f"'runs' covers more than {max_runs} runs"
+
+
+def parse_expression(expression: str) -> List[range]:
+    """
+    Parses a range expression into the ranges of runs it covers.
+
+    Raises:
+        ValueError: if the expression is not valid
+    """
+    ranges = []
+    for item in expression.split(","):
+        match = RANGE_PATTERN.match(item)
+        if match is None:
+            raise ValueError(invalid_range_message(expression))
+        start, end, step = match.groups()
+        start = int(start)
+        end = int(end) if end is not None else start
+        step = int(step) if step is not None else 1
+        if end < start or step < 1:
+            raise ValueError(invalid_range_message(expression))
+        ranges.append(range(start, end + 1, step))
+    return ranges
+
+
+def parse_runs(runs) -> List[range]:
+    """
+    Parses the 'runs' of a request into the ranges of runs it covers.
+
+    Raises:
+        ValueError: if the runs are not valid
+    """
+    items = runs if isinstance(runs, list) else [runs]
+    if not items:
+        raise ValueError(INVALID_RUNS_MESSAGE)
+    ranges = []
+    for item in items:
+        if isinstance(item, bool):
+            raise ValueError(INVALID_RUNS_MESSAGE)
+        if isinstance(item, int) and item >= 0:
+            ranges.append(range(item, item + 1))
+        elif isinstance(item, str):
+            ranges.extend(parse_expression(item))
+        else:
+            raise ValueError(INVALID_RUNS_MESSAGE)
+    return ranges
+
+
+def expand_runs(runs, max_runs: Optional[int] = None) -> Iterator[int]:
+    """
+    Checks the 'runs' of a request, and returns a generator of its run numbers.
+
+    Args:
+        runs: A run number, a range expression, or a list of either
+        max_runs: The number of runs, duplicates included, above which the runs are rejected.
+                  Defaults to the AUTOREDUCE_MAX_RUNS setting
+
+    Returns:
+        A generator of the run numbers, in the order given and without duplicates
+
+    Raises:
+        ValueError: if the runs are not valid or there are too many, before any run is generated
+    """
+    max_runs = max_runs or settings.AUTOREDUCE_MAX_RUNS
+    ranges = parse_runs(runs)
+    if sum(len(run_range) for run_range in ranges) > max_runs:
+        raise ValueError(too_many_runs_message(max_runs))
+    return unique_runs(ranges)
+
+
+def unique_runs(ranges: List[range]) -> Iterator[int]:
+    """Yields the run numbers of the ranges, skipping those that have already been yielded."""
+    seen = set()
+    for run_range in ranges:
+        for run_number in run_range:
+            if run_number not in seen:
+                seen.add(run_number)
+                yield run_number
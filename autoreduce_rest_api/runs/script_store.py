@@ -0,0 +1,137 @@
+"""
+Content-addressed store of the reduction scripts sent with the submissions.
+
+A custom reduction_script is sent inline with each submission, so resubmitting thousands of runs
+with the same script in several requests carries it in every request. A script can instead be
+uploaded once to /api/scripts, which returns the SHA-256 of its content, and the submissions can
+then refer to it with reduction_script_hash. The store is deduplicated by that hash, so uploading
+the same script again stores nothing new.
+
+The scripts are kept in an LRU layer in this process, bounded by AUTOREDUCE_SCRIPT_STORE_SIZE bytes.
+The "django" backend also stores them in a Django cache, for every process to find the scripts
+uploaded to any of them and to find them again once evicted from the LRU layer. With the "local"
+backend, a script evicted from the LRU layer is lost, and a submission referring to it is rejected
+until it is uploaded again.
+
+The messages published for the runs still hold the script itself, as the queue processor expects it.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+BOTH_SCRIPTS_MESSAGE = "Only one of 'reduction_script' and 'reduction_script_hash' can be given"
+UNKNOWN_SCRIPT_MESSAGE = "No reduction script is stored with this hash, upload it to /api/scripts first"
+
+
+def script_hash(script: str) -> str:
+    """Returns the hash that the script is stored with: the hex SHA-256 of its UTF-8 encoding."""
+    return hashlib.sha256(script.encode()).hexdigest()
+
+
+class ScriptStore:
+    """Thread-safe store of scripts keyed by their hash, with an LRU layer bounded by the size of the scripts."""
+
+    def __init__(self, max_size: int, max_script_size: int, backend: str = "local", alias: str = "default"):
+        """
+        Args:
+            max_size: Number of bytes of scripts kept by the LRU layer
+            max_script_size: Number of bytes above which a script is not accepted
+            backend: "local" to keep the scripts in this process only, "django" to also store them in a Django cache
+            alias: The Django cache used by the "django" backend
+        """
+        if backend not in ("local", "django"):
+            raise ValueError(f"Unknown {type(self).__name__} backend '{backend}'")
+        self.backend = backend
+        self.max_size = max_size
+        self.max_script_size = max_script_size
+        self._alias = alias
+        self._scripts = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _django_key(key: str) -> str:
+        return f"autoreduce_rest_api:script:{key}"
+
+    def _keep(self, key: str, script: str):
+        """Keeps the script in the LRU layer, evicting the least recently used scripts over its size."""
+        with self._lock:
+            if key not in self._scripts:
+                self._scripts[key] = script
+                self._size += len(script.encode())
+            self._scripts.move_to_end(key)
+            while self._size > self.max_size and self._scripts:
+                _, evicted = self._scripts.popitem(last=False)
+                self._size -= len(evicted.encode())
+
+    def put(self, script: str) -> Tuple[str, bool]:
+        """
+        Stores the script, unless it is already stored.
+
+        Returns:
+            The hash of the script, and whether it was not already stored
+
+        Raises:
+            ValueError: if the script is larger than the store accepts
+        """
+        size = len(script.encode())
+        if size > self.max_script_size:
+            raise ValueError(f"The script is {size} bytes, over the limit of {self.max_script_size} bytes")
+        key = script_hash(script)
+        created = self.get(key) is None
+        self._keep(key, script)
+        if self.backend == "django":
+            # set again even if it was found in the LRU layer, in case the Django cache has evicted it
+            caches[self._alias].set(self._django_key(key), script, timeout=None)
+        return key, created
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the script stored with the hash, or None if there is none."""
+        with self._lock:
+            script = self._scripts.get(key)
+            if script is not None:
+                self._scripts.move_to_end(key)
+                return script
+        if self.backend != "django":
+            return None
+        script = caches[self._alias].get(self._django_key(key))
+        if script is not None:
+            self._keep(key, script)
+        return script
+
+    def clear(self):
+        """Removes all the scripts from the LRU layer."""
+        with self._lock:
+            self._scripts.clear()
+            self._size = 0
+
+
+script_store = ScriptStore(max_size=settings.AUTOREDUCE_SCRIPT_STORE_SIZE,
+                           max_script_size=settings.AUTOREDUCE_SCRIPT_MAX_SIZE,
+                           backend=settings.AUTOREDUCE_SCRIPT_STORE_BACKEND,
+                           alias=settings.AUTOREDUCE_SCRIPT_STORE_ALIAS)
+
+
+def resolve_reduction_script(data: dict) -> Optional[str]:
+    """
+    Returns the reduction script of a submission, given inline as reduction_script or
+    by the hash of a stored script as reduction_script_hash, or None if it has neither.
+
+    Raises:
+        ValueError: if both are given, or there is no script stored with the hash
+    """
+    key = data.get("reduction_script_hash")
+    if key is None:
+        return data.get("reduction_script")
+    if data.get("reduction_script") is not None:
+        raise ValueError(BOTH_SCRIPTS_MESSAGE)
+    script = script_store.get(key) if isinstance(key, str) and HASH_PATTERN.match(key) else None
+    if script is None:
+        raise ValueError(UNKNOWN_SCRIPT_MESSAGE)
+    return script
@@ -0,0 +1,82 @@
+"""
+The autoreduce_scripts modules that submit the runs, loaded on first use.
+
+Importing manual_submission pulls in h5py and numpy, the ICAT client and pydantic, which took most of
+the time and memory of starting the API although only the submissions need them. The modules are
+proxied here instead, and imported when one of their attributes is first used, so that the processes
+that never submit a run, such as the management commands, do not load them.
+
+The server loads them before serving with the warmup command, which hurricane runs before its startup
+probe reports that the server has started:
+
+    autoreduce-rest-api-manage serve --command warmup
+
+The time taken by each step of the warm-up is logged, and recorded in the startup metrics.
+"""
+import importlib
+import logging
+import sys
+import time
+from typing import Callable, Optional
+
+from django.utils.functional import SimpleLazyObject
+
+from autoreduce_rest_api.runs.metrics import STARTUP_DURATION, instrument_scripts
+from autoreduce_rest_api.runs.publishing import kafka_producer
+
+logger = logging.getLogger(__name__)
+
+
+def timed_step(step: str, func: Callable):
+    """Runs a step of the startup, recording and logging the time it took and the modules it imported."""
+    modules = len(sys.modules)
+    start = time.perf_counter()
+    result = func()
+    duration = time.perf_counter() - start
+    STARTUP_DURATION.labels(step).set(duration)
+    logger.info("Startup step %s took %.0f ms and imported %d modules", step, duration * 1000,
+                len(sys.modules) - modules)
+    return result
+
+
+def lazy_module(name: str, prepare: Optional[Callable] = None) -> SimpleLazyObject:
+    """
+    Returns a proxy of the module, which imports it when one of its attributes is first used.
+
+    Args:
+        name: The name of the module
+        prepare: Called with the module once it has been imported
+    """
+
+    def load():
+        module = importlib.import_module(name)
+        if prepare is not None:
+            prepare(module)
+        return module
+
+    return SimpleLazyObject(lambda: timed_step(name.rsplit(".", 1)[-1], load))
+
+
+manual_submission = lazy_module("autoreduce_scripts.manual_operations.manual_submission", prepare=instrument_scripts)
+manual_batch_submit = lazy_module("autoreduce_scripts.manual_operations.manual_batch_submit")
+
+
+def warm_up() -> float:
+    """
+    Loads the modules of the submissions and creates the Kafka producer, so that the first requests
+    do not wait for them.
+
+    Returns:
+        The time the warm-up took, in seconds
+
+    Raises:
+        RuntimeError: if the Kafka producer cannot be created
+    """
+    start = time.perf_counter()
+    for module in (manual_submission, manual_batch_submit):
+        # using an attribute of a proxy imports its module
+        getattr(module, "__name__")
+    timed_step("kafka_producer", kafka_producer.get)
+    duration = time.perf_counter() - start
+    STARTUP_DURATION.labels("warmup").set(duration)
+    return duration
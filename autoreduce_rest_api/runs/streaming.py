@@ -0,0 +1,137 @@
+"""
+Newline delimited JSON responses, which report the outcome of each run as soon as it is known.
+
+Every line is a JSON object with a "type". There is a "run" line for each run, in the order of the runs,
+followed by a "summary" line, or by an "error" line if the submission stopped part way.
+
+The lines are sent as they are produced by the WSGI servers that stream responses, such as gunicorn,
+and by the ASGI servers through the application of asgi.py, which produces them in a thread pool rather
+than in the event loop (see async_views.StreamingASGIHandler). Hurricane serves the API through Tornado's
+WSGI container, which collects the whole body before sending it, so under hurricane, as in the container
+image, the client receives all of the lines at once, once the submission has finished. The progress is only
+streamed when the API is served through asgi.py.
+
+DRF only lets a request reach the views if one of their renderers accepts its Accept header, so the views
+that stream have NDJSONRenderer among them.
+"""
+import itertools
+import json
+from typing import Iterable, Iterator
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http.response import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+from autoreduce_rest_api.runs.publishing import request_publisher
+from autoreduce_rest_api.runs.submission import (EMPTY_BATCH_MESSAGE, RunResult, SubmissionError, iter_lookups,
+                                                 publish_batch)
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+# status of the runs of a batch that have been found, as they are not submitted on their own
+FOUND = "found"
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders the DRF responses, such as the errors raised by the authentication and the parsers, as a single line.
+    The views stream their own lines instead, but need the renderer for DRF to accept the media type.
+    """
+
+    media_type = NDJSON_CONTENT_TYPE
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, _accepted_media_type=None, _renderer_context=None):
+        return b"" if data is None else (json.dumps(data, cls=DjangoJSONEncoder) + "\n").encode()
+
+
+def accepts_ndjson(request) -> bool:
+    """Returns whether the request's Accept header asks for newline delimited JSON."""
+    accept = request.META.get("HTTP_ACCEPT", "")
+    return any(media_range.split(";")[0].strip() == NDJSON_CONTENT_TYPE for media_range in accept.split(","))
+
+
+def ndjson_response(lines: Iterable[dict]) -> StreamingHttpResponse:
+    """Returns a response that sends each of the lines as soon as it is produced."""
+    response = StreamingHttpResponse((json.dumps(line, cls=DjangoJSONEncoder) + "\n" for line in lines),
+                                     content_type=NDJSON_CONTENT_TYPE)
+    # stops proxies such as nginx from holding the lines back until the response is complete
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def prime(items: Iterator) -> Iterator:
+    """
+    Starts a generator, so that the errors it raises before its first item, such as failing to create the
+    Kafka producer, are raised while an error response can still be returned instead of the stream.
+
+    Returns:
+        An iterator over all of the items of the generator
+    """
+    try:
+        first = next(items)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first], items)
+
+
+def run_line(result: RunResult) -> dict:
+    """Returns the line of a run, with the message that was published if it was submitted."""
+    line = {"type": "run", **result.to_dict()}
+    if result.message is not None:
+        line["message"] = result.message
+    return line
+
+
+def submission_lines(results: Iterable[RunResult]) -> Iterator[dict]:
+    """
+    Yields a line for each run submitted by iter_submissions, then a summary with the number of runs
+    that were submitted, skipped and failed.
+    """
+    counts = {RunResult.SUBMITTED: 0, RunResult.SKIPPED: 0, RunResult.FAILED: 0}
+    try:
+        for result in results:
+            counts[result.status] += 1
+            yield run_line(result)
+    except RuntimeError as err:
+        yield {"type": "error", "error": str(err)}
+        return
+    yield {"type": "summary", **counts}
+
+
+def batch_lines(instrument: str, runs: Iterable, **kwargs) -> Iterator[dict]:
+    """
+    Yields a line for each run of a batch as it is looked up, then publishes the batch and yields
+    a summary with the message that was published.
+
+    Args:
+        instrument: The name of the instrument
+        runs: The run numbers of the batch
+        kwargs: The arguments of the batch, passed on to publish_batch
+
+    Raises:
+        RuntimeError: if there are no runs or the producer cannot be created, before the first line
+    """
+    instrument = instrument.upper()
+    runs = list(runs)
+    if not runs:
+        raise RuntimeError(EMPTY_BATCH_MESSAGE)
+    publisher = request_publisher()
+
+    lookups = []
+    for run_number, run_data, error in iter_lookups(instrument, runs):
+        lookups.append((run_number, run_data, error))
+        if error is None:
+            yield {"type": "run", "run_number": run_number, "status": FOUND}
+        else:
+            yield run_line(RunResult(run_number, RunResult.FAILED, error=error))
+    try:
+        message = publish_batch(publisher, instrument, lookups, **kwargs)
+    except SubmissionError as err:
+        yield {"type": "error", "error": str(err), "failed_runs": [result.to_dict() for result in err.failed_runs]}
+        return
+    except RuntimeError as err:
+        yield {"type": "error", "error": str(err)}
+        return
+    yield {"type": "summary", "submitted_runs": message}
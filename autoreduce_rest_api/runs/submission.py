@@ -0,0 +1,500 @@
+"""
+Submits runs with their ICAT and datafile lookups spread over a pool of threads.
+
+The lookups are I/O bound and independent of each other, so they are made concurrently, on the threads
+of a pool shared by the requests of the process and sized by AUTOREDUCE_LOOKUP_THREADS. The threads live
+as long as the process, so that, as the request threads do, they keep their database connection from one
+lookup to the next for AUTOREDUCE_DB_CONN_MAX_AGE seconds (see connections), and close it when it exits.
+No more than AUTOREDUCE_INSTRUMENT_CONCURRENCY lookups of an instrument are given to the pool at once, and
+the others are held back until one of them finishes, so that a large submission to one instrument never
+takes the threads that the lookups of the other instruments are waiting for.
+The messages are still published in the order in which the runs were requested, through the
+producer shared by the process, and the submission waits for them to be delivered once, at the end.
+"""
+import atexit
+import contextvars
+import logging
+import queue
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from autoreduce_db.reduction_viewer.models import DataLocation, RunNumber
+
+from autoreduce_rest_api.runs.cache import run_metadata_cache
+from autoreduce_rest_api.runs.connections import close_unusable_connections
+from autoreduce_rest_api.runs.metrics import time_stage
+from autoreduce_rest_api.runs.publishing import RequestPublisher, request_publisher
+from autoreduce_rest_api.runs.scripts import manual_batch_submit, manual_submission
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOFTWARE = {"name": "Mantid", "version": "latest"}
+EMPTY_BATCH_MESSAGE = "No runs to submit in the batch"
+MISMATCHING_RB_NUMBERS_MESSAGE = "Submitted runs have mismatching RB numbers"
+
+
+class RunResult:
+    """
+    The outcome of submitting a single run.
+
+    Attributes:
+        run_number: The run number that was requested
+        status: One of SUBMITTED, SKIPPED or FAILED
+        message: The dict representation of the message that was published, if the run was submitted
+        error: Why the run could not be submitted, if it failed
+    """
+    SUBMITTED = "submitted"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+
+    def __init__(self, run_number, status: str, message: Optional[dict] = None, error: Optional[str] = None):
+        self.run_number = run_number
+        self.status = status
+        self.message = message
+        self.error = error
+
+    def to_dict(self) -> dict:
+        """Returns a JSON serialisable representation of the result, without the submitted message."""
+        result = {"run_number": self.run_number, "status": self.status}
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+class SubmissionError(RuntimeError):
+    """Raised when a submission fails because of some of its runs."""
+
+    def __init__(self, message: str, failed_runs: List[RunResult]):
+        super().__init__(message)
+        self.failed_runs = failed_runs
+
+
+class LookupPool:
+    """
+    Threads that run the lookups of every request, started on first use and kept until the process exits,
+    each handling its database connections as Django handles those of a request thread.
+    """
+
+    def __init__(self, max_workers: int):
+        """
+        Args:
+            max_workers: The number of threads, which is the most lookups made at once by the process
+        """
+        self.max_workers = max_workers
+        self._tasks: queue.SimpleQueue = queue.SimpleQueue()
+        self._threads: List[threading.Thread] = []
+        self._shutdown_at_exit = False
+        self._lock = threading.Lock()
+
+    def submit(self, func: Callable, *args) -> Future:
+        """Returns a future of the result of the function, called with the arguments by one of the threads."""
+        future = Future()
+        with self._lock:
+            if not self._threads:
+                self._start()
+            self._tasks.put((future, func, args))
+        return future
+
+    def _start(self):
+        for index in range(self.max_workers):
+            thread = threading.Thread(target=self._work, name=f"lookup-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if not self._shutdown_at_exit:
+            self._shutdown_at_exit = True
+            atexit.register(self.shutdown)
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                try:
+                    connections.close_all()
+                except Exception:  # pylint:disable=broad-except
+                    logger.exception("Could not close the database connections of %s", threading.current_thread().name)
+                return
+            future, func, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                close_unusable_connections()
+                result = func(*args)
+            except BaseException as err:  # pylint:disable=broad-except
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+            finally:
+                self._close_old_connections()
+
+    @staticmethod
+    def _close_old_connections():
+        """Closes the connections older than CONN_MAX_AGE, without stopping the thread if that fails."""
+        try:
+            close_old_connections()
+        except Exception:  # pylint:disable=broad-except
+            logger.exception("Could not close the database connections of %s", threading.current_thread().name)
+
+    def shutdown(self):
+        """Stops the threads once they have run the lookups already submitted, closing their connections."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+            for _ in threads:
+                self._tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+
+lookup_pool = LookupPool(max_workers=settings.AUTOREDUCE_LOOKUP_THREADS)
+
+
+class InstrumentLimiter:
+    """
+    Caps the lookups of each instrument given to the lookup pool at the same time, across all the requests.
+    The lookups over the cap are held back until one of the instrument's lookups finishes, rather than
+    given to the pool to wait in its threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # only for the instruments with lookups in flight, as the names come from the clients
+        self._in_flight: Dict[str, int] = {}
+        self._held: Dict[str, deque] = {}
+
+    def submit(self, instrument: str, func: Callable, *args) -> Future:
+        """
+        Returns a future of the result of the function, called with the arguments on the lookup pool
+        once fewer than AUTOREDUCE_INSTRUMENT_CONCURRENCY lookups of the instrument are in flight.
+        """
+        future = Future()
+        with self._lock:
+            if self._in_flight.get(instrument, 0) >= settings.AUTOREDUCE_INSTRUMENT_CONCURRENCY:
+                self._held.setdefault(instrument, deque()).append((future, func, args))
+                return future
+            self._in_flight[instrument] = self._in_flight.get(instrument, 0) + 1
+        future.set_running_or_notify_cancel()
+        self._start(instrument, future, func, args)
+        return future
+
+    def in_flight(self, instrument: str) -> int:
+        """Returns the number of lookups of the instrument given to the pool and not yet finished."""
+        with self._lock:
+            return self._in_flight.get(instrument, 0)
+
+    def _start(self, instrument: str, future: Future, func: Callable, args: tuple):
+        lookup_pool.submit(func, *args).add_done_callback(partial(self._finish, instrument, future))
+
+    def _finish(self, instrument: str, future: Future, lookup: Future):
+        self._release(instrument)
+        if lookup.exception() is not None:
+            future.set_exception(lookup.exception())
+        else:
+            future.set_result(lookup.result())
+
+    def _release(self, instrument: str):
+        """Gives the place of a finished lookup to the next lookup of the instrument held back and not cancelled."""
+        while True:
+            with self._lock:
+                held = self._held.get(instrument)
+                if not held:
+                    self._in_flight[instrument] -= 1
+                    if not self._in_flight[instrument]:
+                        del self._in_flight[instrument]
+                    return
+                future, func, args = held.popleft()
+                if not held:
+                    del self._held[instrument]
+            if future.set_running_or_notify_cancel():
+                self._start(instrument, future, func, args)
+                return
+
+
+instrument_limiter = InstrumentLimiter()
+
+
+@time_stage("prefetch")
+def prefetch_run_data(instrument_runs: Dict[str, Iterable[int]]) -> Dict[str, Dict[int, Tuple[str, str, str]]]:
+    """
+    Retrieves the data location, RB number and title of the runs that are already in the database,
+    for all of the instruments at once. This replaces the query made for each run by
+    manual_submission.get_run_data_from_database with two queries in total.
+
+    Args:
+        instrument_runs: The run numbers to look for, keyed by the upper case instrument name
+
+    Returns:
+        The data file location, RB number and run title of each run found, keyed by instrument then run number
+    """
+    instrument_runs = {instrument: set(runs) for instrument, runs in instrument_runs.items()}
+    all_run_numbers = set().union(*instrument_runs.values())
+    # the lowest run version first, as get_run_data_from_database takes the first one
+    run_number_records = RunNumber.objects \
+        .filter(run_number__in=all_run_numbers,
+                reduction_run__batch_run=False,
+                reduction_run__instrument__name__in=list(instrument_runs)) \
+        .select_related("reduction_run__experiment", "reduction_run__instrument") \
+        .order_by("reduction_run__run_version")
+
+    found = {}
+    for record in run_number_records:
+        key = (record.reduction_run.instrument.name, record.run_number)
+        if record.run_number in instrument_runs[key[0]] and key not in found:
+            found[key] = record.reduction_run
+
+    data_locations = {}
+    for data_location in DataLocation.objects \
+            .filter(reduction_run__in=[reduction_run.pk for reduction_run in found.values()]) \
+            .order_by("pk"):
+        data_locations.setdefault(data_location.reduction_run_id, data_location.file_path)
+
+    run_data = defaultdict(dict)
+    for (instrument, run_number), reduction_run in found.items():
+        if reduction_run.pk in data_locations:
+            run_data[instrument][run_number] = (data_locations[reduction_run.pk],
+                                                str(reduction_run.experiment.reference_number), reduction_run.run_title)
+    return dict(run_data)
+
+
+def lookup_run(instrument: str, run_number, known_runs: Optional[dict] = None) -> Tuple[str, str, str]:
+    """
+    Retrieves the data location, RB number and title of a run. Called from the lookup threads.
+
+    The result is cached as it does not change once the run exists, so resubmitting
+    the run does not go to the database and ICAT again.
+
+    Args:
+        instrument: The name of the instrument
+        run_number: The run number to look up
+        known_runs: Run data that has already been retrieved, keyed by run number
+
+    Returns:
+        The data file location, RB number and run title
+    """
+    if known_runs and run_number in known_runs:
+        return known_runs[run_number]
+    run_data = run_metadata_cache.get(instrument, run_number)
+    if run_data is not None:
+        return run_data
+    with time_stage("lookup"):
+        run_data = manual_submission.get_run_data(instrument, run_number, "nxs")
+    location, rb_num, _ = run_data
+    if location and rb_num:
+        run_metadata_cache.set(instrument, run_number, run_data)
+    return run_data
+
+
+def iter_lookups(instrument: str,
+                 runs: List,
+                 max_workers: Optional[int] = None,
+                 known_runs: Optional[dict] = None) -> Iterator[Tuple[object, Optional[Tuple], Optional[str]]]:
+    """
+    Looks up the runs concurrently on the lookup pool, within the cap of the instrument,
+    yielding the results in the order of the runs.
+
+    Args:
+        instrument: The name of the instrument
+        runs: The run numbers to look up
+        max_workers: The number of lookups of these runs made at the same time.
+                     Defaults to the AUTOREDUCE_SUBMISSION_WORKERS setting
+        known_runs: Run data that has already been retrieved, keyed by run number
+
+    Yields:
+        The run number, the result of the lookup or None if it failed, and the error message if it failed
+    """
+    max_workers = max_workers or settings.AUTOREDUCE_SUBMISSION_WORKERS
+    futures: Dict[int, Future] = {}
+
+    def submit(index: int):
+        if index < len(runs):
+            # in a copy of the context of the request, for the queries to count towards its budget
+            futures[index] = instrument_limiter.submit(instrument,
+                                                       contextvars.copy_context().run, lookup_run, instrument,
+                                                       runs[index], known_runs)
+
+    for index in range(max_workers):
+        submit(index)
+    try:
+        for index, run_number in enumerate(runs):
+            future = futures.pop(index)
+            # keeps max_workers lookups of the runs going, so that the pool is shared fairly between requests
+            submit(index + max_workers)
+            try:
+                yield run_number, future.result(), None
+            except (RuntimeError, ValueError) as err:
+                yield run_number, None, str(err)
+    finally:
+        # stop the lookups that are held back if the caller stopped early
+        for future in futures.values():
+            future.cancel()
+
+
+# pylint:disable=too-many-locals,too-many-arguments
+def iter_submissions(instrument: str,
+                     runs: Iterable,
+                     software: Optional[dict] = None,
+                     reduction_script: Optional[str] = None,
+                     reduction_arguments: Optional[dict] = None,
+                     user_id=-1,
+                     description="",
+                     max_workers: Optional[int] = None,
+                     known_runs: Optional[dict] = None,
+                     publisher: Optional[RequestPublisher] = None) -> Iterator[RunResult]:
+    """
+    Submits each of the runs separately, as manual_submission.main does.
+
+    A run that cannot be found or categorised is reported as failed or skipped
+    and does not stop the remaining runs from being submitted.
+
+    Args:
+        instrument: The name of the instrument to submit the runs for
+        runs: The run numbers to submit
+        software: The software to be used for reduction
+        reduction_script: The reduction script to be used
+        reduction_arguments: The arguments to be passed to the reduction script
+        user_id: The user ID that submitted the request
+        description: A custom description of the runs
+        max_workers: The number of lookups made at the same time
+        known_runs: Run data that has already been retrieved, keyed by run number
+        publisher: The publisher of the request, which the caller flushes once it has published all of its
+                   messages. If None, the runs are published through a publisher of their own, flushed here
+
+    Yields:
+        The result of each run, in the order of the runs, once its message has been published.
+        The messages are only known to have been delivered once all the results have been yielded,
+        or once the caller has flushed its publisher
+
+    Raises:
+        RuntimeError: if the messages cannot be published or delivered
+    """
+    instrument = instrument.upper()
+    if not isinstance(runs, Iterable):
+        runs = [runs]
+    runs = list(runs)
+    flush = publisher is None
+    if flush:
+        publisher = request_publisher()
+
+    for run_number, run_data, error in iter_lookups(instrument, runs, max_workers, known_runs):
+        if error is not None:
+            yield RunResult(run_number, RunResult.FAILED, error=error)
+            continue
+        location, rb_num, run_title = run_data
+        if not location and not rb_num:
+            logger.error("Unable to find RB number and location for %s%s", instrument, run_number)
+            yield RunResult(run_number, RunResult.SKIPPED, error="Unable to find RB number and location")
+            continue
+        try:
+            category = manual_submission.categorize_rb_number(rb_num)
+            logger.info("Run is in category %s", category)
+        except RuntimeError as err:
+            logger.warning("Could not categorize the run due to an invalid RB number. It will be not be submitted.")
+            yield RunResult(run_number, RunResult.SKIPPED, error=str(err))
+            continue
+
+        with time_stage("publish"):
+            message = manual_submission.submit_run(publisher,
+                                                   rb_num,
+                                                   instrument,
+                                                   location,
+                                                   run_number,
+                                                   run_title=run_title,
+                                                   software=software,
+                                                   reduction_script=reduction_script,
+                                                   reduction_arguments=reduction_arguments,
+                                                   user_id=user_id,
+                                                   description=description)
+        yield RunResult(run_number, RunResult.SUBMITTED, message=message)
+    if flush:
+        with time_stage("flush"):
+            publisher.flush()
+
+
+def submit_batch(instrument: str,
+                 runs: Iterable,
+                 software: Optional[dict] = None,
+                 reduction_script: Optional[str] = None,
+                 reduction_arguments: Optional[dict] = None,
+                 user_id=-1,
+                 description="",
+                 max_workers: Optional[int] = None) -> dict:
+    """
+    Submits the runs as a single batch reduction, as manual_batch_submit.main does.
+
+    Returns:
+        The dict representation of the message that was published
+
+    Raises:
+        SubmissionError: if any of the runs could not be looked up
+        RuntimeError: if the runs have mismatching RB numbers or the message cannot be published
+    """
+    instrument = instrument.upper()
+    runs = list(runs)
+    if not runs:
+        raise RuntimeError(EMPTY_BATCH_MESSAGE)
+    return publish_batch(request_publisher(),
+                         instrument,
+                         list(iter_lookups(instrument, runs, max_workers)),
+                         software=software,
+                         reduction_script=reduction_script,
+                         reduction_arguments=reduction_arguments,
+                         user_id=user_id,
+                         description=description)
+
+
+def publish_batch(publisher: RequestPublisher,
+                  instrument: str,
+                  lookups: List[Tuple[object, Optional[Tuple], Optional[str]]],
+                  software: Optional[dict] = None,
+                  reduction_script: Optional[str] = None,
+                  reduction_arguments: Optional[dict] = None,
+                  user_id=-1,
+                  description="") -> dict:
+    """
+    Publishes a batch reduction of runs that have already been looked up, and waits for it to be delivered.
+
+    Args:
+        publisher: The publisher of the request
+        instrument: The name of the instrument, in upper case
+        lookups: What iter_lookups yielded for each of the runs of the batch
+
+    Returns:
+        The dict representation of the message that was published
+
+    Raises:
+        SubmissionError: if any of the runs could not be looked up
+        RuntimeError: if the runs have mismatching RB numbers or the message cannot be published or delivered
+    """
+    runs, locations, rb_numbers, titles, failed = [], [], [], [], []
+    for run_number, run_data, error in lookups:
+        if error is not None:
+            failed.append(RunResult(run_number, RunResult.FAILED, error=error))
+            continue
+        location, rb_num, run_title = run_data
+        runs.append(run_number)
+        locations.append(location)
+        rb_numbers.append(rb_num)
+        titles.append(run_title)
+    if failed:
+        raise SubmissionError(f"Could not look up {len(failed)} of the runs in the batch", failed)
+    if not manual_batch_submit.all_equal(rb_numbers):
+        raise RuntimeError(MISMATCHING_RB_NUMBERS_MESSAGE)
+    with time_stage("publish"):
+        message = manual_submission.submit_run(publisher,
+                                               rb_numbers[0],
+                                               instrument,
+                                               locations,
+                                               runs,
+                                               run_title=titles,
+                                               software=software,
+                                               reduction_script=reduction_script,
+                                               reduction_arguments=reduction_arguments,
+                                               user_id=user_id,
+                                               description=description)
+    with time_stage("flush"):
+        publisher.flush()
+    return message
@@ -0,0 +1,100 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the asynchronous run views."""
+import asyncio
+import threading
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, TransactionTestCase
+from rest_framework.authtoken.models import Token
+
+from autoreduce_rest_api.runs.async_views import INVALID_JSON_MESSAGE
+from autoreduce_rest_api.runs.removal import REMOVED
+from autoreduce_rest_api.runs.submission import RunResult
+from autoreduce_rest_api.runs.views import NO_RUNS_KEY_MESSAGE
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+# the views run in their own threads, which only see the data of committed transactions
+class AsyncViewsTest(TransactionTestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        self.token = Token.objects.create(user=get_user_model().objects.first())
+        self.client = AsyncClient()
+
+    async def post(self, url: str, data, authorization=None):
+        """Posts the data as JSON, authenticated with the test user's token unless another header is given."""
+        return await self.client.post(url,
+                                      data,
+                                      content_type="application/json",
+                                      authorization=f"Token {self.token}" if authorization is None else authorization)
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions",
+           return_value=[RunResult(1, RunResult.SUBMITTED, message={"run_number": 1})])
+    async def test_submit_runs(self, iter_submissions: Mock):
+        """Test that the runs are submitted and that the response is that of the sync view."""
+        response = await self.post(f"/api/async/runs/{INSTRUMENT_NAME}", {"runs": [1]})
+        assert response.status_code == 200
+        assert response.json() == {"submitted_runs": [{"run_number": 1}], "failed_runs": []}
+        instrument, runs = iter_submissions.call_args[0]
+        assert (instrument, list(runs)) == (INSTRUMENT_NAME, [1])
+
+    @patch("autoreduce_rest_api.runs.views.remove_runs_in_bulk",
+           return_value=[{
+               "run_number": 1,
+               "status": REMOVED,
+               "versions": [0]
+           }])
+    async def test_delete_batch(self, remove_runs_in_bulk: Mock):
+        """Test that a batch run is removed."""
+        response = await self.client.delete(f"/api/async/runs/batch/{INSTRUMENT_NAME}", {"runs": [1]},
+                                            content_type="application/json",
+                                            authorization=f"Token {self.token}")
+        assert response.status_code == 200
+        assert response.json()["removed_runs"] == [1]
+        instrument, runs = remove_runs_in_bulk.call_args.args
+        assert (instrument, list(runs), remove_runs_in_bulk.call_args.kwargs) == (INSTRUMENT_NAME, [1], {"batch": True})
+
+    async def test_invalid_body(self):
+        """Test that a body without runs, or that is not a JSON object, is rejected."""
+        for data, expected_error in (({}, NO_RUNS_KEY_MESSAGE), ("not json", INVALID_JSON_MESSAGE),
+                                     ([1, 2], INVALID_JSON_MESSAGE)):
+            response = await self.post(f"/api/async/runs/{INSTRUMENT_NAME}", data)
+            assert response.status_code == 400
+            assert response.json()["error"] == expected_error
+
+    async def test_requires_token(self):
+        """Test that requests without a valid token are rejected."""
+        for authorization in ("", "Token invalid"):
+            response = await self.post(f"/api/async/runs/{INSTRUMENT_NAME}", {"runs": [1]}, authorization)
+            assert response.status_code == 401
+
+    async def test_method_not_allowed(self):
+        """Test that only the methods of the sync view are allowed."""
+        response = await self.client.get(f"/api/async/runs/{INSTRUMENT_NAME}", authorization=f"Token {self.token}")
+        assert response.status_code == 405
+
+    async def test_requests_are_concurrent(self):
+        """Test that a request does not wait for the submission of another to finish."""
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_for_other_request(_instrument, runs, **_kwargs):
+            # raises BrokenBarrierError if the requests are made one after the other
+            barrier.wait()
+            return [RunResult(run, RunResult.SUBMITTED, message={"run_number": run}) for run in runs]
+
+        with patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=wait_for_other_request):
+            responses = await asyncio.gather(self.post(f"/api/async/runs/{INSTRUMENT_NAME}", {"runs": [1]}),
+                                             self.post(f"/api/async/runs/{INSTRUMENT_NAME}", {"runs": [2]}))
+        assert [response.json()["submitted_runs"] for response in responses] == [[{
+            "run_number": 1
+        }], [{
+            "run_number": 2
+        }]]
@@ -0,0 +1,74 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the cached token authentication."""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.cache import TokenCache, token_cache
+
+# answered without any query of its own, so only the authentication can query the database
+JOB_URL = "/api/jobs/unknown"
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        self.user = get_user_model().objects.first()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token}")
+
+    def test_cached_token_does_not_query(self):
+        """Test that the database is only queried the first time a token is used."""
+        with self.assertNumQueries(1):
+            assert self.client.get(JOB_URL).status_code == 404
+        with self.assertNumQueries(0):
+            assert self.client.get(JOB_URL).status_code == 404
+        assert self.client.get("/api/cache/tokens").json()["hits"] == 2
+
+    def test_deleted_token_is_rejected(self):
+        """Test that a token stops authenticating as soon as it is deleted."""
+        assert self.client.get(JOB_URL).status_code == 404
+        self.token.delete()
+        assert self.client.get(JOB_URL).status_code == 401
+
+    def test_deactivated_user_is_rejected(self):
+        """Test that the token of a user stops authenticating as soon as the user is deactivated."""
+        assert self.client.get(JOB_URL).status_code == 404
+        self.user.is_active = False
+        self.user.save()
+        assert self.client.get(JOB_URL).status_code == 401
+
+    def test_invalid_token_is_not_cached(self):
+        """Test that unknown tokens are rejected and not cached."""
+        self.client.credentials(HTTP_AUTHORIZATION="Token invalid")
+        assert self.client.get(JOB_URL).status_code == 401
+        assert not token_cache.stats()["entries"]
+
+
+class TokenCacheTest(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    @parameterized.expand([["local"], ["django"]])
+    def test_invalidate(self, backend: str):
+        """Test that invalidated tokens are no longer returned by each backend."""
+        tokens = TokenCache(max_entries=10, ttl=60, backend=backend)
+        tokens.set("a", ("user a", "token a"))
+        tokens.set("b", ("user b", "token b"))
+        assert tokens.get("a") == ("user a", "token a")
+        tokens.invalidate(["a"])
+        assert tokens.get("a") is None
+        assert tokens.get("b") == ("user b", "token b")
+        assert (tokens.hits, tokens.misses) == (2, 1)
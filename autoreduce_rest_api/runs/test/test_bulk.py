@@ -0,0 +1,215 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for submitting runs of several instruments in one request."""
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.bulk import validate_entry
+from autoreduce_rest_api.runs.cache import run_metadata_cache
+from autoreduce_rest_api.runs.run_ranges import INVALID_RUNS_MESSAGE
+from autoreduce_rest_api.runs.script_store import UNKNOWN_SCRIPT_MESSAGE
+from autoreduce_rest_api.runs.submission import RunResult, prefetch_run_data
+from autoreduce_rest_api.runs.test.utils import create_reduction_run
+from autoreduce_rest_api.runs.views import INVALID_ENTRIES_MESSAGE, NO_ENTRIES_KEY_MESSAGE
+
+
+class BulkSubmitTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        run_metadata_cache.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    @parameterized.expand([
+        [[], "Entry must be an object"],
+        [{
+            "runs": [1]
+        }, "'instrument' must be a non-empty string"],
+        [{
+            "instrument": "MARI"
+        }, "No 'runs' key specified"],
+        [{
+            "instrument": "MARI",
+            "runs": [1.5]
+        }, INVALID_RUNS_MESSAGE],
+        [{
+            "instrument": "MARI",
+            "runs": [1],
+            "user_id": "1"
+        }, "'user_id' must be of type int"],
+        [{
+            "instrument": "MARI",
+            "runs": [1],
+            "software": {
+                "name": "Mantid"
+            }
+        }, "'software' must have a 'name' and a 'version'"],
+        [{
+            "instrument": "MARI",
+            "runs": 1,
+            "software": {
+                "name": "Mantid",
+                "version": "6.0"
+            }
+        }, None],
+        [{
+            "instrument": "MARI",
+            "runs": [1],
+            "reduction_script_hash": "0" * 64
+        }, UNKNOWN_SCRIPT_MESSAGE],
+    ])
+    def test_validate_entry(self, entry, expected_error):
+        """Test that malformed entries are described."""
+        assert validate_entry(entry) == expected_error
+
+    def test_prefetch_run_data(self):
+        """Test that the runs of all the instruments are found with a fixed number of queries."""
+        create_reduction_run("MARI", 1, run_version=1, rb_number=2)
+        create_reduction_run("MARI", 1, run_version=0, rb_number=1)
+        create_reduction_run("MARI", 2)
+        create_reduction_run("MARI", [3, 4], batch_run=True)
+        create_reduction_run("WISH", 1, rb_number=3)
+        with self.assertNumQueries(2):
+            run_data = prefetch_run_data({"MARI": [1, 3, 5], "WISH": [1]})
+        assert run_data == {
+            "MARI": {
+                1: ("/tmp/MARI1.nxs", "1", "Title 1")
+            },
+            "WISH": {
+                1: ("/tmp/WISH1.nxs", "3", "Title 1")
+            },
+        }
+
+    @patch("autoreduce_rest_api.runs.bulk.iter_submissions")
+    def test_invalid_entry_submits_nothing(self, iter_submissions: Mock):
+        """Test that an invalid entry stops all of the entries from being submitted."""
+        response = self.client.post("/api/bulk/runs",
+                                    {"entries": [{
+                                        "instrument": "MARI",
+                                        "runs": [1]
+                                    }, {
+                                        "instrument": "WISH"
+                                    }]},
+                                    format="json")
+        assert response.status_code == 400
+        assert response.json() == {"error": INVALID_ENTRIES_MESSAGE, "entries": {"1": "No 'runs' key specified"}}
+        iter_submissions.assert_not_called()
+
+    def test_instrument_named_bulk(self):
+        """Test that an instrument named bulk is reached through the run routes."""
+        create_reduction_run("BULK", 1)
+        response = self.client.get("/api/runs/bulk")
+        assert response.status_code == 200
+        assert [run["run_numbers"] for run in response.json()["runs"]] == [[1]]
+
+    def test_no_entries(self):
+        """Test that a request without entries is rejected."""
+        response = self.client.post("/api/bulk/runs", {"entries": []}, format="json")
+        assert response.status_code == 400
+        assert response.json()["error"] == NO_ENTRIES_KEY_MESSAGE
+
+    @patch("autoreduce_scripts.manual_operations.manual_submission.submit_run",
+           side_effect=lambda publisher, rb_number, instrument, location, run_number, **kwargs: {
+               "instrument": instrument,
+               "run_number": run_number,
+               "rb_number": rb_number
+           })
+    @patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data",
+           return_value=("/tmp/WISH2.nxs", "3", "Title"))
+    def test_submits_each_entry(self, get_run_data: Mock, _: Mock):
+        """Test that each entry is submitted and that runs already in the database are not looked up again."""
+        create_reduction_run("MARI", 1)
+        response = self.client.post(
+            "/api/bulk/runs",
+            {"entries": [{
+                "instrument": "mari",
+                "runs": [1]
+            }, {
+                "instrument": "WISH",
+                "runs": 2,
+                "user_id": 5
+            }]},
+            format="json")
+        assert response.status_code == 200
+        assert response.json()["results"] == [{
+            "instrument":
+            "MARI",
+            "submitted_runs": [{
+                "instrument": "MARI",
+                "run_number": 1,
+                "rb_number": "1234567"
+            }],
+            "failed_runs": []
+        }, {
+            "instrument":
+            "WISH",
+            "submitted_runs": [{
+                "instrument": "WISH",
+                "run_number": 2,
+                "rb_number": "3"
+            }],
+            "failed_runs": []
+        }]
+        get_run_data.assert_called_once_with("WISH", 2, "nxs")
+
+    @patch("autoreduce_rest_api.runs.bulk.iter_submissions")
+    def test_entry_failure_is_reported(self, iter_submissions: Mock):
+        """Test that an entry that cannot be submitted does not stop the other entries."""
+        iter_submissions.side_effect = [
+            RuntimeError("Producer not connected"), [RunResult(2, RunResult.FAILED, error="Not found")]
+        ]
+        response = self.client.post(
+            "/api/bulk/runs", {"entries": [{
+                "instrument": "MARI",
+                "runs": [1]
+            }, {
+                "instrument": "WISH",
+                "runs": [2]
+            }]},
+            format="json")
+        assert response.status_code == 200
+        assert response.json()["results"] == [{
+            "instrument": "MARI",
+            "error": "Producer not connected"
+        }, {
+            "instrument":
+            "WISH",
+            "submitted_runs": [],
+            "failed_runs": [{
+                "run_number": 2,
+                "status": RunResult.FAILED,
+                "error": "Not found"
+            }]
+        }]
+
+    @patch("autoreduce_rest_api.runs.bulk.request_publisher")
+    @patch("autoreduce_rest_api.runs.bulk.iter_submissions",
+           side_effect=lambda instrument, runs, **_: [RunResult(runs[0], RunResult.SUBMITTED, message={})])
+    def test_entries_share_publisher(self, iter_submissions: Mock, request_publisher: Mock):
+        """Test that the messages of all the entries are published through one publisher, flushed once."""
+        entries = [{"instrument": "MARI", "runs": [1]}, {"instrument": "WISH", "runs": [2]}]
+        assert self.client.post("/api/bulk/runs", {"entries": entries}, format="json").status_code == 200
+        publisher = request_publisher.return_value
+        assert [call.kwargs["publisher"] for call in iter_submissions.call_args_list] == [publisher, publisher]
+        publisher.flush.assert_called_once_with()
+
+        publisher.flush.side_effect = RuntimeError("1 of the messages could not be delivered")
+        response = self.client.post("/api/bulk/runs", {"entries": entries}, format="json")
+        assert response.json()["results"] == [{
+            "instrument": "MARI",
+            "error": "1 of the messages could not be delivered"
+        }, {
+            "instrument": "WISH",
+            "error": "1 of the messages could not be delivered"
+        }]
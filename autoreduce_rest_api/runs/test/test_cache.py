@@ -0,0 +1,139 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the run metadata cache."""
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.cache import LocalCache, RunMetadataCache, run_metadata_cache
+from autoreduce_rest_api.runs.submission import lookup_run
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+RUN_DATA = ("/tmp/location", "RB1234567", "Title")
+
+
+class LocalCacheTest(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        """Test that the entry that was used least recently is evicted first."""
+        local_cache = LocalCache(max_entries=2, ttl=60)
+        local_cache.set("a", 1)
+        local_cache.set("b", 2)
+        local_cache.get("a")
+        local_cache.set("c", 3)
+        assert local_cache.get("a") == 1
+        assert local_cache.get("b") is None
+        assert local_cache.get("c") == 3
+
+    @patch("autoreduce_rest_api.runs.cache.time.monotonic")
+    def test_entries_expire(self, monotonic: Mock):
+        """Test that entries are not returned after their TTL."""
+        monotonic.return_value = 100
+        local_cache = LocalCache(max_entries=2, ttl=60)
+        local_cache.set("a", 1)
+        monotonic.return_value = 159
+        assert local_cache.get("a") == 1
+        monotonic.return_value = 160
+        assert local_cache.get("a") is None
+        assert not local_cache
+
+
+class RunMetadataCacheTest(SimpleTestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    @parameterized.expand([["local"], ["django"]])
+    def test_counts_hits_and_misses(self, backend: str):
+        """Test that lookups are counted by each backend."""
+        metadata_cache = RunMetadataCache(max_entries=10, ttl=60, backend=backend)
+        assert metadata_cache.get(INSTRUMENT_NAME, 1) is None
+        metadata_cache.set(INSTRUMENT_NAME, 1, RUN_DATA)
+        assert metadata_cache.get(INSTRUMENT_NAME, 1) == RUN_DATA
+        stats = metadata_cache.stats()
+        assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+    @parameterized.expand([["local"], ["django"]])
+    def test_invalidate(self, backend: str):
+        """Test that single runs and whole instruments can be invalidated."""
+        metadata_cache = RunMetadataCache(max_entries=10, ttl=60, backend=backend)
+        for run_number in (1, 2, 3):
+            metadata_cache.set(INSTRUMENT_NAME, run_number, RUN_DATA)
+        metadata_cache.set("OTHER", 1, RUN_DATA)
+
+        metadata_cache.invalidate(INSTRUMENT_NAME, [1])
+        assert metadata_cache.get(INSTRUMENT_NAME, 1) is None
+        assert metadata_cache.get(INSTRUMENT_NAME, 2) == RUN_DATA
+
+        metadata_cache.invalidate(INSTRUMENT_NAME)
+        assert metadata_cache.get(INSTRUMENT_NAME, 2) is None
+        assert metadata_cache.get(INSTRUMENT_NAME, 3) is None
+        assert metadata_cache.get("OTHER", 1) == RUN_DATA
+
+    def test_disabled_cache_stores_nothing(self):
+        """Test that the 'none' backend never returns a value."""
+        metadata_cache = RunMetadataCache(max_entries=10, ttl=60, backend="none")
+        metadata_cache.set(INSTRUMENT_NAME, 1, RUN_DATA)
+        assert metadata_cache.get(INSTRUMENT_NAME, 1) is None
+
+    @patch("autoreduce_rest_api.runs.submission.close_old_connections", new=Mock())
+    @patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data", return_value=RUN_DATA)
+    def test_lookup_uses_cache(self, get_run_data: Mock):
+        """Test that a run is only looked up once while it is cached."""
+        run_metadata_cache.clear()
+        assert lookup_run(INSTRUMENT_NAME, 1) == RUN_DATA
+        assert lookup_run(INSTRUMENT_NAME, 1) == RUN_DATA
+        get_run_data.assert_called_once()
+
+    @patch("autoreduce_rest_api.runs.submission.close_old_connections", new=Mock())
+    @patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data", return_value=(None, None, None))
+    def test_lookup_does_not_cache_missing_runs(self, get_run_data: Mock):
+        """Test that a run without data is looked up again next time, as it may have been added since."""
+        run_metadata_cache.clear()
+        lookup_run(INSTRUMENT_NAME, 1)
+        lookup_run(INSTRUMENT_NAME, 1)
+        assert get_run_data.call_count == 2
+
+
+class RunMetadataCacheViewTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        run_metadata_cache.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    def test_invalidate_runs(self):
+        """Test that an admin can invalidate the cached runs of an instrument."""
+        run_metadata_cache.set(INSTRUMENT_NAME, 1, RUN_DATA)
+        run_metadata_cache.set(INSTRUMENT_NAME, 2, RUN_DATA)
+        response = self.client.delete(f"/api/cache/runs/{INSTRUMENT_NAME.lower()}", {"runs": [1]}, format="json")
+        assert response.status_code == 200
+        assert response.json() == {"instrument": INSTRUMENT_NAME, "invalidated_runs": [1]}
+        assert run_metadata_cache.get(INSTRUMENT_NAME, 1) is None
+        assert run_metadata_cache.get(INSTRUMENT_NAME, 2) == RUN_DATA
+        assert self.client.get("/api/cache/runs").json()["entries"] == 1
+
+    @parameterized.expand([["get", "/api/cache/runs", 200], ["delete", "/api/cache/runs", 405],
+                           ["get", f"/api/cache/runs/{INSTRUMENT_NAME}", 405],
+                           ["delete", f"/api/cache/runs/{INSTRUMENT_NAME}", 200]])
+    def test_methods(self, method: str, url: str, status: int):
+        """Test that the statistics are given for the whole cache, and the runs invalidated by instrument."""
+        assert getattr(self.client, method)(url).status_code == status
+
+    def test_requires_admin(self):
+        """Test that users that are not staff cannot use the endpoint."""
+        user = get_user_model().objects.create(username="not-staff")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user)}")
+        assert self.client.get("/api/cache/runs").status_code == 403
+        assert self.client.delete(f"/api/cache/runs/{INSTRUMENT_NAME}").status_code == 403
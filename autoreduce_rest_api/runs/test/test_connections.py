@@ -0,0 +1,76 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the management of the database connections and the query budget of the requests."""
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_db.reduction_viewer.models import ReductionRun
+
+from autoreduce_rest_api.runs.cache import token_cache
+from autoreduce_rest_api.runs.connections import QueryBudgetMiddleware, close_unusable_connections
+from autoreduce_rest_api.runs.submission import iter_lookups
+
+LOGGER = "autoreduce_rest_api.runs.connections"
+
+
+def query_run_data(_instrument, run_number, _file_ext):
+    """Looks a run up with a query, as get_run_data does."""
+    ReductionRun.objects.count()
+    return f"/tmp/{run_number}.nxs", "1234567", "Title"
+
+
+class QueryBudgetTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    @override_settings(AUTOREDUCE_QUERY_BUDGET=1)
+    def test_request_over_budget_is_logged(self):
+        """Test that a request making more queries than its budget is logged, and one within it is not."""
+        token_cache.clear()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=get_user_model().objects.first())}")
+        with self.assertLogs(LOGGER, "WARNING") as logs:
+            client.get("/api/runs/TESTINSTRUMENT")
+        assert logs.output[0].startswith(f"WARNING:{LOGGER}:GET /api/runs/TESTINSTRUMENT made ")
+        assert "over the budget of 1 queries" in logs.output[0]
+
+        with self.assertNoLogs(LOGGER, "WARNING"):
+            QueryBudgetMiddleware(lambda _request: HttpResponse())(RequestFactory().get("/"))
+
+    @override_settings(AUTOREDUCE_QUERY_BUDGET=2)
+    @patch("autoreduce_rest_api.runs.submission.close_old_connections")
+    @patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data", side_effect=query_run_data)
+    def test_lookup_threads_are_counted(self, _get_run_data, _close_old_connections):
+        """Test that the queries of the lookup threads count towards the budget of the request."""
+
+        def submit(_request):
+            list(iter_lookups("TESTINSTRUMENT", [1, 2, 3], max_workers=3))
+            return HttpResponse()
+
+        with self.assertLogs(LOGGER, "WARNING") as logs:
+            QueryBudgetMiddleware(submit)(RequestFactory().post("/api/runs/TESTINSTRUMENT"))
+        assert "made 3 queries" in logs.output[0]
+
+
+# the connection must not be in the transaction of a TestCase to be closed
+class HealthCheckTest(TransactionTestCase):
+
+    def test_unusable_connection_is_closed(self):
+        """Test that a connection that is no longer usable is closed, for the request to open another."""
+        connection.ensure_connection()
+        # the in-memory database of the tests is kept open by close
+        with patch.object(connection, "is_usable", return_value=False), patch.object(connection, "close") as close:
+            with override_settings(AUTOREDUCE_DB_HEALTH_CHECKS=False):
+                close_unusable_connections()
+            close.assert_not_called()
+            close_unusable_connections()
+        close.assert_called_once()
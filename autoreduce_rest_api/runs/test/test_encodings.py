@@ -0,0 +1,216 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the compressed and MessagePack request and response bodies."""
+import gzip
+import io
+import json
+from typing import Optional
+from unittest.mock import Mock, patch
+
+import msgpack
+import zstandard
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from parameterized import parameterized
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.encodings import (MSGPACK_CONTENT_TYPE, TRAILING_DATA_MESSAGE,
+                                                UNSUPPORTED_ENCODING_MESSAGE, DecodedStream, RequestTooLarge, compress,
+                                                compress_sequence, preferred, unpack)
+from autoreduce_rest_api.runs.streaming import NDJSON_CONTENT_TYPE
+from autoreduce_rest_api.runs.submission import RunResult
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+DATA = {"runs": list(range(1, 201)), "reduction_arguments": {"ei": 1.5, "monitors": [1, 2]}}
+
+
+def decompress(encoding: Optional[str], content: bytes) -> bytes:
+    """Returns the content decompressed with the content coding."""
+    if encoding == "gzip":
+        return gzip.decompress(content)
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(content), read_across_frames=True).read()
+    return content
+
+
+def submitted(_instrument, runs, **_kwargs):
+    """Submits every run."""
+    return iter([RunResult(run, RunResult.SUBMITTED, message={"run_number": run}) for run in runs])
+
+
+class PreferredTest(SimpleTestCase):
+
+    @parameterized.expand([
+        ["", None],
+        ["gzip", "gzip"],
+        ["gzip, deflate, br", "gzip"],
+        ["zstd, gzip", "zstd"],
+        ["gzip;q=0.5, zstd", "zstd"],
+        ["*", "zstd"],
+        ["*, zstd;q=0", "gzip"],
+        ["br", None],
+    ])
+    def test_accept_encoding(self, header: str, expected: Optional[str]):
+        """Test that the best compression the header accepts is chosen."""
+        assert preferred(header, ("zstd", "gzip")) == expected
+
+    @parameterized.expand([
+        ["*/*", "application/json"],
+        ["application/msgpack", "application/msgpack"],
+        ["application/msgpack, application/json", "application/msgpack"],
+        ["application/json;q=0.9, application/msgpack", "application/msgpack"],
+        ["application/*, application/msgpack;q=0.5", "application/json"],
+        ["text/html", None],
+    ])
+    def test_accept(self, header: str, expected: Optional[str]):
+        """Test that named media types are preferred over wildcards, then by their order in the header."""
+        assert preferred(header, ("application/json", "application/msgpack")) == expected
+
+
+class DecodingTest(SimpleTestCase):
+
+    @parameterized.expand([[["gzip"]], [["zstd"]], [["zstd", "gzip"]]])
+    def test_decoded_as_read(self, encodings: list):
+        """Test that the body is decoded a chunk at a time, through each of its content codings."""
+        content = msgpack.packb(DATA)
+        for encoding in encodings:
+            content = compress(encoding, content)
+        stream = DecodedStream(io.BytesIO(content), encodings, max_size=len(msgpack.packb(DATA)))
+        assert len(stream.read(10)) == 10
+        assert stream.size == 10
+        stream = DecodedStream(io.BytesIO(content), encodings, max_size=len(msgpack.packb(DATA)))
+        assert unpack(stream) == DATA
+
+    def test_too_large(self):
+        """Test that a body that decodes to more than the limit is rejected, without decoding all of it."""
+        stream = DecodedStream(io.BytesIO(compress("gzip", b" " * 10**7)), ["gzip"], max_size=1000)
+        with self.assertRaises(RequestTooLarge):
+            stream.read()
+        assert stream.size < 10**6
+
+    @parameterized.expand([["gzip"], ["zstd"]])
+    def test_corrupted(self, encoding: str):
+        """Test that a body that cannot be decoded is a parse error."""
+        with self.assertRaisesRegex(exceptions.ParseError, f"Cannot decode the {encoding} body"):
+            DecodedStream(io.BytesIO(b"not compressed"), [encoding], max_size=1000).read()
+
+    @parameterized.expand([[b"", "No more data"], [msgpack.packb({}) + msgpack.packb([]), TRAILING_DATA_MESSAGE]])
+    def test_not_one_object(self, content: bytes, error: str):
+        """Test that a MessagePack body must hold a single object."""
+        with self.assertRaisesRegex(exceptions.ParseError, error):
+            unpack(io.BytesIO(content))
+
+    def test_streaming_compression(self):
+        """Test that each chunk of a stream can be decompressed as soon as it is sent."""
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        chunks = compress_sequence("zstd", (f"line {number}\n".encode() for number in range(3)))
+        assert [decompressor.decompress(chunk) for chunk in chunks] == [b"line 0\n", b"line 1\n", b"line 2\n", b""]
+
+
+@patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=submitted)
+class EncodedViewsTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    @parameterized.expand([
+        ["application/json", None],
+        [MSGPACK_CONTENT_TYPE, None],
+        ["application/json", "gzip"],
+        [MSGPACK_CONTENT_TYPE, "zstd"],
+    ])
+    def test_request_and_response(self, _: Mock, media_type: str, encoding: Optional[str]):
+        """Test that a body in each of the encodings is parsed, and that the response is given in the same one."""
+        content = msgpack.packb(DATA) if media_type == MSGPACK_CONTENT_TYPE else json.dumps(DATA).encode()
+        headers = {"HTTP_ACCEPT": media_type}
+        if encoding is not None:
+            content = compress(encoding, content)
+            headers.update(HTTP_CONTENT_ENCODING=encoding, HTTP_ACCEPT_ENCODING=encoding)
+        response = self.client.post(f"/api/runs/{INSTRUMENT_NAME}", content, content_type=media_type, **headers)
+        assert response.status_code == 200
+        assert response["Content-Type"] == media_type
+        assert response.get("Content-Encoding") == encoding
+        assert "Accept" in response["Vary"]
+        content = decompress(encoding, response.content)
+        data = msgpack.unpackb(content) if media_type == MSGPACK_CONTENT_TYPE else json.loads(content)
+        assert [run["run_number"] for run in data["submitted_runs"]] == DATA["runs"]
+
+    def test_small_response_not_compressed(self, _: Mock):
+        """Test that a response below the size at which compression pays off is sent as it is."""
+        response = self.client.post(f"/api/runs/{INSTRUMENT_NAME}", {"runs": [1]},
+                                    format="json",
+                                    HTTP_ACCEPT_ENCODING="gzip")
+        assert response.status_code == 200
+        assert not response.has_header("Content-Encoding")
+
+    def test_stream_compressed(self, _: Mock):
+        """Test that the newline delimited JSON stream is compressed."""
+        response = self.client.post(f"/api/runs/{INSTRUMENT_NAME}",
+                                    DATA,
+                                    format="json",
+                                    HTTP_ACCEPT=NDJSON_CONTENT_TYPE,
+                                    HTTP_ACCEPT_ENCODING="gzip")
+        assert response["Content-Encoding"] == "gzip"
+        lines = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+        assert len(lines) == len(DATA["runs"]) + 1
+        assert json.loads(lines[-1])["type"] == "summary"
+
+    def test_unsupported_encoding(self, iter_submissions: Mock):
+        """Test that a body with an encoding that cannot be decoded is rejected."""
+        response = self.client.post(f"/api/runs/{INSTRUMENT_NAME}",
+                                    b"compressed",
+                                    content_type="application/json",
+                                    HTTP_CONTENT_ENCODING="br")
+        assert response.status_code == 415
+        assert response.json() == {"error": UNSUPPORTED_ENCODING_MESSAGE}
+        iter_submissions.assert_not_called()
+
+    @parameterized.expand([["gzip"], ["zstd"]])
+    def test_corrupted_body(self, _: Mock, encoding: str):
+        """Test that a body that cannot be decoded is rejected."""
+        response = self.client.post(f"/api/runs/{INSTRUMENT_NAME}",
+                                    b"not compressed",
+                                    content_type="application/json",
+                                    HTTP_CONTENT_ENCODING=encoding)
+        assert response.status_code == 400
+
+    @override_settings(AUTOREDUCE_MAX_DECODED_BODY_SIZE=100)
+    def test_body_too_large(self, iter_submissions: Mock):
+        """Test that a body that decodes to more than the limit is rejected."""
+        response = self.client.post(f"/api/runs/{INSTRUMENT_NAME}",
+                                    compress("gzip",
+                                             json.dumps(DATA).encode()),
+                                    content_type="application/json",
+                                    HTTP_CONTENT_ENCODING="gzip")
+        assert response.status_code == 413
+        iter_submissions.assert_not_called()
+
+
+# the views run in their own threads, which only see the data of committed transactions
+class EncodedAsyncViewsTest(TransactionTestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        self.token = Token.objects.create(user=get_user_model().objects.first())
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=submitted)
+    async def test_compressed_msgpack(self, _: Mock):
+        """Test that the asynchronous views parse and give the same encodings as the sync views."""
+        response = await AsyncClient().post(f"/api/async/runs/{INSTRUMENT_NAME}",
+                                            compress("zstd", msgpack.packb(DATA)),
+                                            content_type=MSGPACK_CONTENT_TYPE,
+                                            authorization=f"Token {self.token}",
+                                            content_encoding="zstd",
+                                            accept=MSGPACK_CONTENT_TYPE)
+        assert response.status_code == 200
+        data = msgpack.unpackb(response.content)
+        assert [run["run_number"] for run in data["submitted_runs"]] == DATA["runs"]
@@ -0,0 +1,211 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the Idempotency-Key support of the submission views."""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest.mock import Mock, patch
+
+import msgpack
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.cache import idempotency_cache
+from autoreduce_rest_api.runs.encodings import MSGPACK_CONTENT_TYPE
+from autoreduce_rest_api.runs.idempotency import (IN_PROGRESS_MESSAGE, KEY_REUSED_MESSAGE, NOT_COMPLETED_MESSAGE,
+                                                  _in_flight)
+from autoreduce_rest_api.runs.jobs import JobQueueFull
+from autoreduce_rest_api.runs.streaming import NDJSON_CONTENT_TYPE
+from autoreduce_rest_api.runs.submission import RunResult
+
+URL = "/api/runs/testinstrument"
+ASYNC_URL = "/api/async/runs/testinstrument"
+RESULTS = [RunResult(1, RunResult.SUBMITTED, message={"run_number": 1})]
+SUBMITTED = {"submitted_runs": [{"run_number": 1}], "failed_runs": []}
+
+
+class WaitedFuture(Future):
+    """A Future that records when a request starts waiting on it."""
+    waiting = threading.Event()
+
+    def result(self, timeout=None):
+        self.waiting.set()
+        return super().result(timeout)
+
+
+class IdempotencyTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        idempotency_cache.clear()
+        self.client = APIClient()
+        # avoids querying the database for the token, so that requests can be made from other threads
+        self.client.force_authenticate(user=get_user_model().objects.first())
+
+    def post_concurrently(self, submissions):
+        """Posts the same request twice, the second while the first is in flight, and returns their futures."""
+        started, release = threading.Event(), threading.Event()
+        WaitedFuture.waiting.clear()
+
+        def wait_for_release(*_, **__):
+            started.set()
+            release.wait(5)
+            return submissions()
+
+        with patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=wait_for_release) as submit, \
+                patch("autoreduce_rest_api.runs.idempotency.Future", new=WaitedFuture), \
+                ThreadPoolExecutor(2) as executor:
+            first = executor.submit(self.post, {"runs": [1]})
+            assert started.wait(5)
+            second = executor.submit(self.post, {"runs": [1]})
+            assert WaitedFuture.waiting.wait(5)
+            release.set()
+            second.result()
+            submit.assert_called_once()
+            return first, second
+
+    def post(self, data: dict, key: str = "key", **extra):
+        """Posts the runs to submit with the Idempotency-Key."""
+        return self.client.post(URL, data, format="json", HTTP_IDEMPOTENCY_KEY=key, **extra)
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", return_value=RESULTS)
+    def test_retry_is_replayed(self, iter_submissions: Mock):
+        """Test that a retry gets the first response back, without submitting the runs again."""
+        first = self.post({"runs": [1]})
+        retry = self.post({"runs": [1]})
+        assert first.status_code == retry.status_code == 200
+        assert retry.json() == first.json() == SUBMITTED
+        assert retry["Idempotent-Replayed"] == "true"
+        assert not first.has_header("Idempotent-Replayed")
+        iter_submissions.assert_called_once()
+
+        assert self.post({"runs": [1]}, key="other").status_code == 200
+        assert self.client.post(URL, {"runs": [1]}, format="json").status_code == 200
+        assert iter_submissions.call_count == 3
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", return_value=RESULTS)
+    def test_key_reused_for_other_body(self, iter_submissions: Mock):
+        """Test that a key cannot be reused for a request with a different body."""
+        assert self.post({"runs": [1]}).status_code == 200
+        response = self.post({"runs": [2]})
+        assert response.status_code == 422
+        assert response.json() == {"error": KEY_REUSED_MESSAGE}
+        iter_submissions.assert_called_once()
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", return_value=RESULTS)
+    def test_error_in_negotiated_media_type(self, _: Mock):
+        """Test that the errors of the keys are encoded as the other responses are."""
+        assert self.post({"runs": [1]}).status_code == 200
+        response = self.post({"runs": [2]}, HTTP_ACCEPT=MSGPACK_CONTENT_TYPE)
+        assert response["Content-Type"] == MSGPACK_CONTENT_TYPE
+        assert msgpack.unpackb(response.content) == {"error": KEY_REUSED_MESSAGE}
+
+    def test_invalid_key(self):
+        """Test that a key that is too long is rejected."""
+        assert self.post({"runs": [1]}, key="k" * 256).status_code == 400
+
+    @patch("autoreduce_rest_api.runs.views.job_manager.submit", side_effect=JobQueueFull)
+    def test_server_error_is_not_stored(self, submit: Mock):
+        """Test that a server error is not replayed, so that the request can be retried."""
+        assert self.post({"runs": [1], "async": True}).status_code == 503
+        assert self.post({"runs": [1], "async": True}).status_code == 503
+        assert submit.call_count == 2
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=lambda *_, **__: iter(RESULTS))
+    def test_stream_is_replayed(self, iter_submissions: Mock):
+        """Test that a streamed response is stored once it has been sent, and replayed in full."""
+        first = self.post({"runs": [1]}, HTTP_ACCEPT=NDJSON_CONTENT_TYPE)
+        content = b"".join(first.streaming_content)
+        retry = self.post({"runs": [1]}, HTTP_ACCEPT=NDJSON_CONTENT_TYPE)
+        assert retry.content == content
+        assert retry["Content-Type"] == NDJSON_CONTENT_TYPE
+        iter_submissions.assert_called_once()
+
+    def test_concurrent_requests_are_coalesced(self):
+        """Test that a request made while the first with the same key is in flight waits for its response."""
+        first, second = self.post_concurrently(lambda: RESULTS)
+        assert first.result().json() == second.result().json() == SUBMITTED
+        assert second.result()["Idempotent-Replayed"] == "true"
+
+    def test_waiters_retry_if_first_fails(self):
+        """Test that requests waiting on a request that raised are told to retry."""
+
+        def lose_connection():
+            raise ValueError("lost the connection")
+
+        # the test client would otherwise raise the exception of the first request from both
+        self.client.raise_request_exception = False
+        first, second = self.post_concurrently(lose_connection)
+        with self.assertRaises(ValueError):
+            first.result()
+        assert second.result().status_code == 409
+        assert second.result().json() == {"error": NOT_COMPLETED_MESSAGE}
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=lambda *_, **__: iter(RESULTS))
+    def test_stream_closed_before_sent(self, iter_submissions: Mock):
+        """Test that a stream closed before any of it was sent releases its key, so that it can be retried."""
+        self.post({"runs": [1]}, HTTP_ACCEPT=NDJSON_CONTENT_TYPE).close()
+        assert not _in_flight
+        retry = self.post({"runs": [1]})
+        assert retry.json() == SUBMITTED
+        assert not retry.has_header("Idempotent-Replayed")
+        assert iter_submissions.call_count == 2
+
+    @override_settings(AUTOREDUCE_IDEMPOTENCY_WAIT_TIMEOUT=0.01)
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", return_value=RESULTS)
+    def test_wait_times_out(self, iter_submissions: Mock):
+        """Test that a request waiting for longer than the timeout on the first request is rejected."""
+        scope = f"{get_user_model().objects.first().pk}:{URL}:key"
+        _in_flight[scope] = Future()
+        self.addCleanup(_in_flight.pop, scope)
+        response = self.post({"runs": [1]})
+        assert response.status_code == 409
+        assert response.json() == {"error": IN_PROGRESS_MESSAGE}
+        iter_submissions.assert_not_called()
+
+
+# the asynchronous views run in their own threads, which only see the data of committed transactions
+class AsyncIdempotencyTest(TransactionTestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        idempotency_cache.clear()
+        self.token = Token.objects.create(user=get_user_model().objects.first())
+        self.client = AsyncClient()
+
+    async def post(self, data: dict, key: str = "key"):
+        """Posts the runs to submit to the asynchronous view with the Idempotency-Key."""
+        return await self.client.post(ASYNC_URL,
+                                      data,
+                                      content_type="application/json",
+                                      authorization=f"Token {self.token}",
+                                      idempotency_key=key)
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", return_value=RESULTS)
+    async def test_retry_is_replayed(self, iter_submissions: Mock):
+        """Test that a retry to the asynchronous view gets the first response back."""
+        first = await self.post({"runs": [1]})
+        retry = await self.post({"runs": [1]})
+        assert retry.json() == first.json() == SUBMITTED
+        assert retry["Idempotent-Replayed"] == "true"
+        iter_submissions.assert_called_once()
+        assert (await self.post({"runs": [2]})).status_code == 422
+        assert (await self.post({"runs": [1]}, key="k" * 256)).status_code == 400
+
+    @override_settings(AUTOREDUCE_IDEMPOTENCY_WAIT_TIMEOUT=0.01)
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", return_value=RESULTS)
+    async def test_wait_times_out(self, iter_submissions: Mock):
+        """Test that a request waiting on the first request is rejected after the timeout, leaving it in flight."""
+        scope = f"{self.token.user_id}:{ASYNC_URL}:key"
+        future = _in_flight[scope] = Future()
+        self.addCleanup(_in_flight.pop, scope)
+        response = await self.post({"runs": [1]})
+        assert response.status_code == 409
+        assert response.json() == {"error": IN_PROGRESS_MESSAGE}
+        assert not future.cancelled()
+        iter_submissions.assert_not_called()
@@ -0,0 +1,125 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for submitting runs in background jobs."""
+import threading
+import time
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.jobs import Job, JobManager, JobQueueFull, job_manager
+from autoreduce_rest_api.runs.submission import RunResult
+from autoreduce_rest_api.runs.views import JOB_NOT_FOUND_MESSAGE
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+def wait_for_job(job: Job, timeout=10):
+    """Wait until the job has finished, or it times out."""
+    must_end = time.time() + timeout
+    while time.time() < must_end and not job.done:
+        time.sleep(0.01)
+    return job.done
+
+
+class JobManagerTest(SimpleTestCase):
+
+    def test_job_records_per_run_progress(self):
+        """Test that each run's outcome is recorded separately."""
+        manager = JobManager(max_workers=1, max_pending=1, max_retained=1)
+        job = Job(INSTRUMENT_NAME, [1, 2])
+
+        def func(job: Job):
+            job.record(RunResult(1, RunResult.SUBMITTED, message={"run_number": 1}))
+            job.record(RunResult(2, RunResult.FAILED, error="Test error"))
+
+        manager.submit(job, func)
+        assert wait_for_job(job)
+        result = job.to_dict()
+        assert result["status"] == Job.COMPLETED
+        assert result["progress"] == {"total": 2, "finished": 2}
+        assert result["runs"] == [{
+            "run_number": 1,
+            "status": RunResult.SUBMITTED
+        }, {
+            "run_number": 2,
+            "status": RunResult.FAILED,
+            "error": "Test error"
+        }]
+        assert result["submitted_runs"] == [{"run_number": 1}]
+
+    def test_unexpected_exception_fails_job(self):
+        """Test that an exception escaping the job marks it as failed instead of losing it."""
+        manager = JobManager(max_workers=1, max_pending=1, max_retained=1)
+        job = manager.submit(Job(INSTRUMENT_NAME, [1]), Mock(side_effect=ValueError("Test error")))
+        assert wait_for_job(job)
+        assert job.status == Job.FAILED
+        assert job.error == "Test error"
+
+    def test_rejects_jobs_above_pending_limit(self):
+        """Test that the number of unfinished jobs is bounded."""
+        manager = JobManager(max_workers=1, max_pending=1, max_retained=10)
+        release = threading.Event()
+        job = manager.submit(Job(INSTRUMENT_NAME, [1]), lambda job: release.wait(10))
+        with self.assertRaises(JobQueueFull):
+            manager.submit(Job(INSTRUMENT_NAME, [2]), Mock())
+        release.set()
+        assert wait_for_job(job)
+        manager.submit(Job(INSTRUMENT_NAME, [2]), Mock())
+
+    def test_discards_oldest_finished_jobs(self):
+        """Test that only the most recent jobs are retained."""
+        manager = JobManager(max_workers=1, max_pending=10, max_retained=1)
+        first = manager.submit(Job(INSTRUMENT_NAME, [1]), Mock())
+        assert wait_for_job(first)
+        second = manager.submit(Job(INSTRUMENT_NAME, [2]), Mock())
+        assert manager.get(first.job_id) is None
+        assert manager.get(second.job_id) is second
+
+
+class AsyncSubmissionViewTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions")
+    def test_async_post_returns_job_and_reports_progress(self, iter_submissions: Mock):
+        """Test that an async POST returns 202 straight away and the job status reports each run."""
+        iter_submissions.return_value = [
+            RunResult(63125, RunResult.SUBMITTED, message={"run_number": 63125}),
+            RunResult(63126, RunResult.FAILED, error="Test error"),
+        ]
+        response = self.client.post(f"/api/runs/{INSTRUMENT_NAME}", {
+            "runs": [63125, 63126],
+            "async": True
+        },
+                                    format="json")
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        assert response["Location"] == f"/api/jobs/{job_id}"
+        assert wait_for_job(job_manager.get(job_id))
+
+        response = self.client.get(f"/api/jobs/{job_id}")
+        assert response.status_code == 200
+        result = response.json()
+        assert result["status"] == Job.COMPLETED
+        assert [run["status"] for run in result["runs"]] == [RunResult.SUBMITTED, RunResult.FAILED]
+        assert result["submitted_runs"] == [{"run_number": 63125}]
+        iter_submissions.assert_called_once()
+        assert iter_submissions.call_args.args == (INSTRUMENT_NAME, [63125, 63126])
+
+    def test_unknown_job_returns_404(self):
+        """Test that querying an unknown job returns an error message."""
+        response = self.client.get("/api/jobs/unknown")
+        assert response.status_code == 404
+        assert response.json()["error"] == JOB_NOT_FOUND_MESSAGE
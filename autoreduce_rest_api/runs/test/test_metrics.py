@@ -0,0 +1,116 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the metrics of the run endpoints."""
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from prometheus_client import REGISTRY
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_db.reduction_viewer.models import Instrument
+from autoreduce_scripts.manual_operations import manual_submission
+
+from autoreduce_rest_api.runs.cache import run_metadata_cache
+from autoreduce_rest_api.runs.metrics import OTHER_INSTRUMENT, instrument_scripts
+from autoreduce_rest_api.runs.instruments import instrument_index
+from autoreduce_rest_api.runs.submission import RunResult, iter_submissions
+from autoreduce_rest_api.runs.test.utils import fake_get_run_data, fake_submit_run
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+def sample(name: str, **labels) -> float:
+    """Returns the current value of a sample, 0 if it has not been recorded yet."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def stage_count(stage: str) -> float:
+    """Returns the number of times the stage has been timed."""
+    return sample("autoreduce_rest_api_stage_duration_seconds_count", stage=stage)
+
+
+class RequestMetricsTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        instrument_index.clear()
+        Instrument.objects.create(name=INSTRUMENT_NAME)
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions",
+           return_value=[RunResult(1, RunResult.SUBMITTED, message={"run_number": 1})])
+    def test_records_requests(self, _: Mock):
+        """Test that requests are counted and timed by view, method, instrument and status."""
+        labels = {"view": "manage", "method": "POST", "instrument": INSTRUMENT_NAME}
+        requests = sample("autoreduce_rest_api_requests_total", **labels, status="200")
+        durations = sample("autoreduce_rest_api_request_duration_seconds_count", **labels)
+        in_flight = sample("autoreduce_rest_api_requests_in_flight", view="manage")
+
+        response = self.client.post(f"/api/runs/{INSTRUMENT_NAME.lower()}", {"runs": [1]}, format="json")
+
+        assert response.status_code == 200
+        assert sample("autoreduce_rest_api_requests_total", **labels, status="200") == requests + 1
+        assert sample("autoreduce_rest_api_request_duration_seconds_count", **labels) == durations + 1
+        assert sample("autoreduce_rest_api_requests_in_flight", view="manage") == in_flight
+
+    def test_unknown_instrument_label(self):
+        """Test that the requests for an instrument that is not in the instrument table are labelled other."""
+        labels = {"view": "manage", "method": "DELETE", "status": "400"}
+        requests = sample("autoreduce_rest_api_requests_total", **labels, instrument=OTHER_INSTRUMENT)
+        assert self.client.delete("/api/runs/unknown", {}, format="json").status_code == 400
+        assert sample("autoreduce_rest_api_requests_total", **labels, instrument=OTHER_INSTRUMENT) == requests + 1
+        assert not sample("autoreduce_rest_api_requests_total", **labels, instrument="UNKNOWN")
+
+    def test_unauthenticated_instrument_label(self):
+        """Test that the instrument of a request that was not authenticated is not used as a label."""
+        labels = {"view": "manage", "method": "DELETE", "status": "401"}
+        requests = sample("autoreduce_rest_api_requests_total", **labels, instrument=OTHER_INSTRUMENT)
+        assert APIClient().delete(f"/api/runs/{INSTRUMENT_NAME}", {}, format="json").status_code == 401
+        assert sample("autoreduce_rest_api_requests_total", **labels, instrument=OTHER_INSTRUMENT) == requests + 1
+        assert not sample("autoreduce_rest_api_requests_total", **labels, instrument=INSTRUMENT_NAME)
+
+    def test_records_error_status(self):
+        """Test that the status of responses that are not successful is recorded."""
+        labels = {"view": "job", "method": "GET", "instrument": "", "status": "404"}
+        requests = sample("autoreduce_rest_api_requests_total", **labels)
+        assert self.client.get("/api/jobs/unknown").status_code == 404
+        assert sample("autoreduce_rest_api_requests_total", **labels) == requests + 1
+
+
+@patch("autoreduce_scripts.manual_operations.manual_submission.submit_run", side_effect=fake_submit_run)
+@patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data", side_effect=fake_get_run_data)
+class StageMetricsTest(SimpleTestCase):
+
+    def setUp(self) -> None:
+        run_metadata_cache.clear()
+
+    @patch("autoreduce_rest_api.runs.submission.close_old_connections", new=Mock())
+    def test_times_each_stage(self, *_: Mock):
+        """Test that the lookup and publishing of each run, and the flush of their messages, are timed."""
+        before = {stage: stage_count(stage) for stage in ("lookup", "publish", "flush")}
+        list(iter_submissions(INSTRUMENT_NAME, [1, 2]))
+        assert {stage: stage_count(stage) - count
+                for stage, count in before.items()} == {
+                    "lookup": 2,
+                    "publish": 2,
+                    "flush": 1
+                }
+
+    def test_instrument_scripts(self, *_: Mock):
+        """Test that the calls made by get_run_data are timed, and that they are only wrapped once."""
+        with patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data_from_icat",
+                   return_value=("/tmp/location", "1234567")) as get_run_data_from_icat:
+            instrument_scripts(manual_submission)
+            instrument_scripts(manual_submission)
+            count = stage_count("icat")
+            assert manual_submission.get_run_data_from_icat(INSTRUMENT_NAME, 1, "nxs") == ("/tmp/location", "1234567")
+            assert stage_count("icat") == count + 1
+            get_run_data_from_icat.assert_called_once()
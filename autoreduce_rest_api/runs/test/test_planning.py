@@ -0,0 +1,144 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the plans of the submissions and removals."""
+import os
+import tempfile
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_db.reduction_viewer.models import Instrument, ReductionRun
+
+from autoreduce_rest_api.runs.cache import run_metadata_cache
+from autoreduce_rest_api.runs.instruments import instrument_index, reduce_vars_directory
+from autoreduce_rest_api.runs.planning import (INACTIVE_MESSAGE, NO_REDUCE_VARS_MESSAGE, UNKNOWN_INSTRUMENT_MESSAGE,
+                                               plan_removal, plan_submission)
+from autoreduce_rest_api.runs.submission import MISMATCHING_RB_NUMBERS_MESSAGE
+from autoreduce_rest_api.runs.test.utils import create_reduction_run
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+class PlanningTest(TestCase):
+
+    def setUp(self) -> None:
+        instrument_index.clear()
+        run_metadata_cache.clear()
+        scripts = tempfile.TemporaryDirectory()  # pylint:disable=consider-using-with
+        self.addCleanup(scripts.cleanup)
+        os.makedirs(os.path.join(scripts.name, f"NDX{INSTRUMENT_NAME}"))
+        with open(os.path.join(scripts.name, f"NDX{INSTRUMENT_NAME}", "reduce_vars.py"), "w", encoding="utf-8"):
+            pass
+        patcher = patch("autoreduce_rest_api.runs.instruments.SCRIPTS_DIRECTORY", os.path.join(scripts.name, "NDX%s"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_submission(self):
+        """Test that the runs in the database or the cache would be submitted, and the others looked up."""
+        create_reduction_run(INSTRUMENT_NAME, 1)
+        create_reduction_run(INSTRUMENT_NAME, 1, run_version=1)
+        run_metadata_cache.set(INSTRUMENT_NAME, 2, ("/tmp/2.nxs", "1234567", "Title 2"))
+        Instrument.objects.filter(name=INSTRUMENT_NAME).update(is_active=True)
+        with self.assertNumQueries(3):
+            plan = plan_submission(INSTRUMENT_NAME.lower(), [1, 2, 3])
+        assert plan["errors"] == [] and plan["warnings"] == []
+        assert plan["counts"] == {"submit": 2, "lookup": 1}
+        assert plan["runs"] == [
+            {
+                "run_number": 1,
+                "status": "submit",
+                "rb_number": "1234567"
+            },
+            {
+                "run_number": 2,
+                "status": "submit",
+                "rb_number": "1234567"
+            },
+            {
+                "run_number": 3,
+                "status": "lookup"
+            },
+        ]
+
+    def test_instrument_index_is_cached(self):
+        """Test that the instruments are only queried once their index has expired."""
+        create_reduction_run(INSTRUMENT_NAME, 1)
+        plan_submission(INSTRUMENT_NAME, [1])
+        with self.assertNumQueries(2):
+            plan = plan_submission(INSTRUMENT_NAME, [1])
+        assert plan["warnings"] == [INACTIVE_MESSAGE.format(instrument=INSTRUMENT_NAME)]
+
+    @parameterized.expand([["OTHER", UNKNOWN_INSTRUMENT_MESSAGE], ["NOSCRIPTS", NO_REDUCE_VARS_MESSAGE]])
+    def test_instrument_errors(self, instrument: str, error: str):
+        """Test that an unknown instrument, or one without a reduce_vars.py, is reported."""
+        Instrument.objects.create(name="NOSCRIPTS", is_active=True)
+        plan = plan_submission(instrument, [1])
+        assert plan["errors"] == [error.format(instrument=instrument, directory=reduce_vars_directory(instrument))]
+
+    def test_batch_with_mismatching_rb_numbers(self):
+        """Test that a batch of runs known with different RB numbers is reported, as it would fail."""
+        create_reduction_run(INSTRUMENT_NAME, 1)
+        create_reduction_run(INSTRUMENT_NAME, 2, rb_number=7654321)
+        assert MISMATCHING_RB_NUMBERS_MESSAGE in plan_submission(INSTRUMENT_NAME, [1, 2], batch=True)["errors"]
+
+    def test_removal(self):
+        """Test that every version of the runs that were found would be removed, and nothing is."""
+        create_reduction_run(INSTRUMENT_NAME, 1)
+        create_reduction_run(INSTRUMENT_NAME, 1, run_version=1)
+        plan = plan_removal(INSTRUMENT_NAME, [1, 2])
+        assert plan["counts"] == {"remove": 1, "not_found": 1}
+        assert plan["runs"][0] == {"run_number": 1, "status": "remove", "versions": [0, 1]}
+        assert ReductionRun.objects.count() == 2
+
+    def test_batch_removal_of_other_instrument(self):
+        """Test that a batch run of another instrument would not be removed."""
+        batch_run = create_reduction_run("OTHERINSTRUMENT", [1, 2], batch_run=True)
+        plan = plan_removal(INSTRUMENT_NAME, [batch_run.pk], batch=True)
+        assert plan["runs"] == [{"run_number": batch_run.pk, "status": "not_found"}]
+
+
+class PlanViewsTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        instrument_index.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        create_reduction_run(INSTRUMENT_NAME, 1)
+
+    @parameterized.expand([
+        ["post", "/api/plan/runs/{}", {}, "submit"],
+        ["post", "/api/runs/{}", {
+            "dry_run": True
+        }, "submit"],
+        ["post", "/api/runs/batch/{}", {
+            "dry_run": True
+        }, "submit"],
+        ["delete", "/api/plan/runs/{}", {}, "remove"],
+        ["delete", "/api/runs/{}", {
+            "dry_run": True
+        }, "remove"],
+    ])
+    @patch("autoreduce_rest_api.runs.views.iter_submissions")
+    def test_nothing_is_done(self, method: str, url: str, data: dict, action: str, iter_submissions: Mock):
+        """Test that the plan is returned, by the plan views and by the run views in a dry run, and nothing done."""
+        response = getattr(self.client, method)(url.format(INSTRUMENT_NAME), {"runs": "1-2", **data}, format="json")
+        assert response.status_code == 200
+        assert response.json()["action"] == action
+        assert [run["run_number"] for run in response.json()["runs"]] == [1, 2]
+        iter_submissions.assert_not_called()
+        assert ReductionRun.objects.count() == 1
+
+    def test_invalid_runs(self):
+        """Test that the runs are validated as the run views validate them."""
+        response = self.client.post(f"/api/plan/runs/{INSTRUMENT_NAME}", {"runs": "2-1"}, format="json")
+        assert response.status_code == 400
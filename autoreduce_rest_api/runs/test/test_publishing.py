@@ -0,0 +1,142 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the publishing of the messages through the shared producer."""
+import json
+from unittest.mock import Mock, patch
+
+import confluent_kafka
+from django.test import SimpleTestCase, override_settings
+from parameterized import parameterized
+
+from autoreduce_rest_api.runs.cache import run_metadata_cache
+from autoreduce_rest_api.runs.publishing import MemoryBroker, RequestPublisher, SharedProducer
+from autoreduce_rest_api.runs.submission import DEFAULT_SOFTWARE, iter_submissions, submit_batch
+from autoreduce_rest_api.runs.test.utils import fake_get_run_data, use_memory_broker
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+def message(payload: dict) -> Mock:
+    """Returns a message with the json method of autoreduce_utils' Message."""
+    return Mock(json=Mock(return_value=json.dumps(payload)))
+
+
+def failing_producer(err) -> Mock:
+    """Returns a producer that calls back with the error for every message it is flushed with."""
+    produced = []
+
+    def flush(_timeout):
+        for callback in produced:
+            callback(err, None)
+        return 0
+
+    producer = Mock()
+    producer.produce.side_effect = lambda topic, value, key, callback: produced.append(callback)
+    producer.flush.side_effect = flush
+    return producer
+
+
+class RequestPublisherTest(SimpleTestCase):
+
+    def test_messages_are_delivered_on_flush(self):
+        """Test that the messages are only delivered when the request flushes, all at once."""
+        broker = MemoryBroker()
+        publisher = RequestPublisher(broker)
+        publisher.publish("data_ready", message({"run_number": 1}))
+        publisher.publish("data_ready", [message({"run_number": 2}), message({"run_number": 3})])
+        assert not broker.messages
+        assert len(broker) == 3
+        publisher.flush()
+        assert [json.loads(delivered.value())["run_number"] for delivered in broker.messages] == [1, 2, 3]
+        assert broker.flushes == 1
+        assert broker.bytes_sent == sum(len(delivered.value()) for delivered in broker.messages)
+
+    def test_delivery_error(self):
+        """Test that a message that could not be delivered fails the flush."""
+        publisher = RequestPublisher(failing_producer("Broker down"))
+        publisher.publish("data_ready", message({"run_number": 1}))
+        with self.assertRaisesRegex(RuntimeError, "1 of the messages could not be delivered: Broker down"):
+            publisher.flush()
+
+    def test_not_delivered_in_time(self):
+        """Test that a message that is still queued once the flush times out fails the flush."""
+        producer = Mock()
+        publisher = RequestPublisher(producer)
+        publisher.publish("data_ready", message({"run_number": 1}))
+        with self.assertRaisesRegex(RuntimeError, "1 of the messages were not delivered within 3 seconds"):
+            publisher.flush(timeout=3)
+        producer.flush.assert_called_once_with(3)
+
+    def test_full_queue(self):
+        """Test that a message is produced again once the producer has had time to deliver some of its queue."""
+        producer = Mock()
+        producer.produce.side_effect = [BufferError(), None]
+        RequestPublisher(producer).publish("data_ready", message({"run_number": 1}))
+        producer.poll.assert_called_once_with(1)
+        assert producer.produce.call_count == 2
+
+    def test_produce_error(self):
+        """Test that a message the producer does not accept raises a RuntimeError."""
+        producer = Mock()
+        producer.produce.side_effect = confluent_kafka.KafkaException("Unknown topic")
+        with self.assertRaisesRegex(RuntimeError, "Cannot publish to data_ready"):
+            RequestPublisher(producer).publish("data_ready", message({"run_number": 1}))
+
+
+class SharedProducerTest(SimpleTestCase):
+
+    @patch("autoreduce_rest_api.runs.publishing.atexit.register")
+    def test_producer_is_shared(self, register: Mock):
+        """Test that the producer is created once, then drained, which is also done when the process exits."""
+        shared = SharedProducer(backend="memory")
+        assert not shared.drain()
+        producer = shared.get()
+        assert shared.get() is producer
+        register.assert_called_once_with(shared.drain)
+        RequestPublisher(producer).publish("data_ready", message({"run_number": 1}))
+        assert not shared.drain()
+        assert len(producer.messages) == 1
+
+    @override_settings(AUTOREDUCE_KAFKA_LINGER_MS=20, AUTOREDUCE_KAFKA_BATCH_SIZE=500)
+    @patch("autoreduce_rest_api.runs.publishing.atexit.register", new=Mock())
+    @patch("autoreduce_rest_api.runs.publishing.confluent_kafka.Producer")
+    def test_kafka_config(self, producer: Mock):
+        """Test that the Kafka producer batches the messages, with the configuration of the environment."""
+        with patch.dict("os.environ", {"KAFKA_BROKER_URL": "broker:9092"}):
+            assert SharedProducer(backend="kafka").get() is producer.return_value
+        producer.assert_called_once_with({
+            "linger.ms": 20,
+            "batch.num.messages": 500,
+            "bootstrap.servers": "broker:9092"
+        })
+
+    @parameterized.expand([["local"], ["none"]])
+    def test_unknown_backend(self, backend: str):
+        """Test that an unknown backend is rejected."""
+        with self.assertRaises(ValueError):
+            SharedProducer(backend=backend)
+
+
+@patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data", side_effect=fake_get_run_data)
+class SubmissionPublishingTest(SimpleTestCase):
+
+    def setUp(self) -> None:
+        run_metadata_cache.clear()
+        self.broker = use_memory_broker(self)
+
+    def test_runs_are_flushed_once(self, _: Mock):
+        """Test that the messages of the runs of a request are delivered in a single flush."""
+        list(iter_submissions(INSTRUMENT_NAME, [1, 2, 3], software=DEFAULT_SOFTWARE))
+        assert [delivered.topic() for delivered in self.broker.messages] == ["data_ready"] * 3
+        assert [json.loads(delivered.value())["run_number"] for delivered in self.broker.messages] == [1, 2, 3]
+        assert self.broker.flushes == 1
+
+    def test_batch_is_flushed(self, _: Mock):
+        """Test that the message of a batch is delivered before it is returned."""
+        submitted = submit_batch(INSTRUMENT_NAME, [1, 2], software=DEFAULT_SOFTWARE)
+        assert submitted["run_number"] == [1, 2]
+        assert len(self.broker.messages) == 1
@@ -0,0 +1,110 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the bulk removal of runs."""
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_db.reduction_viewer.models import DataLocation, ReductionRun, RunNumber
+
+from autoreduce_rest_api.runs.removal import NOT_FOUND, REMOVED, remove_runs_in_bulk
+from autoreduce_rest_api.runs.test.utils import create_reduction_run
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+class BulkRemovalTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def test_removes_all_versions(self):
+        """Test that every version of the runs is removed, with the records that depend on them."""
+        for run_version in range(3):
+            create_reduction_run(INSTRUMENT_NAME, 1, run_version=run_version)
+        create_reduction_run(INSTRUMENT_NAME, 2)
+        kept = [create_reduction_run(INSTRUMENT_NAME, 3), create_reduction_run("OTHERINSTRUMENT", 1)]
+
+        report = remove_runs_in_bulk(INSTRUMENT_NAME.lower(), [1, 2, 4])
+
+        assert report == [{
+            "run_number": 1,
+            "status": REMOVED,
+            "versions": [0, 1, 2]
+        }, {
+            "run_number": 2,
+            "status": REMOVED,
+            "versions": [0]
+        }, {
+            "run_number": 4,
+            "status": NOT_FOUND
+        }]
+        assert list(ReductionRun.objects.order_by("pk")) == kept
+        assert RunNumber.objects.count() == DataLocation.objects.count() == 2
+
+    def test_queries_do_not_grow_with_runs(self):
+        """Test that the number of queries depends on the number of chunks rather than of runs."""
+        query_counts = []
+        for runs in (range(0, 3), range(10, 40)):
+            for run_number in runs:
+                create_reduction_run(INSTRUMENT_NAME, run_number)
+            with CaptureQueriesContext(connection) as queries:
+                remove_runs_in_bulk(INSTRUMENT_NAME, runs, chunk_size=50)
+            query_counts.append(len(queries))
+        assert query_counts[0] == query_counts[1]
+        assert not ReductionRun.objects.exists()
+
+    def test_remove_batch_runs(self):
+        """Test that batch runs are removed by primary key, once even if the same run is given twice."""
+        batch_run = create_reduction_run(INSTRUMENT_NAME, [1, 2], batch_run=True)
+        report = remove_runs_in_bulk(INSTRUMENT_NAME, [batch_run.pk, batch_run.pk + 1], batch=True, chunk_size=1)
+        assert [result["status"] for result in report] == [REMOVED, NOT_FOUND]
+        assert not ReductionRun.objects.exists()
+        assert not RunNumber.objects.exists()
+
+    def test_remove_batch_runs_of_instrument(self):
+        """Test that the primary keys of other instruments' runs, or of runs that are not batch runs, are not found."""
+        kept = [
+            create_reduction_run("OTHERINSTRUMENT", [1, 2], batch_run=True),
+            create_reduction_run(INSTRUMENT_NAME, 1)
+        ]
+        report = remove_runs_in_bulk(INSTRUMENT_NAME, [reduction_run.pk for reduction_run in kept], batch=True)
+        assert [result["status"] for result in report] == [NOT_FOUND, NOT_FOUND]
+        assert list(ReductionRun.objects.order_by("pk")) == kept
+
+    def test_delete_view(self):
+        """Test that the DELETE view returns the removed runs and the report of each run."""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=get_user_model().objects.first())}")
+        create_reduction_run(INSTRUMENT_NAME, 5)
+        response = client.delete(f"/api/runs/{INSTRUMENT_NAME}", {"runs": "5-6"}, format="json")
+        assert response.status_code == 200
+        assert response.json() == {
+            "removed_runs": [5],
+            "runs": [{
+                "run_number": 5,
+                "status": REMOVED,
+                "versions": [0]
+            }, {
+                "run_number": 6,
+                "status": NOT_FOUND
+            }]
+        }
+
+    @parameterized.expand([["/api/runs/{}"], ["/api/runs/batch/{}"]])
+    @patch("autoreduce_rest_api.runs.views.remove_runs_in_bulk", side_effect=RuntimeError("Test error"))
+    def test_delete_view_error(self, url: str, _):
+        """Test that a removal raising a RuntimeError is returned as a 400 with its error."""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=get_user_model().objects.first())}")
+        response = client.delete(url.format(INSTRUMENT_NAME), {"runs": [1]}, format="json")
+        assert response.status_code == 400
+        assert response.json() == {"error": "Test error"}
@@ -0,0 +1,122 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for listing the runs of an instrument."""
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_db.reduction_viewer.models import Status
+
+from autoreduce_rest_api.runs.cache import token_cache
+from autoreduce_rest_api.runs.run_list import INVALID_CURSOR_MESSAGE, INVALID_FIELDS_MESSAGE, INVALID_STATUS_MESSAGE
+from autoreduce_rest_api.runs.test.utils import create_reduction_run
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+URL = f"/api/runs/{INSTRUMENT_NAME}"
+
+
+class RunListTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        token_cache.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    def test_list_runs(self):
+        """Test that the runs of the instrument are listed newest first with all of their fields."""
+        run = create_reduction_run(INSTRUMENT_NAME, 1, rb_number=7)
+        batch_run = create_reduction_run(INSTRUMENT_NAME, [3, 2], batch_run=True)
+        create_reduction_run("OTHERINSTRUMENT", 1)
+
+        response = self.client.get(URL)
+
+        assert response.status_code == 200
+        runs = response.json()["runs"]
+        assert [listed["id"] for listed in runs] == [batch_run.pk, run.pk]
+        assert runs[0]["run_numbers"] == [2, 3]
+        assert runs[0]["batch_run"] is True
+        assert {key: runs[1][key]
+                for key in ("run_numbers", "status", "rb_number", "run_version")} == {
+                    "run_numbers": [1],
+                    "status": "Queued",
+                    "rb_number": 7,
+                    "run_version": 0
+                }
+        assert response.json()["next"] is None
+        assert "no-cache" in response["Cache-Control"]
+
+    def test_pages(self):
+        """Test that following the next links lists every run once, with the same queries for each page."""
+        created = [create_reduction_run(INSTRUMENT_NAME, run_number).pk for run_number in range(5)]
+        listed, url = [], f"{URL}?limit=2&fields=id"
+        self.client.get(url)
+        while url is not None:
+            # the aggregate of the conditional response, then the runs of the page
+            with self.assertNumQueries(2):
+                page = self.client.get(url).json()
+            listed.extend(run["id"] for run in page["runs"])
+            assert all(set(run) == {"id"} for run in page["runs"])
+            url = page["next"]
+        assert listed == created[::-1]
+
+    def test_filters(self):
+        """Test that the runs can be filtered by run number and status."""
+        create_reduction_run(INSTRUMENT_NAME, 1)
+        completed = create_reduction_run(INSTRUMENT_NAME, 2)
+        completed.status = Status.get_completed()
+        completed.save()
+        create_reduction_run(INSTRUMENT_NAME, 3)
+
+        response = self.client.get(URL, {"runs": "1-2,5-9:2", "fields": "run_numbers"})
+        assert response.json()["runs"] == [{"run_numbers": [2]}, {"run_numbers": [1]}]
+        response = self.client.get(URL, {"status": "completed,error", "fields": "id,status"})
+        assert response.json()["runs"] == [{"id": completed.pk, "status": "Completed"}]
+
+    def test_conditional_request(self):
+        """Test that an unchanged list is a 304 with a single query, until one of its runs changes."""
+        run = create_reduction_run(INSTRUMENT_NAME, 1)
+        response = self.client.get(URL)
+        etag = response["ETag"]
+        assert response.has_header("Last-Modified")
+
+        with self.assertNumQueries(1):
+            response = self.client.get(URL, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        run.status = Status.get_processing()
+        run.save()
+        response = self.client.get(URL, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.json()["runs"][0]["status"] == "Processing"
+        assert response["ETag"] != etag
+
+    @parameterized.expand([
+        [{
+            "fields": "id,password"
+        }, INVALID_FIELDS_MESSAGE],
+        [{
+            "status": "Lost"
+        }, INVALID_STATUS_MESSAGE],
+        [{
+            "cursor": "not a cursor"
+        }, INVALID_CURSOR_MESSAGE],
+        [{
+            "limit": "0"
+        }, "'limit' must be between 1 and 1000"],
+        [{
+            "runs": "1-"
+        }, "Invalid run range '1-'"],
+    ])
+    def test_invalid_parameters(self, params: dict, message: str):
+        """Test that invalid query parameters are rejected."""
+        response = self.client.get(URL, params)
+        assert response.status_code == 400
+        assert response.json()["error"].startswith(message)
@@ -0,0 +1,94 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the expansion of run range expressions."""
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.run_ranges import (INVALID_RUNS_MESSAGE, expand_runs, invalid_range_message,
+                                                 too_many_runs_message)
+
+
+class ExpandRunsTest(SimpleTestCase):
+
+    @parameterized.expand([
+        [5, [5]],
+        [[3, 1, 2], [3, 1, 2]],
+        ["63125", [63125]],
+        ["1-4", [1, 2, 3, 4]],
+        [" 1 - 9 : 4 , 20 ", [1, 5, 9, 20]],
+        ["10-12,11,1", [10, 11, 12, 1]],
+        [[1, "1-3", 3], [1, 2, 3]],
+    ])
+    def test_expand(self, runs, expected):
+        """Test that the runs are expanded in the order given, without duplicates."""
+        assert list(expand_runs(runs)) == expected
+
+    @parameterized.expand([
+        [[], INVALID_RUNS_MESSAGE],
+        [[True], INVALID_RUNS_MESSAGE],
+        [[-1], INVALID_RUNS_MESSAGE],
+        [1.5, INVALID_RUNS_MESSAGE],
+        [{
+            "runs": 1
+        }, INVALID_RUNS_MESSAGE],
+        ["", invalid_range_message("")],
+        ["1-", invalid_range_message("1-")],
+        ["5-1", invalid_range_message("5-1")],
+        ["1-5:0", invalid_range_message("1-5:0")],
+        ["1,,2", invalid_range_message("1,,2")],
+        [[1, "a"], invalid_range_message("a")],
+    ])
+    def test_invalid(self, runs, message):
+        """Test that invalid runs are rejected with a message saying why."""
+        with self.assertRaisesMessage(ValueError, message):
+            expand_runs(runs)
+
+    def test_too_many_runs(self):
+        """Test that runs above the limit are rejected before they are expanded, duplicates included."""
+        with self.assertRaisesMessage(ValueError, too_many_runs_message(10)):
+            expand_runs("1-1000000000000", max_runs=10)
+        with self.assertRaisesMessage(ValueError, too_many_runs_message(10)):
+            expand_runs("1-6,1-6", max_runs=10)
+        assert list(expand_runs("1-20:2", max_runs=10)) == list(range(1, 21, 2))
+
+    def test_expansion_is_lazy(self):
+        """Test that the runs are generated as they are consumed."""
+        runs = expand_runs("1-10000")
+        assert next(runs) == 1
+        assert next(runs) == 2
+
+
+class RunRangeViewTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", return_value=[])
+    def test_submit_range(self, iter_submissions: Mock):
+        """Test that a range expression is submitted as the runs it covers."""
+        response = self.client.post("/api/runs/testinstrument", {"runs": "1-3,2,7"}, format="json")
+        assert response.status_code == 200
+        assert list(iter_submissions.call_args.args[1]) == [1, 2, 3, 7]
+
+    @parameterized.expand([["/api/runs/testinstrument"], ["/api/runs/batch/testinstrument"]])
+    @patch("autoreduce_rest_api.runs.views.submit_batch")
+    @patch("autoreduce_rest_api.runs.views.iter_submissions")
+    def test_invalid_range_submits_nothing(self, url: str, iter_submissions: Mock, submit_batch: Mock):
+        """Test that an invalid range is rejected before any run is submitted."""
+        response = self.client.post(url, {"runs": "1-3,x"}, format="json")
+        assert response.status_code == 400
+        assert response.json() == {"error": invalid_range_message("1-3,x")}
+        iter_submissions.assert_not_called()
+        submit_batch.assert_not_called()
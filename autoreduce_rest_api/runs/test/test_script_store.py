@@ -0,0 +1,130 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the store of reduction scripts."""
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.script_store import (BOTH_SCRIPTS_MESSAGE, UNKNOWN_SCRIPT_MESSAGE, ScriptStore,
+                                                   script_hash, script_store)
+from autoreduce_rest_api.runs.submission import RunResult
+from autoreduce_rest_api.runs.views import NO_SCRIPT_KEY_MESSAGE
+
+SCRIPT = "def main(input_file, output_dir):\n    pass\n"
+
+
+class ScriptStoreTest(SimpleTestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_deduplicated(self):
+        """Test that a script is stored once, under the hash of its content."""
+        store = ScriptStore(max_size=1000, max_script_size=100)
+        assert store.put(SCRIPT) == (script_hash(SCRIPT), True)
+        assert store.put(SCRIPT) == (script_hash(SCRIPT), False)
+        assert store.get(script_hash(SCRIPT)) == SCRIPT
+        assert store.get(script_hash("other")) is None
+
+    def test_least_recently_used_are_evicted(self):
+        """Test that the scripts least recently used are evicted once the store is over its size."""
+        store = ScriptStore(max_size=10, max_script_size=10)
+        first, _ = store.put("aaaa")
+        second, _ = store.put("bbbb")
+        store.get(first)
+        third, _ = store.put("cccc")
+        assert [store.get(key) for key in (first, second, third)] == ["aaaa", None, "cccc"]
+
+    def test_too_large(self):
+        """Test that a script over the size limit is rejected."""
+        with self.assertRaisesRegex(ValueError, "over the limit of 10 bytes"):
+            ScriptStore(max_size=100, max_script_size=10).put("a" * 11)
+
+    def test_shared_through_django_cache(self):
+        """Test that the django backend finds the scripts stored by other processes, and evicted ones."""
+        uploaded_to = ScriptStore(max_size=100, max_script_size=100, backend="django")
+        key, _ = uploaded_to.put(SCRIPT)
+        other = ScriptStore(max_size=100, max_script_size=100, backend="django")
+        assert other.get(key) == SCRIPT
+        assert other.put(SCRIPT) == (key, False)
+        uploaded_to.clear()
+        assert uploaded_to.get(key) == SCRIPT
+
+    def test_unknown_backend(self):
+        """Test that an unknown backend is rejected."""
+        with self.assertRaises(ValueError):
+            ScriptStore(max_size=100, max_script_size=100, backend="none")
+
+
+def submitted(_instrument, runs, **_kwargs):
+    """Submits every run."""
+    return iter([RunResult(run, RunResult.SUBMITTED, message={"run_number": run}) for run in runs])
+
+
+class ScriptViewsTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        script_store.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    def test_upload(self):
+        """Test that a script is created once, and can then be read back by its hash."""
+        response = self.client.post("/api/scripts", {"script": SCRIPT}, format="json")
+        assert response.status_code == 201
+        assert response.json() == {"script_hash": script_hash(SCRIPT), "size": len(SCRIPT)}
+        assert self.client.post("/api/scripts", {"script": SCRIPT}, format="json").status_code == 200
+        response = self.client.get(response["Location"])
+        assert response.json() == {"script_hash": script_hash(SCRIPT), "script": SCRIPT}
+
+    @parameterized.expand([[{}], [{"script": ""}], [{"script": ["print()"]}]])
+    def test_upload_invalid(self, data: dict):
+        """Test that an upload without a script is rejected."""
+        response = self.client.post("/api/scripts", data, format="json")
+        assert response.status_code == 400
+        assert response.json()["error"] == NO_SCRIPT_KEY_MESSAGE
+
+    def test_not_found(self):
+        """Test that reading a script that is not stored is a 404."""
+        assert self.client.get(f"/api/scripts/{script_hash(SCRIPT)}").status_code == 404
+
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=submitted)
+    def test_submit_with_hash(self, iter_submissions: Mock):
+        """Test that the runs of a submission referring to an uploaded script are submitted with the script."""
+        key, _ = script_store.put(SCRIPT)
+        data = {"runs": [1, 2], "reduction_script_hash": key}
+        response = self.client.post("/api/runs/TESTINSTRUMENT", data, format="json")
+        assert response.status_code == 200
+        assert iter_submissions.call_args.kwargs["reduction_script"] == SCRIPT
+
+    @parameterized.expand([
+        [{
+            "reduction_script_hash": "0" * 64
+        }, UNKNOWN_SCRIPT_MESSAGE],
+        [{
+            "reduction_script_hash": "not a hash"
+        }, UNKNOWN_SCRIPT_MESSAGE],
+        [{
+            "reduction_script_hash": script_hash(SCRIPT),
+            "reduction_script": SCRIPT
+        }, BOTH_SCRIPTS_MESSAGE],
+    ])
+    @patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=submitted)
+    def test_submit_invalid_hash(self, data: dict, error: str, iter_submissions: Mock):
+        """Test that a submission referring to a script that is not stored is rejected."""
+        script_store.put(SCRIPT)
+        response = self.client.post("/api/runs/TESTINSTRUMENT", {"runs": [1], **data}, format="json")
+        assert response.status_code == 400
+        assert response.json()["error"] == error
+        iter_submissions.assert_not_called()
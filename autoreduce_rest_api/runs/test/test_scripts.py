@@ -0,0 +1,75 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the lazy loading of the submissions and the warm-up."""
+import os
+import subprocess
+import sys
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+from prometheus_client import REGISTRY
+
+from autoreduce_rest_api.runs.scripts import lazy_module
+
+# imports the URLs, which import every view, and reports whether the submissions were loaded
+IMPORT_URLS = """
+import sys
+import django
+django.setup()
+import autoreduce_rest_api.autoreduce_django.urls
+print("autoreduce_scripts.manual_operations.manual_submission" in sys.modules)
+"""
+
+
+def startup_duration(step: str) -> float:
+    """Returns the recorded duration of the startup step."""
+    return REGISTRY.get_sample_value("autoreduce_rest_api_startup_duration_seconds", {"step": step})
+
+
+class LazyModuleTest(SimpleTestCase):
+
+    def test_loaded_on_first_use(self):
+        """Test that the module is only imported, and prepared, once one of its attributes is used."""
+        prepare = Mock()
+        with patch("autoreduce_rest_api.runs.scripts.importlib.import_module") as import_module:
+            module = lazy_module("autoreduce_scripts.manual_operations.lazy_test", prepare=prepare)
+            import_module.assert_not_called()
+            assert module.main is import_module.return_value.main
+            assert module.other is import_module.return_value.other
+        import_module.assert_called_once_with("autoreduce_scripts.manual_operations.lazy_test")
+        prepare.assert_called_once_with(import_module.return_value)
+        assert startup_duration("lazy_test") is not None
+
+    def test_views_do_not_load_the_submissions(self):
+        """Test that importing the views does not import autoreduce_scripts, in a new process."""
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": "autoreduce_rest_api.autoreduce_django.settings"}
+        output = subprocess.run([sys.executable, "-c", IMPORT_URLS],
+                                env=env,
+                                capture_output=True,
+                                check=True,
+                                text=True,
+                                timeout=60).stdout
+        assert output.strip() == "False"
+
+
+class WarmupCommandTest(SimpleTestCase):
+
+    def test_warmup(self):
+        """Test that the command loads the submissions and records how long it took."""
+        stdout = StringIO()
+        call_command("warmup", stdout=stdout)
+        assert stdout.getvalue().startswith("Warmed up in")
+        assert startup_duration("warmup") is not None
+
+    @patch("autoreduce_rest_api.runs.scripts.kafka_producer.get", side_effect=RuntimeError("Cannot connect"))
+    def test_producer_error(self, _: Mock):
+        """Test that the command fails, so that hurricane does not serve, if the producer cannot be created."""
+        with self.assertRaisesRegex(CommandError, "Cannot connect"):
+            call_command("warmup", stdout=StringIO())
@@ -0,0 +1,168 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for streaming the results of a submission as newline delimited JSON."""
+import json
+import threading
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.http.response import StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.async_views import StreamingASGIHandler
+from autoreduce_rest_api.runs.cache import run_metadata_cache
+from autoreduce_rest_api.runs.streaming import FOUND, NDJSON_CONTENT_TYPE
+from autoreduce_rest_api.runs.submission import RunResult
+from autoreduce_rest_api.runs.test.utils import fake_get_run_data, fake_submit_run
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+@patch("autoreduce_scripts.manual_operations.manual_submission.submit_run", side_effect=fake_submit_run)
+@patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data", side_effect=fake_get_run_data)
+class StreamingTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        run_metadata_cache.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    def post(self, url: str, runs: list):
+        """Posts the runs, asking for the results to be streamed."""
+        return self.client.post(url, {"runs": runs}, format="json", HTTP_ACCEPT=NDJSON_CONTENT_TYPE)
+
+    @staticmethod
+    def read_lines(response) -> list:
+        """Returns the decoded lines of a streamed response."""
+        assert response["Content-Type"] == NDJSON_CONTENT_TYPE
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_streams_each_run(self, *_: Mock):
+        """Test that there is a line for each run, in order, then a summary."""
+        lines = self.read_lines(self.post(f"/api/runs/{INSTRUMENT_NAME}", [102, 103, 104]))
+        assert lines == [{
+            "type": "run",
+            "run_number": 102,
+            "status": RunResult.SUBMITTED,
+            "message": fake_submit_run(None, "1234567", INSTRUMENT_NAME, "/tmp/102.nxs", 102)
+        }, {
+            "type": "run",
+            "run_number": 103,
+            "status": RunResult.FAILED,
+            "error": "Cannot find datafile for 103"
+        }, {
+            "type": "run",
+            "run_number": 104,
+            "status": RunResult.SUBMITTED,
+            "message": fake_submit_run(None, "1234567", INSTRUMENT_NAME, "/tmp/104.nxs", 104)
+        }, {
+            "type": "summary",
+            RunResult.SUBMITTED: 2,
+            RunResult.SKIPPED: 0,
+            RunResult.FAILED: 1
+        }]
+
+    def test_lines_are_sent_before_the_submission_finishes(self, *_: Mock):
+        """Test that a run's line can be read before the next run has been submitted."""
+        submitted = []
+
+        def submissions(_instrument, runs, **_kwargs):
+            for run_number in runs:
+                submitted.append(run_number)
+                yield RunResult(run_number, RunResult.SUBMITTED, message={"run_number": run_number})
+
+        with patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=submissions):
+            content = self.post(f"/api/runs/{INSTRUMENT_NAME}", [1, 2, 3]).streaming_content
+            assert json.loads(next(content))["run_number"] == 1
+            assert submitted == [1]
+
+    def test_error_before_the_first_run(self, *_: Mock):
+        """Test that failing to create the Kafka producer gives an error response rather than a stream."""
+        with patch("autoreduce_rest_api.runs.publishing.kafka_producer.get",
+                   side_effect=RuntimeError("Cannot connect")):
+            response = self.post(f"/api/runs/{INSTRUMENT_NAME}", [1, 2])
+        assert response.status_code == 400
+        assert response.json() == {"error": "Cannot connect"}
+
+    def test_error_after_the_first_run(self, _: Mock, submit_run: Mock):
+        """Test that an error raised part way is the last line of the stream."""
+        submit_run.side_effect = [{"run_number": 1}, RuntimeError("Producer disconnected")]
+        lines = self.read_lines(self.post(f"/api/runs/{INSTRUMENT_NAME}", [1, 2, 3]))
+        assert [line["type"] for line in lines] == ["run", "error"]
+        assert lines[-1]["error"] == "Producer disconnected"
+
+    def test_streams_batch(self, *_: Mock):
+        """Test that each run of a batch is reported as it is found, then the submitted batch."""
+        lines = self.read_lines(self.post(f"/api/runs/batch/{INSTRUMENT_NAME}", [1, 2]))
+        assert lines == [{
+            "type": "run",
+            "run_number": 1,
+            "status": FOUND
+        }, {
+            "type": "run",
+            "run_number": 2,
+            "status": FOUND
+        }, {
+            "type":
+            "summary",
+            "submitted_runs":
+            fake_submit_run(None, "1234567", INSTRUMENT_NAME, ["/tmp/1.nxs", "/tmp/2.nxs"], [1, 2])
+        }]
+
+    def test_unauthenticated(self, *_: Mock):
+        """Test that the errors raised before the view are rendered as a single line."""
+        self.client.credentials()
+        response = self.post(f"/api/runs/{INSTRUMENT_NAME}", [1])
+        assert response.status_code == 401
+        assert response["Content-Type"] == NDJSON_CONTENT_TYPE
+        assert list(json.loads(response.content)) == ["detail"]
+
+    def test_streams_batch_failure(self, _: Mock, submit_run: Mock):
+        """Test that a batch with a run that cannot be found ends with an error and is not submitted."""
+        lines = self.read_lines(self.post(f"/api/runs/batch/{INSTRUMENT_NAME}", [102, 103]))
+        assert [line["status"] for line in lines[:2]] == [FOUND, RunResult.FAILED]
+        assert lines[2]["type"] == "error"
+        assert lines[2]["failed_runs"] == [{
+            "run_number": 103,
+            "status": RunResult.FAILED,
+            "error": "Cannot find datafile for 103"
+        }]
+        submit_run.assert_not_called()
+
+
+# the parts are produced in the threads of the asynchronous views, which check their connections
+class StreamingASGIHandlerTest(TransactionTestCase):
+
+    async def test_parts_produced_outside_event_loop(self):
+        """Test that the parts of a streamed response are produced in other threads, and sent in order."""
+        threads = []
+        closed = Mock()
+
+        def lines():
+            for number in range(3):
+                threads.append(threading.get_ident())
+                yield f"line {number}\n"
+
+        response = StreamingHttpResponse(lines(), content_type=NDJSON_CONTENT_TYPE)
+        response.set_cookie("session", "value")
+        response._resource_closers.append(closed)  # pylint:disable=protected-access
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await StreamingASGIHandler().send_response(response, send)
+        assert threading.get_ident() not in threads
+        assert messages[0]["status"] == 200
+        assert (b"Content-Type", NDJSON_CONTENT_TYPE.encode()) in messages[0]["headers"]
+        assert any(header == b"Set-Cookie" for header, _ in messages[0]["headers"])
+        assert [message.get("body") for message in messages[1:]] == [b"line 0\n", b"line 1\n", b"line 2\n", None]
+        closed.assert_called_once()
@@ -0,0 +1,137 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the concurrent submission of runs."""
+import threading
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase, override_settings
+
+from autoreduce_rest_api.runs.cache import run_metadata_cache
+from autoreduce_rest_api.runs.submission import (InstrumentLimiter, LookupPool, RunResult, SubmissionError,
+                                                 instrument_limiter, iter_lookups, iter_submissions, submit_batch)
+from autoreduce_rest_api.runs.test.utils import fake_get_run_data, fake_submit_run
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+@patch("autoreduce_scripts.manual_operations.manual_submission.submit_run", side_effect=fake_submit_run)
+@patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data", side_effect=fake_get_run_data)
+class SubmissionTest(SimpleTestCase):
+
+    def setUp(self) -> None:
+        run_metadata_cache.clear()
+
+    def test_results_keep_the_order_of_the_runs(self, _: Mock, submit_run: Mock):
+        """Test that runs are published in the requested order even if the lookups finish out of order."""
+        runs = list(range(1, 10))
+        results = list(iter_submissions(INSTRUMENT_NAME, runs, max_workers=4))
+        assert [result.run_number for result in results] == runs
+        assert all(result.status == RunResult.SUBMITTED for result in results)
+        assert [call.args[4] for call in submit_run.call_args_list] == runs
+
+    def test_failed_runs_do_not_stop_the_others(self, _: Mock, submit_run: Mock):
+        """Test that a run that cannot be looked up is reported and the rest are submitted."""
+        results = list(iter_submissions(INSTRUMENT_NAME, [102, 103, 104], max_workers=2))
+        assert [result.status for result in results] == [RunResult.SUBMITTED, RunResult.FAILED, RunResult.SUBMITTED]
+        assert results[1].to_dict() == {
+            "run_number": 103,
+            "status": RunResult.FAILED,
+            "error": "Cannot find datafile for 103"
+        }
+        assert submit_run.call_count == 2
+
+    @override_settings(AUTOREDUCE_INSTRUMENT_CONCURRENCY=2)
+    def test_instrument_concurrency_is_capped(self, get_run_data: Mock, _: Mock):
+        """Test that no more lookups than the instrument's cap run at the same time."""
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def tracking_get_run_data(*args):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            try:
+                return fake_get_run_data(*args)
+            finally:
+                with lock:
+                    active[0] -= 1
+
+        get_run_data.side_effect = tracking_get_run_data
+        results = list(iter_submissions("CAPPED", range(1, 20), max_workers=8))
+        assert len(results) == 19
+        assert peak[0] == 2
+
+    def test_instrument_limits_are_dropped(self, _: Mock, __: Mock):
+        """Test that nothing is kept for the instruments once their lookups have finished."""
+        for instrument in (f"INSTRUMENT{index}" for index in range(5)):
+            list(iter_submissions(instrument, [1, 2], max_workers=2))
+            assert not instrument_limiter.in_flight(instrument)
+        assert not instrument_limiter._in_flight  # pylint:disable=protected-access
+
+    def test_batch_submits_single_message(self, _: Mock, submit_run: Mock):
+        """Test that a batch publishes all of its runs in one message."""
+        message = submit_batch(INSTRUMENT_NAME, [1, 2, 3], max_workers=3)
+        submit_run.assert_called_once()
+        assert message["run_number"] == [1, 2, 3]
+        assert message["data"] == ["/tmp/1.nxs", "/tmp/2.nxs", "/tmp/3.nxs"]
+
+    def test_batch_reports_all_failed_runs(self, _: Mock, submit_run: Mock):
+        """Test that a batch with runs that cannot be looked up is not submitted."""
+        with self.assertRaises(SubmissionError) as context:
+            submit_batch(INSTRUMENT_NAME, [101, 102, 103], max_workers=3)
+        assert [result.run_number for result in context.exception.failed_runs] == [101, 103]
+        submit_run.assert_not_called()
+
+    def test_batch_with_mismatching_rb_numbers(self, get_run_data: Mock, submit_run: Mock):
+        """Test that a batch spanning several experiments is rejected."""
+        get_run_data.side_effect = [("/tmp/1.nxs", "1234567", "Title"), ("/tmp/2.nxs", "7654321", "Title")]
+        with self.assertRaisesRegex(RuntimeError, "mismatching RB numbers"):
+            submit_batch(INSTRUMENT_NAME, [1, 2], max_workers=1)
+        submit_run.assert_not_called()
+
+
+class LookupPoolTest(SimpleTestCase):
+
+    def setUp(self) -> None:
+        run_metadata_cache.clear()
+        self.pool = LookupPool(max_workers=2)
+        self.addCleanup(self.pool.shutdown)
+
+    @patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data", side_effect=fake_get_run_data)
+    def test_threads_are_shared(self, get_run_data: Mock):
+        """Test that the lookups of every request are made by the same threads of the pool."""
+        threads = set()
+
+        def tracking_get_run_data(*args):
+            threads.add(threading.current_thread())
+            return fake_get_run_data(*args)
+
+        get_run_data.side_effect = tracking_get_run_data
+        with patch("autoreduce_rest_api.runs.submission.lookup_pool", new=self.pool):
+            for runs in ([1, 2, 3], [4, 5, 6]):
+                assert [run_data for _, run_data, _ in iter_lookups(INSTRUMENT_NAME, runs, max_workers=2)] == \
+                    [fake_get_run_data(INSTRUMENT_NAME, run, "nxs") for run in runs]
+        assert len(threads) == 2
+        assert all(thread.is_alive() for thread in threads)
+
+    @override_settings(AUTOREDUCE_INSTRUMENT_CONCURRENCY=1)
+    def test_capped_instrument_does_not_block_others(self):
+        """Test that the lookups held back by the cap of an instrument leave the threads to the other instruments."""
+        release = threading.Event()
+        limiter = InstrumentLimiter()
+        with patch("autoreduce_rest_api.runs.submission.lookup_pool", new=self.pool):
+            blocked = [limiter.submit("BUSY", release.wait, 5) for _ in range(3)]
+            assert limiter.submit("OTHER", sum, [1, 2]).result(timeout=5) == 3
+            assert limiter.in_flight("BUSY") == 1
+            release.set()
+            assert [future.result(timeout=5) for future in blocked] == [True, True, True]
+
+    @patch("autoreduce_rest_api.runs.submission.connections")
+    def test_shutdown_closes_connections(self, connections: Mock):
+        """Test that each thread closes its connections when the pool is shut down, after its lookups."""
+        assert self.pool.submit(sum, [1, 2]).result() == 3
+        self.pool.shutdown()
+        assert connections.close_all.call_count == 2
@@ -23,6 +23,7 @@ from autoreduce_qp.queue_processor.confluent_consumer import setup_kafka_connect
 from autoreduce_utils.clients.connection_exception import ConnectionException
 from autoreduce_utils.settings import SCRIPTS_DIRECTORY
 
+from autoreduce_rest_api.runs.cache import run_metadata_cache
 from autoreduce_rest_api.runs.views import NO_RUNS_KEY_MESSAGE
 
 INSTRUMENT_NAME = "TESTINSTRUMENT"
@@ -69,6 +70,8 @@ class SubmitRunsTest(LiveServerTestCase):
     def setUp(self) -> None:
         user = get_user_model()
         self.token = Token.objects.create(user=user.objects.first())
+        # the ICAT lookups are mocked per test, so results cached by a previous test must not be reused
+        run_metadata_cache.clear()
         return super().setUp()
 
     @parameterized.expand([[requests.post, "/api/runs/"], [requests.post, "/api/runs/batch/"],
@@ -84,10 +87,10 @@ class SubmitRunsTest(LiveServerTestCase):
         assert json.loads(response.content)["error"] == NO_RUNS_KEY_MESSAGE
 
     @parameterized.expand([
-        ['autoreduce_rest_api.runs.views.submit_main', requests.post, "/api/runs/"],
-        ['autoreduce_rest_api.runs.views.submit_batch_main', requests.post, "/api/runs/batch/"],
-        ['autoreduce_rest_api.runs.views.remove_main', requests.delete, "/api/runs/"],
-        ['autoreduce_rest_api.runs.views.remove_main', requests.delete, "/api/runs/batch/"],
+        ['autoreduce_rest_api.runs.views.iter_submissions', requests.post, "/api/runs/"],
+        ['autoreduce_rest_api.runs.views.submit_batch', requests.post, "/api/runs/batch/"],
+        ['autoreduce_rest_api.runs.views.remove_runs_in_bulk', requests.delete, "/api/runs/"],
+        ['autoreduce_rest_api.runs.views.remove_runs_in_bulk', requests.delete, "/api/runs/batch/"],
     ])
     def test_raising_returns_json_error(self, mock_path: str, requests_callable: Callable, url: str):
         """
@@ -0,0 +1,179 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the throttling of the run submissions."""
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from parameterized import parameterized
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from autoreduce_rest_api.runs.streaming import NDJSON_CONTENT_TYPE
+from autoreduce_rest_api.runs.jobs import Job
+from autoreduce_rest_api.runs.submission import RunResult
+from autoreduce_rest_api.runs.throttling import RateLimiter, rate_limiter
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+URL = f"/api/runs/{INSTRUMENT_NAME}"
+
+
+def submitted(_instrument, runs, **_kwargs):
+    """Submits every run."""
+    return iter([RunResult(run, RunResult.SUBMITTED, message={"run_number": run}) for run in runs])
+
+
+class RateLimiterTest(SimpleTestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    @parameterized.expand([["local", "monotonic"], ["django", "time"]])
+    def test_token_bucket(self, backend: str, clock: str):
+        """Test that a bucket allows bursts up to its size, then refills at its rate."""
+        limiter = RateLimiter(backend=backend)
+        with patch(f"autoreduce_rest_api.runs.throttling.time.{clock}", return_value=100.0) as now:
+            assert not limiter.take("key", 3, rate=2, burst=4)
+            assert limiter.take("key", 3, rate=2, burst=4) == 1
+            assert not limiter.take("other", 4, rate=2, burst=4)
+            now.return_value = 101.0
+            assert not limiter.take("key", 3, rate=2, burst=4)
+
+    @parameterized.expand([["local"], ["django"]])
+    def test_hold(self, backend: str):
+        """Test that counts are only held up to the limit, and can be held again once released."""
+        limiter = RateLimiter(backend=backend)
+        assert limiter.hold("key", 6, limit=10)
+        assert not limiter.hold("key", 5, limit=10)
+        assert limiter.held("key") == 6
+        limiter.release("key", 6)
+        assert limiter.hold("key", 10, limit=10)
+
+    @parameterized.expand([["local"], ["django"]])
+    def test_refund(self, backend: str):
+        """Test that tokens put back can be taken again, but do not fill the bucket over its burst."""
+        limiter = RateLimiter(backend=backend)
+        with patch("autoreduce_rest_api.runs.throttling.time.monotonic", return_value=100.0), \
+                patch("autoreduce_rest_api.runs.throttling.time.time", return_value=100.0):
+            assert not limiter.take("key", 3, rate=1, burst=4)
+            limiter.refund("key", 3, rate=1, burst=4)
+            limiter.refund("key", 3, rate=1, burst=4)
+            assert not limiter.take("key", 4, rate=1, burst=4)
+            assert limiter.take("key", 1, rate=1, burst=4) == 1
+
+    def test_disabled(self):
+        """Test that the 'none' backend admits everything."""
+        limiter = RateLimiter(backend="none")
+        assert not limiter.take("key", 100, rate=1, burst=1)
+        assert limiter.hold("key", 100, limit=1)
+
+
+@patch("autoreduce_rest_api.runs.views.iter_submissions", side_effect=submitted)
+@override_settings(AUTOREDUCE_THROTTLE_TOKEN_BURST=2,
+                   AUTOREDUCE_THROTTLE_TOKEN_RATE=0.5,
+                   AUTOREDUCE_THROTTLE_INSTRUMENT_BURST=10,
+                   AUTOREDUCE_THROTTLE_INSTRUMENT_RATE=1,
+                   AUTOREDUCE_THROTTLE_MAX_IN_FLIGHT_RUNS=8)
+class ThrottledViewsTest(TestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        rate_limiter.clear()
+        self.client = APIClient()
+        token = Token.objects.create(user=get_user_model().objects.first())
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    def post(self, runs, **extra):
+        """Submits the runs to the instrument."""
+        return self.client.post(URL, {"runs": runs}, format="json", **extra)
+
+    def test_token_limit(self, iter_submissions: Mock):
+        """Test that the requests of a token over its burst are rejected with the time after which to retry."""
+        assert [self.post([run]).status_code for run in (1, 2)] == [200, 200]
+        response = self.post([3])
+        assert response.status_code == 429
+        assert response["Retry-After"] == "2"
+        assert response.json()["retry_after"] == 2
+        assert iter_submissions.call_count == 2
+
+    def test_instrument_limit(self, iter_submissions: Mock):
+        """Test that the runs sent to an instrument over its burst are rejected, and that nothing is held."""
+        assert self.post("1-6").status_code == 200
+        response = self.post("7-12")
+        assert response.status_code == 429
+        assert response["Retry-After"] == "2"
+        assert not rate_limiter.held(INSTRUMENT_NAME)
+        iter_submissions.assert_called_once()
+
+    @override_settings(AUTOREDUCE_THROTTLE_TOKEN_BURST=10)
+    def test_runs_in_flight(self, _iter_submissions: Mock):
+        """Test that the runs of a streamed response are in flight until it has been sent."""
+        response = self.post("1-5", HTTP_ACCEPT=NDJSON_CONTENT_TYPE)
+        assert rate_limiter.held(INSTRUMENT_NAME) == 5
+        assert self.post("6-9").status_code == 429
+        list(response.streaming_content)
+        assert not rate_limiter.held(INSTRUMENT_NAME)
+        assert self.post("6-9").status_code == 200
+
+    def test_too_many_runs(self, iter_submissions: Mock):
+        """Test that a request with more runs than could ever be admitted is rejected as invalid."""
+        response = self.client.post(f"/api/runs/batch/{INSTRUMENT_NAME}", {"runs": "1-9"}, format="json")
+        assert response.status_code == 400
+        assert response.json()["error"] == "At most 8 runs can be submitted to an instrument in one request"
+        iter_submissions.assert_not_called()
+
+    @override_settings(AUTOREDUCE_THROTTLE_TOKEN_BURST=1)
+    def test_rejection_refunds_token(self, _iter_submissions: Mock):
+        """Test that a request rejected for its runs does not count against the requests of the token."""
+        rate_limiter.hold(INSTRUMENT_NAME, 8, limit=8)
+        assert self.post([1]).status_code == 429
+        rate_limiter.release(INSTRUMENT_NAME, 8)
+        assert self.post([1]).status_code == 200
+
+    @override_settings(AUTOREDUCE_MAX_RUNS=5)
+    def test_too_many_runs_is_max_runs(self, _iter_submissions: Mock):
+        """Test that no request is admitted with more runs than a request can have."""
+        response = self.post("1-6")
+        assert response.status_code == 400
+        assert response.json()["error"] == "At most 5 runs can be submitted to an instrument in one request"
+
+    def test_rejection_is_not_replayed(self, _iter_submissions: Mock):
+        """Test that a request rejected by the throttling can be retried with the same Idempotency-Key."""
+        self.post([1])
+        self.post([2])
+        assert self.post([3], HTTP_IDEMPOTENCY_KEY="key").status_code == 429
+        rate_limiter.clear()
+        assert self.post([3], HTTP_IDEMPOTENCY_KEY="key").status_code == 200
+
+    @patch("autoreduce_rest_api.runs.bulk.iter_submissions", side_effect=submitted)
+    def test_bulk_limits(self, bulk_iter_submissions: Mock, _iter_submissions: Mock):
+        """Test that the runs of a bulk request count against the limits of each of its instruments."""
+        entries = [{"instrument": INSTRUMENT_NAME, "runs": "1-6"}, {"instrument": "OTHER", "runs": [1]}]
+        assert self.client.post("/api/bulk/runs", {"entries": entries}, format="json").status_code == 200
+        assert self.post("7-12").status_code == 429
+        assert not rate_limiter.held(INSTRUMENT_NAME)
+        bulk_iter_submissions.assert_called()
+
+    @patch("autoreduce_rest_api.runs.bulk.iter_submissions", side_effect=submitted)
+    def test_bulk_too_many_runs(self, bulk_iter_submissions: Mock, _iter_submissions: Mock):
+        """Test that a bulk request with more runs in all than could be submitted in one request is rejected."""
+        entries = [{"instrument": INSTRUMENT_NAME, "runs": "1-5"}, {"instrument": "OTHER", "runs": "1-5"}]
+        response = self.client.post("/api/bulk/runs", {"entries": entries}, format="json")
+        assert response.status_code == 400
+        assert response.json()["error"] == "At most 8 runs can be submitted in one request"
+        bulk_iter_submissions.assert_not_called()
+
+    @patch("autoreduce_rest_api.runs.views.job_manager.submit")
+    def test_job_runs_in_flight(self, submit: Mock, _iter_submissions: Mock):
+        """Test that the runs submitted in a job are in flight until the job has finished."""
+        assert self.client.post(URL, {"runs": "1-5", "async": True}, format="json").status_code == 202
+        assert rate_limiter.held(INSTRUMENT_NAME) == 5
+        job = submit.call_args.args[0]
+        job.status = Job.COMPLETED
+        job.call_done_callbacks()
+        assert not rate_limiter.held(INSTRUMENT_NAME)
@@ -0,0 +1,158 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Test cases for the notifications of the status transitions of runs."""
+import asyncio
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, TransactionTestCase
+from rest_framework.authtoken.models import Token
+
+from autoreduce_db.reduction_viewer.models import Status
+
+from autoreduce_rest_api.runs.async_views import INVALID_CURSOR_MESSAGE, INVALID_IDS_MESSAGE
+from autoreduce_rest_api.runs.test.utils import create_reduction_run
+from autoreduce_rest_api.runs.watcher import RunWatcher, TooManyWaiters
+
+INSTRUMENT_NAME = "TESTINSTRUMENT"
+
+
+def set_status(run, value: str):
+    """Saves the run with the status value, as the queue processor does."""
+    run.status = Status.objects.get_or_create(value=value)[0]
+    run.save()
+
+
+# the watcher polls in its own thread, which only sees the data of committed transactions
+class RunWatcherTest(TransactionTestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        self.watcher = RunWatcher(interval=0.05, history=10, idle=1, max_waiters=2)
+
+    def tearDown(self) -> None:
+        self.watcher.stop()
+
+    def test_poll_records_transitions(self):
+        """Test that each status transition is recorded once, and the runs known at the first poll are not."""
+        existing = create_reduction_run(INSTRUMENT_NAME, 1)
+        self.watcher.poll()
+        run = create_reduction_run(INSTRUMENT_NAME, [2, 3], batch_run=True)
+        self.watcher.poll()
+        set_status(run, "p")
+        set_status(existing, "p")
+        self.watcher.poll()
+        self.watcher.poll()
+        # saved without changing the status
+        run.save()
+        self.watcher.poll()
+
+        events = [(event["id"], event["status"]) for event in self.watcher.events_after(0, INSTRUMENT_NAME, None)]
+        assert events == [(run.pk, "Queued"), (run.pk, "Processing"), (existing.pk, "Processing")]
+        event = self.watcher.events_after(0, INSTRUMENT_NAME, {run.pk})[0]
+        assert (event["cursor"], event["run_numbers"], event["batch_run"]) == (1, [2, 3], True)
+
+    async def test_wait_is_woken(self):
+        """Test that a waiting request returns as soon as the watcher records a transition of its runs."""
+        run = await sync_to_async(create_reduction_run)(INSTRUMENT_NAME, 1)
+        waiting = asyncio.ensure_future(self.watcher.wait(INSTRUMENT_NAME, ids={run.pk}, timeout=10))
+        # let the watcher start from the current status of the run
+        await asyncio.sleep(0.2)
+        await sync_to_async(create_reduction_run)(INSTRUMENT_NAME, 2)
+        await sync_to_async(set_status)(run, "c")
+        events, cursor, missed = await asyncio.wait_for(waiting, 5)
+        assert [(event["id"], event["status"]) for event in events] == [(run.pk, "Completed")]
+        assert (cursor, missed) == (2, False)
+
+        events, _, _ = await self.watcher.wait(INSTRUMENT_NAME, cursor=0, timeout=0)
+        assert len(events) == 2
+
+    async def test_restart_keeps_watermark(self):
+        """Test that the transitions made while the watcher was stopped are recorded once it restarts."""
+        run = await sync_to_async(create_reduction_run)(INSTRUMENT_NAME, 1)
+        await sync_to_async(self.watcher.poll)()
+        await sync_to_async(set_status)(run, "c")
+        await sync_to_async(self.watcher.start)()
+        events, cursor, missed = await self.watcher.wait(INSTRUMENT_NAME, cursor=0, timeout=5)
+        assert [(event["id"], event["status"]) for event in events] == [(run.pk, "Completed")]
+        assert (cursor, missed) == (1, False)
+
+    async def test_too_many_waiters(self):
+        """Test that a request is rejected while the most requests allowed are waiting, and admitted after."""
+        waiting = [asyncio.ensure_future(self.watcher.wait(INSTRUMENT_NAME, timeout=10)) for _ in range(2)]
+        await asyncio.sleep(0.1)
+        with self.assertRaises(TooManyWaiters):
+            await self.watcher.wait(INSTRUMENT_NAME, timeout=0)
+        for future in waiting:
+            future.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        assert await self.watcher.wait(INSTRUMENT_NAME, cursor=0, timeout=0) == ([], 0, False)
+
+    async def test_missed_events(self):
+        """Test that a request is told when events after its cursor are no longer in the history."""
+        transitions = [{
+            "pk": pk,
+            "instrument__name": INSTRUMENT_NAME,
+            "status__value": "c",
+            "run_version": 0,
+            "batch_run": False,
+            "last_updated": None
+        } for pk in range(15)]
+        self.watcher._record(transitions, {})  # pylint:disable=protected-access
+        events, cursor, missed = await self.watcher.wait(INSTRUMENT_NAME, cursor=2, timeout=0)
+        assert (len(events), cursor, missed) == (10, 15, True)
+
+
+class RunEventsViewTest(TransactionTestCase):
+    fixtures = ["autoreduce_rest_api/autoreduce_django/fixtures/super_user_fixture.json"]
+
+    def setUp(self) -> None:
+        self.token = Token.objects.create(user=get_user_model().objects.first())
+        self.client = AsyncClient()
+
+    async def get(self, params: dict):
+        """Gets the events of the instrument, authenticated with the test user's token."""
+        return await self.client.get(f"/api/async/events/{INSTRUMENT_NAME.lower()}",
+                                     params,
+                                     authorization=f"Token {self.token}")
+
+    async def test_events(self):
+        """Test that the view returns the events of the watcher after the cursor."""
+        watcher = RunWatcher(interval=0.05, history=10, idle=1, max_waiters=2)
+        try:
+            with patch("autoreduce_rest_api.runs.async_views.run_watcher", watcher):
+                response = await self.get({"timeout": "0"})
+                assert response.json() == {"events": [], "cursor": 0, "missed": False}
+                run = await sync_to_async(create_reduction_run)(INSTRUMENT_NAME, 1)
+                response = await self.get({"cursor": "0", "ids": str(run.pk), "timeout": "5"})
+        finally:
+            await sync_to_async(watcher.stop)()
+        assert response.status_code == 200
+        assert response.json()["events"][0]["run_numbers"] == [1]
+        assert response.json()["cursor"] == 1
+
+    async def test_too_many_waiters(self):
+        """Test that the view is unavailable while the most requests allowed are waiting."""
+        watcher = RunWatcher(interval=0.05, history=10, idle=1, max_waiters=0)
+        with patch("autoreduce_rest_api.runs.async_views.run_watcher", watcher):
+            response = await self.get({"timeout": "0"})
+        assert response.status_code == 503
+        assert "error" in response.json()
+
+    async def test_invalid_parameters(self):
+        """Test that invalid query parameters are rejected."""
+        for params, message in (({
+                "cursor": "-1"
+        }, INVALID_CURSOR_MESSAGE), ({
+                "ids": "1,two"
+        }, INVALID_IDS_MESSAGE), ({
+                "timeout": "3600"
+        }, "'timeout' must be a number of seconds between 0 and 60")):
+            response = await self.get(params)
+            assert response.status_code == 400
+            assert response.json()["error"] == message
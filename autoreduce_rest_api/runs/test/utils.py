@@ -0,0 +1,77 @@
+# ############################################################################### #
+# Autoreduction Repository : https://github.com/autoreduction/autoreduce
+#
+# Copyright &copy; 2021 ISIS Rutherford Appleton Laboratory UKRI
+# SPDX - License - Identifier: GPL-3.0-or-later
+# ############################################################################### #
+"""Helpers shared by the test cases."""
+# pylint:disable=no-member
+import time
+from typing import Iterable, Union
+
+from autoreduce_db.reduction_viewer.models import (DataLocation, Experiment, Instrument, ReductionArguments,
+                                                   ReductionRun, ReductionScript, RunNumber, Status)
+
+from autoreduce_rest_api.runs.publishing import MemoryBroker, kafka_producer
+
+
+def create_reduction_run(instrument_name: str,
+                         run_numbers: Union[int, Iterable[int]],
+                         run_version: int = 0,
+                         rb_number: int = 1234567,
+                         batch_run: bool = False) -> ReductionRun:
+    """
+    Creates a reduction run and the records it depends on, as the queue processor would.
+
+    Args:
+        instrument_name: The name of the instrument, which is created if it does not exist
+        run_numbers: The run number, or the run numbers of a batch run
+        run_version: The version of the run
+        rb_number: The experiment reference number
+        batch_run: Whether this is a batch run
+    """
+    if isinstance(run_numbers, int):
+        run_numbers = [run_numbers]
+    instrument, _ = Instrument.objects.get_or_create(name=instrument_name)
+    experiment, _ = Experiment.objects.get_or_create(reference_number=rb_number)
+    reduction_run = ReductionRun.objects.create(
+        run_version=run_version,
+        run_title=f"Title {run_numbers[0]}",
+        experiment=experiment,
+        instrument=instrument,
+        arguments=ReductionArguments.objects.create(raw="{}", instrument=instrument),
+        script=ReductionScript.objects.create(text=""),
+        status=Status.objects.get_or_create(value="q")[0],
+        batch_run=batch_run,
+    )
+    for run_number in run_numbers:
+        RunNumber.objects.create(run_number=run_number, reduction_run=reduction_run)
+        DataLocation.objects.create(file_path=f"/tmp/{instrument_name}{run_number}.nxs", reduction_run=reduction_run)
+    return reduction_run
+
+
+def use_memory_broker(test_case) -> MemoryBroker:
+    """
+    Has the shared producer publish to a MemoryBroker instead of Kafka until the end of the test.
+
+    Returns:
+        The broker, which keeps the messages that were delivered
+    """
+    broker = MemoryBroker()
+    kafka_producer.replace(broker)
+    test_case.addCleanup(kafka_producer.replace)
+    return broker
+
+
+def fake_get_run_data(_instrument, run_number, _file_ext):
+    """Returns run data that can be traced back to the run, failing for odd run numbers above 100."""
+    # finish the runs in the reverse order to check that the output order does not depend on it
+    time.sleep(0.001 * (10 - run_number % 10))
+    if run_number > 100 and run_number % 2:
+        raise RuntimeError(f"Cannot find datafile for {run_number}")
+    return f"/tmp/{run_number}.nxs", "1234567", f"Title {run_number}"
+
+
+def fake_submit_run(_publisher, rb_number, _instrument, data_file_location, run_number, **_):
+    """Returns the message that would have been published."""
+    return {"run_number": run_number, "data": data_file_location, "rb_number": rb_number}
@@ -0,0 +1,407 @@
+"""
+Throttling and admission control of the run submissions.
+
+Without it, a single client posting large ranges of runs fills Kafka and the reduction cluster at the
+expense of every other instrument. A POST to ManageRuns, BatchSubmit or BulkSubmit, or to their
+asynchronous counterparts, is only handled once it has been admitted:
+
+* each token can make AUTOREDUCE_THROTTLE_TOKEN_RATE requests per second, in bursts of up to
+  AUTOREDUCE_THROTTLE_TOKEN_BURST requests
+* each instrument can be sent AUTOREDUCE_THROTTLE_INSTRUMENT_RATE runs per second, in bursts of up to
+  AUTOREDUCE_THROTTLE_INSTRUMENT_BURST runs
+* each instrument can have up to AUTOREDUCE_THROTTLE_MAX_IN_FLIGHT_RUNS runs in the requests being
+  handled, until their response has been sent, or the job they started has finished
+
+The runs of a bulk submission count against the limits of each of its instruments, and no more runs
+can be submitted in a bulk request than to a single instrument.
+
+A request over one of the limits is rejected with a 429 and a Retry-After header, without any of its
+runs being submitted, or counting against the requests of its token. A request with more runs than
+either instrument limit, or than AUTOREDUCE_MAX_RUNS, could never be admitted, so it is rejected with
+a 400 instead. By default the instrument limits are derived from AUTOREDUCE_MAX_RUNS, so that any
+request with valid runs can be admitted.
+
+The "local" backend keeps the limits of each process, and the "django" backend shares them between
+processes through a Django cache. The latter reads and writes the token buckets without a lock, so
+requests racing on the same bucket from several processes may briefly exceed its rate.
+"""
+import hashlib
+import math
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http.response import HttpResponse
+
+from autoreduce_rest_api.runs.encodings import EncodedResponse
+
+from autoreduce_rest_api.runs.metrics import THROTTLED
+from autoreduce_rest_api.runs.run_ranges import parse_runs
+
+# seconds after which a request rejected for the runs in flight is told to retry, as how long
+# the requests in flight take depends on their runs rather than on a rate
+IN_FLIGHT_RETRY_AFTER = 5
+
+
+class Throttled(Exception):
+    """Raised when a submission is not admitted."""
+
+    def __init__(self, message: str, reason: str, retry_after: Optional[float] = None):
+        """
+        Args:
+            message: The error returned to the client
+            reason: The limit that was reached, as labelled in the metrics
+            retry_after: Number of seconds after which the request may be admitted,
+                         or None if it never will be
+        """
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def response(self) -> HttpResponse:
+        """Returns the response to the rejected request."""
+        if self.retry_after is None:
+            return EncodedResponse({"error": str(self)}, status=400)
+        retry_after = math.ceil(self.retry_after)
+        response = EncodedResponse({"error": str(self), "retry_after": retry_after}, status=429)
+        response["Retry-After"] = str(retry_after)
+        return response
+
+
+class RateLimiter:
+    """Token buckets and counters of the runs in flight, kept in this process or in a Django cache."""
+
+    def __init__(self, backend: str = "local", alias: str = "default"):
+        """
+        Args:
+            backend: "local" to keep the limits in this process, "django" to share them through a Django cache
+                     or "none" to admit every request
+            alias: The Django cache used by the "django" backend
+        """
+        if backend not in ("local", "django", "none"):
+            raise ValueError(f"Unknown {type(self).__name__} backend '{backend}'")
+        self.backend = backend
+        self._alias = alias
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether requests are throttled at all."""
+        return self.backend != "none"
+
+    @staticmethod
+    def _django_key(kind: str, key: str) -> str:
+        """Returns the key used in the Django cache, which holds a digest of the key as it may hold a token."""
+        return f"autoreduce_rest_api:throttle:{kind}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+    @staticmethod
+    def _refill(bucket: Optional[Tuple[float, float]], now: float, rate: float, burst: int) -> float:
+        """Returns the tokens in the bucket at the time, which starts full and is refilled at the rate."""
+        if bucket is None:
+            return burst
+        tokens, updated = bucket
+        return min(burst, tokens + (now - updated) * rate)
+
+    def take(self, key: str, cost: int, rate: float, burst: int) -> float:
+        """
+        Takes tokens from the bucket of the key, if it holds enough of them.
+
+        Args:
+            key: The key of the bucket
+            cost: The number of tokens to take
+            rate: The number of tokens per second the bucket is refilled with
+            burst: The number of tokens the bucket holds when full
+
+        Returns:
+            0 if the tokens were taken, otherwise the number of seconds after which the bucket
+            will hold enough of them, in which case none is taken
+        """
+        if not self.enabled:
+            return 0.0
+        if self.backend == "django":
+            cache = caches[self._alias]
+            cache_key = self._django_key("bucket", key)
+            now = time.time()
+            tokens = self._refill(cache.get(cache_key), now, rate, burst)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            # a bucket that would be full again is the same as no bucket
+            cache.set(cache_key, (tokens - cost, now), timeout=math.ceil(burst / rate) + 1)
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            tokens = self._refill(self._buckets.get(key), now, rate, burst)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            self._buckets[key] = (tokens - cost, now)
+            return 0.0
+
+    def refund(self, key: str, cost: int, rate: float, burst: int):
+        """Puts tokens taken by take back into the bucket of the key."""
+        if not self.enabled or not cost:
+            return
+        if self.backend == "django":
+            cache = caches[self._alias]
+            cache_key = self._django_key("bucket", key)
+            now = time.time()
+            tokens = self._refill(cache.get(cache_key), now, rate, burst)
+            cache.set(cache_key, (min(burst, tokens + cost), now), timeout=math.ceil(burst / rate) + 1)
+            return
+        with self._lock:
+            now = time.monotonic()
+            tokens = self._refill(self._buckets.get(key), now, rate, burst)
+            self._buckets[key] = (min(burst, tokens + cost), now)
+
+    def hold(self, key: str, count: int, limit: int) -> bool:
+        """
+        Adds to the number held by the key, unless it would then be over the limit.
+
+        Returns:
+            Whether the count was added
+        """
+        if not self.enabled or not count:
+            return True
+        if self.backend == "django":
+            cache = caches[self._alias]
+            cache_key = self._django_key("in-flight", key)
+            cache.add(cache_key, 0, timeout=None)
+            if cache.incr(cache_key, count) > limit:
+                cache.decr(cache_key, count)
+                return False
+            return True
+        with self._lock:
+            held = self._in_flight.get(key, 0) + count
+            if held > limit:
+                return False
+            self._in_flight[key] = held
+            return True
+
+    def release(self, key: str, count: int):
+        """Removes a count added by hold from the number held by the key."""
+        if not self.enabled or not count:
+            return
+        if self.backend == "django":
+            try:
+                caches[self._alias].decr(self._django_key("in-flight", key), count)
+            except ValueError:
+                # the counter has been evicted from the cache
+                pass
+            return
+        with self._lock:
+            held = self._in_flight.get(key, 0) - count
+            if held > 0:
+                self._in_flight[key] = held
+            else:
+                self._in_flight.pop(key, None)
+
+    def held(self, key: str) -> int:
+        """Returns the number held by the key."""
+        if self.backend == "django":
+            return caches[self._alias].get(self._django_key("in-flight", key), 0)
+        with self._lock:
+            return self._in_flight.get(key, 0)
+
+    def clear(self):
+        """Empties the buckets and counters of the local backend."""
+        with self._lock:
+            self._buckets.clear()
+            self._in_flight.clear()
+
+
+rate_limiter = RateLimiter(backend=settings.AUTOREDUCE_THROTTLE_BACKEND, alias=settings.AUTOREDUCE_THROTTLE_ALIAS)
+
+
+def client_key(request) -> str:
+    """Returns the key of the token the request was authenticated with, or of its user if it had no token."""
+    if request.auth is not None:
+        return f"token:{request.auth.key}"
+    return f"user:{request.user.pk}"
+
+
+def count_runs(data: dict) -> int:
+    """
+    Returns the number of runs of the request, or 0 if they are not valid, as the view will reject them,
+    or if it is a dry run, as they will not be submitted.
+    """
+    if data.get("dry_run"):
+        return 0
+    try:
+        return sum(len(run_range) for run_range in parse_runs(data["runs"]))
+    except (KeyError, ValueError):
+        return 0
+
+
+def max_runs_per_request() -> int:
+    """Returns the number of runs above which a request can never be admitted, nor be valid."""
+    return min(settings.AUTOREDUCE_MAX_RUNS, settings.AUTOREDUCE_THROTTLE_INSTRUMENT_BURST,
+               settings.AUTOREDUCE_THROTTLE_MAX_IN_FLIGHT_RUNS)
+
+
+def count_entry_runs(entries) -> Dict[str, int]:
+    """Returns the number of runs of the entries of a bulk request by instrument, leaving out invalid entries."""
+    instrument_runs: Dict[str, int] = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if isinstance(entry, dict) and isinstance(entry.get("instrument"), str):
+            instrument = entry["instrument"].upper()
+            instrument_runs[instrument] = instrument_runs.get(instrument, 0) + count_runs(entry)
+    return instrument_runs
+
+
+def admit(client: str, instrument: str, data: dict) -> Dict[str, int]:
+    """
+    Admits a submission, taking a request from the bucket of the client and its runs from that of the
+    instrument, and holding its runs as in flight until they are released.
+
+    Args:
+        client: The key of the client, see client_key
+        instrument: The instrument the runs are submitted to
+        data: The data of the request
+
+    Returns:
+        The number of runs held by instrument, to pass to release once the response has been sent
+
+    Raises:
+        Throttled: if the request is not admitted
+    """
+    return admit_runs(client, {instrument.upper(): count_runs(data)})
+
+
+def admit_bulk(client: str, data: dict) -> Dict[str, int]:
+    """Admits a bulk submission, as admit does with the runs of each of the instruments of its entries."""
+    return admit_runs(client, count_entry_runs(data.get("entries")))
+
+
+def admit_runs(client: str, instrument_runs: Dict[str, int]) -> Dict[str, int]:
+    """Admits a request with the number of runs of each instrument, see admit."""
+    try:
+        return _admit(client, instrument_runs)
+    except Throttled as err:
+        THROTTLED.labels(err.reason).inc()
+        raise
+
+
+def _admit(client: str, instrument_runs: Dict[str, int]) -> Dict[str, int]:
+    if not rate_limiter.enabled:
+        return {}
+    max_runs = max_runs_per_request()
+    if any(runs > max_runs for runs in instrument_runs.values()):
+        raise Throttled(f"At most {max_runs} runs can be submitted to an instrument in one request", "runs")
+    if sum(instrument_runs.values()) > max_runs:
+        raise Throttled(f"At most {max_runs} runs can be submitted in one request", "runs")
+
+    wait = rate_limiter.take(client, 1, settings.AUTOREDUCE_THROTTLE_TOKEN_RATE,
+                             settings.AUTOREDUCE_THROTTLE_TOKEN_BURST)
+    if wait:
+        raise Throttled("Too many requests have been made with this token", "token", wait)
+
+    held: Dict[str, int] = {}
+    try:
+        # in the same order in every request, so that requests for the same instruments do not hold runs
+        # of each of them that the other is waiting for
+        for instrument, runs in sorted(instrument_runs.items()):
+            if not rate_limiter.hold(instrument, runs, settings.AUTOREDUCE_THROTTLE_MAX_IN_FLIGHT_RUNS):
+                raise Throttled(f"Too many runs of {instrument} are being submitted", "in_flight",
+                                IN_FLIGHT_RETRY_AFTER)
+            held[instrument] = runs
+        taken = []
+        for instrument, runs in held.items():
+            wait = rate_limiter.take(instrument, runs, settings.AUTOREDUCE_THROTTLE_INSTRUMENT_RATE,
+                                     settings.AUTOREDUCE_THROTTLE_INSTRUMENT_BURST)
+            if wait:
+                for taken_instrument, taken_runs in taken:
+                    rate_limiter.refund(taken_instrument, taken_runs, settings.AUTOREDUCE_THROTTLE_INSTRUMENT_RATE,
+                                        settings.AUTOREDUCE_THROTTLE_INSTRUMENT_BURST)
+                raise Throttled(f"Too many runs have been submitted to {instrument}", "instrument", wait)
+            taken.append((instrument, runs))
+    except Throttled:
+        release(held)
+        # the request is not handled, so it does not count against those of the client
+        rate_limiter.refund(client, 1, settings.AUTOREDUCE_THROTTLE_TOKEN_RATE,
+                            settings.AUTOREDUCE_THROTTLE_TOKEN_BURST)
+        raise
+    return held
+
+
+def release(held: Dict[str, int]):
+    """Releases the runs held by admit."""
+    for instrument, runs in held.items():
+        rate_limiter.release(instrument, runs)
+
+
+class ReleasedContent:
+    """The content of a streaming response, whose runs are released once it has been sent or closed."""
+
+    def __init__(self, content: Iterable[bytes], held: Dict[str, int]):
+        self._content = content
+        self._held = held
+        self._released = False
+
+    def __iter__(self):
+        try:
+            yield from self._content
+        finally:
+            self.close()
+
+    def close(self):
+        """Releases the runs, which StreamingHttpResponse does even if the content was never iterated."""
+        if not self._released:
+            self._released = True
+            release(self._held)
+
+
+def release_when_sent(response: HttpResponse, held: Dict[str, int]) -> HttpResponse:
+    """
+    Releases the runs held by admit now, or once the content has been sent if the response streams,
+    or once the job has finished if the response is that of a job the runs are submitted in.
+    """
+    job = getattr(response, "job", None)
+    if job is not None:
+        job.add_done_callback(lambda: release(held))
+    elif response.streaming:
+        response.streaming_content = ReleasedContent(response.streaming_content, held)
+    else:
+        release(held)
+    return response
+
+
+def throttled(view_method):
+    """Decorates the POST method of a run view, so that it is only handled once admitted."""
+
+    @wraps(view_method)
+    def wrapper(self, request, instrument: str, *args, **kwargs):
+        try:
+            held = admit(client_key(request), instrument, request.data)
+        except Throttled as err:
+            return err.response()
+        return handle_admitted(held, lambda: view_method(self, request, instrument, *args, **kwargs))
+
+    return wrapper
+
+
+def throttled_bulk(view_method):
+    """Decorates the POST method of the bulk view, so that it is only handled once admitted."""
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        try:
+            held = admit_bulk(client_key(request), request.data)
+        except Throttled as err:
+            return err.response()
+        return handle_admitted(held, lambda: view_method(self, request, *args, **kwargs))
+
+    return wrapper
+
+
+def handle_admitted(held: Dict[str, int], get_response: Callable[[], HttpResponse]) -> HttpResponse:
+    """Returns the response of an admitted request, releasing its runs once they are no longer in flight."""
+    try:
+        response = get_response()
+    except BaseException:
+        release(held)
+        raise
+    return release_when_sent(response, held)
@@ -1,10 +1,23 @@
 from django.urls import path
 
-from autoreduce_rest_api.runs import views
+from autoreduce_rest_api.runs import async_views, views
 
 app_name = "runs"
 
 urlpatterns = [
     path('runs/<str:instrument>', views.ManageRuns.as_view(), name="manage"),
     path('runs/batch/<str:instrument>', views.BatchSubmit.as_view(), name="batch"),
+    # under its own prefix, so that it cannot take the name of an instrument
+    path('bulk/runs', views.BulkSubmit.as_view(), name="bulk"),
+    path('plan/runs/<str:instrument>', views.RunPlan.as_view(), name="plan"),
+    path('plan/runs/batch/<str:instrument>', views.RunPlan.as_view(batch=True), name="plan-batch"),
+    path('async/runs/<str:instrument>', async_views.manage_runs, name="async-manage"),
+    path('async/runs/batch/<str:instrument>', async_views.batch_submit, name="async-batch"),
+    path('async/events/<str:instrument>', async_views.run_events, name="async-events"),
+    path('jobs/<str:job_id>', views.JobStatus.as_view(), name="job"),
+    path('scripts', views.ReductionScripts.as_view(), name="scripts"),
+    path('scripts/<str:script_hash>', views.ReductionScript.as_view(), name="script"),
+    path('cache/runs', views.RunMetadataCacheView.as_view(), name="run-cache"),
+    path('cache/runs/<str:instrument>', views.InstrumentRunMetadataCacheView.as_view(), name="run-cache-instrument"),
+    path('cache/tokens', views.TokenCacheView.as_view(), name="token-cache"),
 ]
@@ -1,29 +1,201 @@
-from django.http.response import JsonResponse
+from functools import partial
+from typing import Iterable, Iterator, List
+
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from rest_framework import authentication, permissions
+from rest_framework import permissions
 
-from autoreduce_scripts.manual_operations.manual_submission import main as submit_main
-from autoreduce_scripts.manual_operations.manual_batch_submit import main as submit_batch_main
-from autoreduce_scripts.manual_operations.manual_remove import main as remove_main
+from autoreduce_rest_api.runs.authentication import CachedTokenAuthentication
+from autoreduce_rest_api.runs.bulk import submit_entries, validate_entries
+from autoreduce_rest_api.runs.cache import run_metadata_cache, token_cache
+from autoreduce_rest_api.runs.encodings import EncodedResponse, MessagePackParser, MessagePackRenderer
+from autoreduce_rest_api.runs.idempotency import idempotent
+from autoreduce_rest_api.runs.jobs import Job, JobQueueFull, job_manager
+from autoreduce_rest_api.runs.metrics import time_stage
+from autoreduce_rest_api.runs.planning import plan_removal, plan_submission
+from autoreduce_rest_api.runs.run_list import RunListQuery, run_list_etag, run_list_last_modified
+from autoreduce_rest_api.runs.removal import REMOVED, remove_runs_in_bulk
+from autoreduce_rest_api.runs.run_ranges import expand_runs
+from autoreduce_rest_api.runs.script_store import resolve_reduction_script, script_store
+from autoreduce_rest_api.runs.streaming import (NDJSONRenderer, accepts_ndjson, batch_lines, ndjson_response, prime,
+                                                submission_lines)
+from autoreduce_rest_api.runs.submission import (DEFAULT_SOFTWARE, RunResult, SubmissionError, iter_submissions,
+                                                 submit_batch)
+from autoreduce_rest_api.runs.throttling import throttled, throttled_bulk
 
 
-def get_common_args_from_request(request):
+def get_common_args(data: dict):
     """Gets common arguments that are used in all POST views"""
-    return (request.data.get("reduction_arguments", {}), request.data.get("user_id", -1),
-            request.data.get("description", ""), request.data.get("software", {
-                "name": "Mantid",
-                "version": "latest"
-            }))
+    return (data.get("reduction_arguments",
+                     {}), data.get("user_id", -1), data.get("description", ""), data.get("software", DEFAULT_SOFTWARE))
 
 
 NO_RUNS_KEY_MESSAGE = "No 'runs' key specified"
+NO_SCRIPT_KEY_MESSAGE = "'script' must be a non-empty string"
+SCRIPT_NOT_FOUND_MESSAGE = "No reduction script is stored with this hash"
+NO_ENTRIES_KEY_MESSAGE = "'entries' must be a non-empty list"
+INVALID_ENTRIES_MESSAGE = "Some of the entries are invalid, nothing has been submitted"
+JOB_NOT_FOUND_MESSAGE = "No job found with this ID"
+
+
+def get_runs(data: dict) -> Iterator[int]:
+    """
+    Returns a generator of the run numbers of the request, which may be given as range expressions.
+
+    Raises:
+        ValueError: if the runs are missing, invalid or too many, see run_ranges.expand_runs
+    """
+    if "runs" not in data:
+        raise ValueError(NO_RUNS_KEY_MESSAGE)
+    return expand_runs(data["runs"])
+
+
+def submit_runs_in_job(job: Job, instrument: str, **kwargs):
+    """
+    Submits the job's runs, recording the outcome of each run as soon as it is known
+    so that the progress can be followed while the job is running.
+    """
+    for result in iter_submissions(instrument, list(job.runs), **kwargs):
+        job.record(result)
+
+
+def error_response(message, status=400, **extra):
+    """Common function to return an EncodedResponse with an error key"""
+    return EncodedResponse({"error": message, **extra}, status=status)
+
+
+# The functions below hold the work of the run views. They only take the parsed request
+# data, so that they are shared by the views below and their counterparts in async_views.
+
+
+def submit_runs(instrument: str, data: dict, stream: bool = False):
+    """
+    Submits the runs of a POST to ManageRuns, see ManageRuns.post.
+    If stream is True, the result of each run is streamed as newline delimited JSON.
+    """
+    try:
+        runs = get_runs(data)
+        reduction_script = resolve_reduction_script(data)
+    except ValueError as err:
+        return error_response(str(err))
+    if data.get("dry_run", False):
+        return EncodedResponse(plan_submission(instrument, list(runs)))
+    reduction_arguments, user_id, description, software = get_common_args(data)
+    if data.get("async", False):
+        return submit_job(instrument,
+                          runs,
+                          software=software,
+                          reduction_script=reduction_script,
+                          reduction_arguments=reduction_arguments,
+                          user_id=user_id,
+                          description=description)
+    try:
+        results = iter_submissions(instrument,
+                                   runs,
+                                   software=software,
+                                   reduction_script=reduction_script,
+                                   reduction_arguments=reduction_arguments,
+                                   user_id=user_id,
+                                   description=description)
+        if stream:
+            return ndjson_response(submission_lines(prime(results)))
+        results = list(results)
+    except RuntimeError as err:
+        return error_response(str(err))
+    return submission_response(results)
+
+
+def submission_response(results: List[RunResult]):
+    """
+    Returns the response to a submission of runs, which is an error if none of them were submitted.
+    """
+    submitted_runs = [result.message for result in results if result.status == RunResult.SUBMITTED]
+    failed_runs = [result.to_dict() for result in results if result.status == RunResult.FAILED]
+    if failed_runs and not submitted_runs:
+        return error_response(failed_runs[0]["error"], failed_runs=failed_runs)
+    return EncodedResponse({"submitted_runs": submitted_runs, "failed_runs": failed_runs})
+
+
+def submit_job(instrument: str, runs: Iterable[int], **kwargs):
+    """
+    Queues the runs for submission in a background job.
+
+    Returns:
+        A 202 response with the ID of the job and the URL at which its status can be queried
+    """
+    job = Job(instrument.upper(), runs)
+    try:
+        job_manager.submit(job, partial(submit_runs_in_job, instrument=instrument, **kwargs))
+    except JobQueueFull as err:
+        return error_response(str(err), status=503)
+    status_url = reverse("runs:job", kwargs={"job_id": job.job_id})
+    response = EncodedResponse({"job_id": job.job_id, "status": job.status, "status_url": status_url}, status=202)
+    response["Location"] = status_url
+    # the runs are in flight until the job has finished, see throttling.release_when_sent
+    response.job = job
+    return response
+
+
+def submit_batch_runs(instrument: str, data: dict, stream: bool = False):
+    """
+    Submits the runs of a POST to BatchSubmit, see BatchSubmit.post.
+    If stream is True, the lookup of each run is streamed as newline delimited JSON.
+    """
+    try:
+        runs = get_runs(data)
+    except ValueError as err:
+        return error_response(str(err))
+    if data.get("dry_run", False):
+        return EncodedResponse(plan_submission(instrument, list(runs), batch=True))
+    reduction_arguments, user_id, description, software = get_common_args(data)
+    batch_args = {
+        "software": software,
+        "reduction_script": None,
+        "reduction_arguments": reduction_arguments,
+        "user_id": user_id,
+        "description": description,
+    }
+    try:
+        if stream:
+            return ndjson_response(prime(batch_lines(instrument, runs, **batch_args)))
+        return EncodedResponse({"submitted_runs": submit_batch(instrument, runs, **batch_args)})
+    except SubmissionError as err:
+        return error_response(str(err), failed_runs=[result.to_dict() for result in err.failed_runs])
+    except RuntimeError as err:
+        return error_response(str(err))
+
+
+def remove_runs(instrument: str, data: dict, batch: bool = False):
+    """Removes the runs of a DELETE to ManageRuns, or to BatchSubmit if batch is True"""
+    try:
+        runs = get_runs(data)
+    except ValueError as err:
+        return error_response(str(err))
+    if data.get("dry_run", False):
+        return EncodedResponse(plan_removal(instrument, list(runs), batch=batch))
+    try:
+        with time_stage("remove"):
+            report = remove_runs_in_bulk(instrument, runs, batch=batch)
+    except RuntimeError as err:
+        return error_response(str(err))
+    return EncodedResponse({
+        "removed_runs": [result["run_number"] for result in report if result["status"] == REMOVED],
+        "runs": report
+    })
 
 
 class CommonAPIView(APIView):
+    # the bodies can also be MessagePack, and compressed (see encodings)
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [MessagePackParser]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [MessagePackRenderer]
 
-    def error(self, message):
-        """Common function to return a JsonResponse with an error key"""
-        return JsonResponse({"error": message}, status=400)
+    def error(self, message, status=400, **extra):
+        """Common function to return an EncodedResponse with an error key"""
+        return error_response(message, status=status, **extra)
 
 
 class ManageRuns(CommonAPIView):
@@ -34,94 +206,114 @@ class ManageRuns(CommonAPIView):
     * Only admin users are able to access this view.
     """
 
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
 
     permission_classes = [permissions.IsAuthenticated]
 
+    # the results of a POST can be streamed (see streaming)
+    renderer_classes = CommonAPIView.renderer_classes + [NDJSONRenderer]
+
+    @method_decorator(condition(etag_func=run_list_etag, last_modified_func=run_list_last_modified))
+    def get(self, request, instrument: str):
+        """
+        Lists the runs of the instrument, newest first, a page at a time.
+
+        GET query args:
+            runs: Optional range expression of the run numbers to list, such as "100-200,210"
+            status: Optional comma separated statuses to list, e.g. "Queued,Processing"
+            fields: Optional comma separated fields to return, all of them by default
+            limit: Optional number of runs in a page
+            cursor: The position of the page, set in the 'next' link of the previous page
+
+        Returns:
+            runs: The selected fields of each run of the page
+            next: The URL of the next page, or null if this is the last one
+
+        The response has an ETag and a Last-Modified date, and is a 304 if they match
+        the If-None-Match or If-Modified-Since headers (see run_list).
+        """
+        try:
+            query = RunListQuery(instrument, request.query_params)
+        except ValueError as err:
+            return self.error(str(err))
+        response = EncodedResponse(query.page(request.path))
+        # pollers must check that the runs have not changed, which the ETag makes cheap
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @idempotent
+    @throttled
     def post(self, request, instrument: str):
         """
         Submits the runs via manual submission on a POST request.
 
         POST data args:
-            runs: List of int run numbers to submit
+            runs: Run numbers to submit, as a list or as ranges such as "100-200,210-220:2" (see run_ranges)
+            reduction_script: Optional reduction script to use instead of the instrument's
+            reduction_script_hash: Optional hash of a reduction script uploaded to /api/scripts, to use instead
+                                   of sending the script itself
             reduction_arguments: Dictionary of arguments that will be sent in the Message
             user_id: User ID of the user who submitted the runs
             description: Description of the run
+            async: If true, the runs are submitted in a background job and
+                   the response is returned before they have been submitted
+            dry_run: If true, nothing is submitted and the plan of the submission is returned (see RunPlan)
 
         Returns:
             submitted_runs: List of run numbers that were submitted
+            failed_runs: The runs that could not be submitted, with the reason why
+            or, if async was requested,
+            job_id: ID of the job to query at /api/jobs/<job_id>
+            or, if the Accept header is application/x-ndjson,
+            a line for each run as soon as it is submitted or fails, then a summary line
+
+        A retry with the same Idempotency-Key header returns the first response again (see idempotency).
+        Requests over the limits of the token or the instrument are rejected with a 429 (see throttling).
         """
-        if "runs" not in request.data:
-            return self.error(NO_RUNS_KEY_MESSAGE)
-        reduction_arguments, user_id, description, software = get_common_args_from_request(request)
-        if request.data.get('reduction_script') is not None:
-            reduction_script = request.data.get("reduction_script")
-        else:
-            reduction_script = None
-        try:
-            submitted_runs = submit_main(instrument,
-                                         request.data["runs"],
-                                         software=software,
-                                         reduction_script=reduction_script,
-                                         reduction_arguments=reduction_arguments,
-                                         user_id=user_id,
-                                         description=description)
-            return JsonResponse({"submitted_runs": submitted_runs})
-        except RuntimeError as err:
-            return self.error(str(err))
+        return submit_runs(instrument, request.data, stream=accepts_ndjson(request))
 
     def delete(self, request, instrument: str):
         """
         Delete the runs via manual remove on a DELETE request.
 
         DELETE data args:
-            runs: List of int run numbers to submit
+            runs: Run numbers to remove, in the same forms as for a POST
+            dry_run: If true, nothing is removed and the plan of the removal is returned (see RunPlan)
 
         Returns:
             removed_runs: List of run numbers that were deleted
+            runs: The status of each run, removed, not_found or failed, and the versions that were found
         """
-        if "runs" not in request.data:
-            return self.error(NO_RUNS_KEY_MESSAGE)
-        try:
-            removed_runs = remove_main(instrument, request.data["runs"], delete_all_versions=True, no_input=True)
-            return JsonResponse({"removed_runs": removed_runs})
-        except RuntimeError as err:
-            return self.error(str(err))
+        return remove_runs(instrument, request.data)
 
 
 class BatchSubmit(CommonAPIView):
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = ManageRuns.renderer_classes
 
+    @idempotent
+    @throttled
     def post(self, request, instrument: str):
         """
         Submits the runs as a batch reduction
 
         POST data args:
-            runs: List of int run numbers to submit
+            runs: Run numbers to submit, as a list or as ranges such as "100-200,210-220:2" (see run_ranges)
             reduction_arguments: Dictionary of arguments that will be sent in the Message
             user_id: User ID of the user who submitted the runs
             description: Description of the run
+            dry_run: If true, nothing is submitted and the plan of the submission is returned (see RunPlan)
 
         Returns:
             submitted_runs: List of run numbers that were submitted
+            or, if the Accept header is application/x-ndjson,
+            a line for each run as soon as it is looked up, then a summary line
+
+        A retry with the same Idempotency-Key header returns the first response again (see idempotency).
+        Requests over the limits of the token or the instrument are rejected with a 429 (see throttling).
         """
-        if "runs" not in request.data:
-            return self.error(NO_RUNS_KEY_MESSAGE)
-        reduction_arguments, user_id, description, software = get_common_args_from_request(request)
-        try:
-            return JsonResponse({
-                "submitted_runs":
-                submit_batch_main(instrument,
-                                  request.data["runs"],
-                                  software=software,
-                                  reduction_script=None,
-                                  reduction_arguments=reduction_arguments,
-                                  user_id=user_id,
-                                  description=description)
-            })
-        except RuntimeError as err:
-            return self.error(str(err))
+        return submit_batch_runs(instrument, request.data, stream=accepts_ndjson(request))
 
     # pylint:disable=invalid-name
     def delete(self, request, instrument: str):
@@ -129,17 +321,198 @@ class BatchSubmit(CommonAPIView):
         Deletes the batch reduction
 
         DELETE data args:
-            runs: List of int run numbers to submit
+            runs: Run numbers to remove, in the same forms as for a POST
+            dry_run: If true, nothing is removed and the plan of the removal is returned (see RunPlan)
 
         Returns:
             removed_runs: List of run numbers that were deleted
+            runs: The status of each run, removed, not_found or failed, and the versions that were found
         """
-        if "runs" not in request.data:
-            return self.error(NO_RUNS_KEY_MESSAGE)
+        return remove_runs(instrument, request.data, batch=True)
+
+
+class RunPlan(CommonAPIView):
+    """Plans the requests to ManageRuns, or to BatchSubmit if batch is True, without making them."""
+
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    batch = False
+
+    def post(self, request, instrument: str):
+        """
+        Plans a submission, checking it against the instruments and the runs that are already known
+        (see planning), without looking the runs up in ICAT or submitting them.
+
+        POST data args:
+            The same as for a POST to the view that is planned for
+
+        Returns:
+            instrument: The name of the instrument
+            action: "submit"
+            batch: Whether the runs would be submitted as a batch
+            errors: The problems that would make the submission fail, such as an unknown instrument
+            warnings: The problems that would not, such as a paused instrument
+            counts: The number of runs of each status
+            runs: Each run with its status, "submit" if it is known with the RB number given,
+                  or "lookup" if whether it can be submitted depends on ICAT
+        """
+        data = {**request.data, "dry_run": True}
+        if self.batch:
+            return submit_batch_runs(instrument, data)
+        return submit_runs(instrument, data)
+
+    def delete(self, request, instrument: str):
+        """
+        Plans a removal, finding the versions of the runs that would be removed, without removing them.
+
+        DELETE data args:
+            The same as for a DELETE to the view that is planned for
+
+        Returns:
+            The same as for a POST, with the action "remove", and the status of each run "remove",
+            with the versions that would be removed, or "not_found"
+        """
+        return remove_runs(instrument, {**request.data, "dry_run": True}, batch=self.batch)
+
+
+class BulkSubmit(CommonAPIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    @throttled_bulk
+    def post(self, request):
+        """
+        Submits runs for several instruments in one request. All entries are validated
+        before any run is submitted, so an invalid entry means nothing is submitted.
+
+        POST data args:
+            entries: List of objects, each with the same arguments as a POST to /api/runs/<instrument>
+                     and an additional instrument key
+
+        Returns:
+            results: The submitted_runs and failed_runs of each entry, or its error, in the order of the entries
+
+        The runs of each instrument count against its limits, and requests over them, or over the limits
+        of the token, are rejected with a 429 (see throttling).
+        """
+        entries = request.data.get("entries")
+        if not isinstance(entries, list) or not entries:
+            return self.error(NO_ENTRIES_KEY_MESSAGE)
+        errors = validate_entries(entries)
+        if errors:
+            return self.error(INVALID_ENTRIES_MESSAGE, entries={str(index): error for index, error in errors.items()})
+        return EncodedResponse({"results": submit_entries(entries)})
+
+
+class ReductionScripts(CommonAPIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        """
+        Uploads a reduction script, for submissions to refer to by its hash (see script_store).
+
+        POST data args:
+            script: The reduction script
+
+        Returns:
+            script_hash: The hash to send as the reduction_script_hash of the submissions
+            size: The size of the script in bytes
+            with a 201 if the script was not already stored, otherwise a 200
+        """
+        script = request.data.get("script")
+        if not isinstance(script, str) or not script:
+            return self.error(NO_SCRIPT_KEY_MESSAGE)
         try:
-            return JsonResponse({
-                "removed_runs":
-                remove_main(instrument, request.data["runs"], delete_all_versions=True, no_input=True, batch=True)
-            })
-        except RuntimeError as err:
-            return self.error(str(err))
+            key, created = script_store.put(script)
+        except ValueError as err:
+            return self.error(str(err), status=413)
+        url = reverse("runs:script", kwargs={"script_hash": key})
+        response = EncodedResponse({"script_hash": key, "size": len(script.encode())}, status=201 if created else 200)
+        response["Location"] = url
+        return response
+
+
+class ReductionScript(CommonAPIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, script_hash: str):  # pylint:disable=unused-argument
+        """
+        Returns a reduction script that was uploaded to /api/scripts.
+
+        Returns:
+            script_hash: The hash of the script
+            script: The reduction script
+        """
+        script = script_store.get(script_hash)
+        if script is None:
+            return self.error(SCRIPT_NOT_FOUND_MESSAGE, status=404)
+        return EncodedResponse({"script_hash": script_hash, "script": script})
+
+
+class JobStatus(CommonAPIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id: str):  # pylint:disable=unused-argument
+        """
+        Returns the status of a job created by an asynchronous submission.
+
+        Returns:
+            The job's overall status, the status of each of its runs
+            and the runs that have been submitted so far
+        """
+        job = job_manager.get(job_id)
+        if job is None:
+            return self.error(JOB_NOT_FOUND_MESSAGE, status=404)
+        return EncodedResponse(job.to_dict())
+
+
+class RunMetadataCacheView(CommonAPIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):  # pylint:disable=unused-argument
+        """
+        Returns the statistics of the run metadata cache.
+
+        Returns:
+            The backend in use, the hit and miss counters and the number of cached runs
+        """
+        return EncodedResponse(run_metadata_cache.stats())
+
+
+class InstrumentRunMetadataCacheView(CommonAPIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    def delete(self, request, instrument: str):
+        """
+        Invalidates the cached metadata of an instrument's runs, so that they are looked up again.
+
+        DELETE data args:
+            runs: Optional list of int run numbers to invalidate. If not given, all of the instrument's runs are
+
+        Returns:
+            invalidated_runs: The run numbers that were invalidated, or null if all were
+        """
+        run_numbers = request.data.get("runs")
+        if run_numbers is not None and not isinstance(run_numbers, list):
+            run_numbers = [run_numbers]
+        run_metadata_cache.invalidate(instrument.upper(), run_numbers)
+        return EncodedResponse({"instrument": instrument.upper(), "invalidated_runs": run_numbers})
+
+
+class TokenCacheView(CommonAPIView):
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):  # pylint:disable=unused-argument
+        """
+        Returns the statistics of the token authentication cache.
+
+        Returns:
+            The backend in use, the hit and miss counters and the number of cached tokens
+        """
+        return EncodedResponse(token_cache.stats())
@@ -0,0 +1,246 @@
+"""
+Notifies clients of the status transitions of reduction runs, as they are picked up from the database.
+
+A single thread per process polls the database for the runs updated since its last poll, and records
+their status transitions as numbered events. Requests long-poll for the events after the cursor of
+their previous response, waiting on the event loop without holding a thread. Any number of them is
+served by the one query made by the watcher every AUTOREDUCE_WATCH_INTERVAL seconds.
+
+The watcher starts with the first waiting request, and stops once no request has waited on it for
+AUTOREDUCE_WATCH_IDLE seconds, so that the database is not polled when nobody listens. It keeps its
+watermark while stopped, so its first poll after a restart records the transitions made in between,
+and the clients keep their cursors. If more of them were made than the history holds, the clients
+are told that they missed some.
+
+Under hurricane each waiting request holds a server thread until it returns, so no more than
+AUTOREDUCE_WATCH_MAX_WAITERS requests can wait at the same time, and the others are rejected with a 503.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from autoreduce_db.reduction_viewer.models import ReductionRun, RunNumber, Status
+
+logger = logging.getLogger(__name__)
+
+# runs are polled again for this long after their update, in case the transaction that updated
+# them committed after a poll had already moved past their last_updated
+OVERLAP = timedelta(seconds=10)
+STATUSES = dict(Status.STATUS_CHOICES)
+
+
+class TooManyWaiters(Exception):
+    """Raised when a request would wait while the most requests allowed are waiting already."""
+
+
+def wake(future: asyncio.Future):
+    """Wakes a waiting request, unless it has already stopped waiting."""
+    if not future.done():
+        future.set_result(None)
+
+
+class RunWatcher:
+    """
+    Polls the database for the status transitions of the reduction runs, in a thread shared by all
+    the requests, and keeps a bounded history of them.
+    """
+
+    def __init__(self, interval: float, history: int, idle: float, max_waiters: int):
+        """
+        Args:
+            interval: Number of seconds between two polls of the database
+            history: Number of events kept, for the requests that have not yet been given them
+            idle: Number of seconds without a waiting request after which the watcher stops
+            max_waiters: Number of requests that can wait at the same time
+        """
+        self.interval = interval
+        self.idle = idle
+        self.max_waiters = max_waiters
+        self._waiting = 0
+        self._events = deque(maxlen=history)
+        self._cursor = 0
+        self._lock = threading.RLock()
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = set()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._last_waited = 0.0
+        self._watermark = None
+        # the last update and status of the runs updated since the watermark minus the overlap
+        self._known: Dict[int, Tuple[object, str]] = {}
+
+    @property
+    def cursor(self) -> int:
+        """The cursor of the latest event."""
+        with self._lock:
+            return self._cursor
+
+    def start(self):
+        """
+        Starts watching the database, unless it is being watched already. The first poll after a restart
+        picks up from where the watcher stopped, so that the transitions made in between are recorded.
+        """
+        with self._lock:
+            self._last_waited = time.monotonic()
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="run-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops watching the database, once the poll in progress if any has finished."""
+        with self._lock:
+            thread = self._thread
+            self._stopping.set()
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        """Polls the database until the watcher has been idle for long enough, or is stopped."""
+        while True:
+            with self._lock:
+                idle = not self._waiters and time.monotonic() - self._last_waited > self.idle
+                if idle or self._stopping.is_set():
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except DatabaseError:
+                logger.exception("Could not poll the reduction runs")
+            finally:
+                # the watcher is not a request thread, so Django does not manage its connection
+                close_old_connections()
+            self._stopping.wait(self.interval)
+
+    def poll(self):
+        """
+        Records the status transitions of the runs updated since the last poll, and wakes the waiting requests.
+        The very first poll only records the current status of the recently updated runs, to compare the next ones to.
+        """
+        first_poll = self._watermark is None
+        if first_poll:
+            self._watermark = timezone.now()
+            self._known.clear()
+        runs = list(
+            ReductionRun.objects.filter(last_updated__gte=self._watermark - OVERLAP).order_by(
+                "last_updated", "pk").values("pk", "instrument__name", "status__value", "run_version", "batch_run",
+                                             "last_updated"))
+        updated = [run for run in runs if self._known.get(run["pk"], (None, ))[0] != run["last_updated"]]
+        transitions = [run for run in updated if self._known.get(run["pk"], (None, None))[1] != run["status__value"]]
+        for run in updated:
+            self._known[run["pk"]] = (run["last_updated"], run["status__value"])
+        if runs:
+            self._watermark = max(self._watermark, runs[-1]["last_updated"])
+        self._known = {pk: known for pk, known in self._known.items() if known[0] >= self._watermark - OVERLAP}
+        if transitions and not first_poll:
+            self._record(transitions, self._run_numbers(run["pk"] for run in transitions))
+
+    @staticmethod
+    def _run_numbers(pks: Iterable[int]) -> Dict[int, List[int]]:
+        run_numbers = {}
+        for reduction_run_id, run_number in RunNumber.objects \
+                .filter(reduction_run_id__in=list(pks)) \
+                .order_by("run_number") \
+                .values_list("reduction_run_id", "run_number"):
+            run_numbers.setdefault(reduction_run_id, []).append(run_number)
+        return run_numbers
+
+    def _record(self, transitions: List[dict], run_numbers: Dict[int, List[int]]):
+        with self._lock:
+            for run in transitions:
+                self._cursor += 1
+                self._events.append({
+                    "cursor": self._cursor,
+                    "id": run["pk"],
+                    "instrument": run["instrument__name"],
+                    "run_numbers": run_numbers.get(run["pk"], []),
+                    "run_version": run["run_version"],
+                    "batch_run": run["batch_run"],
+                    "status": STATUSES.get(run["status__value"], run["status__value"]),
+                    "last_updated": run["last_updated"],
+                })
+            waiters = list(self._waiters)
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(wake, future)
+            except RuntimeError:
+                # the loop of the request has been closed
+                pass
+
+    def events_after(self, cursor: int, instrument: str, ids: Optional[Set[int]]) -> List[dict]:
+        """Returns the events after the cursor for the runs of the instrument, and with one of the IDs if given."""
+        with self._lock:
+            return [
+                event for event in self._events if event["cursor"] > cursor and event["instrument"] == instrument and (
+                    ids is None or event["id"] in ids)
+            ]
+
+    async def wait(self,
+                   instrument: str,
+                   cursor: Optional[int] = None,
+                   ids: Optional[Set[int]] = None,
+                   timeout: float = 30) -> Tuple[List[dict], int, bool]:
+        """
+        Waits for the events after the cursor, for the runs of the instrument and with one of the IDs if given.
+
+        Args:
+            instrument: The name of the instrument of the runs, in upper case
+            cursor: The cursor returned by the previous call. If None, only the events from now on are returned
+            ids: The primary keys of the reduction runs to return the events of, all of them if None
+            timeout: Number of seconds after which no events are returned, if none has happened
+
+        Returns:
+            The events, the cursor to pass to the next call and whether some events after
+            the cursor were discarded from the history before they could be returned
+
+        Raises:
+            TooManyWaiters: if max_waiters requests are waiting already
+        """
+        with self._lock:
+            if self._waiting >= self.max_waiters:
+                raise TooManyWaiters(f"No more than {self.max_waiters} requests can wait for events at the same time")
+            self._waiting += 1
+        try:
+            return await self._wait(instrument, cursor, ids, timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    async def _wait(self, instrument: str, cursor: Optional[int], ids: Optional[Set[int]],
+                    timeout: float) -> Tuple[List[dict], int, bool]:
+        self.start()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._lock:
+                if cursor is None:
+                    cursor = self._cursor
+                missed = bool(self._events) and cursor < self._events[0]["cursor"] - 1
+                events = self.events_after(cursor, instrument, ids)
+                remaining = deadline - loop.time()
+                if events or missed or remaining <= 0:
+                    return events, self._cursor, missed
+                waiter = (loop, loop.create_future())
+                self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    self._waiters.discard(waiter)
+                    self._last_waited = time.monotonic()
+
+
+run_watcher = RunWatcher(interval=settings.AUTOREDUCE_WATCH_INTERVAL,
+                         history=settings.AUTOREDUCE_WATCH_HISTORY,
+                         idle=settings.AUTOREDUCE_WATCH_IDLE,
+                         max_waiters=settings.AUTOREDUCE_WATCH_MAX_WAITERS)
@@ -0,0 +1,146 @@
+"""
+Compares the requests per second and the latency of run submissions made by many concurrent clients to
+the sync views, served through WSGI from a thread pool as hurricane serves them, and to the asynchronous
+views, served through ASGI.
+
+Both stacks are driven in process, so the figures leave out the network and the HTTP parsing of the
+server. ICAT and the datafile read are replaced by stubs, the ICAT stub sleeping for the given latency,
+Kafka by an in-memory broker, and the token is accepted without a database query, so no external service
+is needed.
+The thread pool of the asynchronous views is sized by the AUTOREDUCE_ASYNC_WORKERS environment variable.
+
+Usage:
+    python -m benchmarks.bench_async_views --clients 100 200 --requests 5 --latency 0.05 --threads 8
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "autoreduce_rest_api.autoreduce_django.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "testserver")
+# neither the instrument cap nor the cache should be what limits the requests
+os.environ.setdefault("AUTOREDUCE_INSTRUMENT_CONCURRENCY", "1024")
+os.environ.setdefault("AUTOREDUCE_RUN_CACHE_BACKEND", "none")
+# the messages are kept in the process rather than published to Kafka
+os.environ.setdefault("AUTOREDUCE_KAFKA_BACKEND", "memory")
+django.setup()
+
+# pylint:disable=wrong-import-position
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.test import AsyncClient, Client  # noqa: E402
+
+INSTRUMENT_NAME = "BENCHINSTRUMENT"
+AUTHORIZATION = "Token benchmark"
+
+
+def stub_services(stack: ExitStack, latency: float):
+    """Replaces the external services with stubs for as long as the stack is open."""
+
+    def slow_icat(_instrument, run_number, _file_ext):
+        time.sleep(latency)
+        return f"/tmp/{INSTRUMENT_NAME}{run_number}.nxs", "1234567"
+
+    for target, kwargs in (
+        ("autoreduce_scripts.manual_operations.manual_submission.get_run_data_from_database", {
+            "return_value": (None, None, None)
+        }),
+        ("autoreduce_scripts.manual_operations.manual_submission.get_run_data_from_icat", {
+            "side_effect": slow_icat
+        }),
+        ("autoreduce_scripts.manual_operations.manual_submission.read_from_datafile", {
+            "return_value": "Benchmark title"
+        }),
+        ("rest_framework.authentication.TokenAuthentication.authenticate_credentials", {
+            "return_value": (User(username="benchmark"), None)
+        }),
+    ):
+        stack.enter_context(patch(target, **kwargs))
+
+
+async def run_clients(send, clients: int, requests: int):
+    """
+    Runs the clients concurrently, each sending its requests one after the other.
+
+    Returns:
+        The wall time and the latency of each request
+    """
+    latencies = []
+
+    async def client(index: int):
+        for request in range(requests):
+            start = time.perf_counter()
+            status_code = await send(index * requests + request)
+            latencies.append(time.perf_counter() - start)
+            assert status_code == 200, status_code
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(clients)))
+    return time.perf_counter() - start, latencies
+
+
+async def run_wsgi(clients: int, requests: int, threads: int):
+    """Sends the requests to the sync view, each handled by one of the threads of the server."""
+    loop = asyncio.get_running_loop()
+
+    def post(run_number: int) -> int:
+        response = Client().post(f"/api/runs/{INSTRUMENT_NAME}", {"runs": [run_number]},
+                                 content_type="application/json",
+                                 HTTP_AUTHORIZATION=AUTHORIZATION)
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=threads) as server:
+        return await run_clients(lambda run_number: loop.run_in_executor(server, post, run_number), clients, requests)
+
+
+async def run_asgi(clients: int, requests: int):
+    """Sends the requests to the asynchronous view."""
+    client = AsyncClient()
+
+    async def post(run_number: int) -> int:
+        response = await client.post(f"/api/async/runs/{INSTRUMENT_NAME}", {"runs": [run_number]},
+                                     content_type="application/json",
+                                     authorization=AUTHORIZATION)
+        return response.status_code
+
+    return await run_clients(post, clients, requests)
+
+
+def run_benchmark(latency: float, client_counts: list, requests: int, threads: int):
+    """Runs both stacks at each number of clients and prints their throughput and latencies."""
+    with ExitStack() as stack:
+        stub_services(stack, latency)
+        print(f"ICAT latency: {latency * 1000:.0f} ms, WSGI threads: {threads}, "
+              f"async view threads: {settings.AUTOREDUCE_ASYNC_WORKERS}, requests per client: {requests}")
+        print(f"{'stack':>6} {'clients':>8} {'requests/s':>11} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+        for clients in client_counts:
+            stacks = {"wsgi": lambda: run_wsgi(clients, requests, threads), "asgi": lambda: run_asgi(clients, requests)}
+            for name, run_stack in stacks.items():
+                elapsed, latencies = asyncio.run(run_stack())
+                percentiles = statistics.quantiles(latencies, n=100)
+                print(f"{name:>6} {clients:>8} {len(latencies) / elapsed:>11.1f} {percentiles[49] * 1000:>9.0f} "
+                      f"{percentiles[98] * 1000:>9.0f}")
+
+
+def main():
+    """Parses the command line arguments and runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each ICAT lookup takes")
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 200], help="Concurrent client counts")
+    parser.add_argument("--requests", type=int, default=5, help="Requests sent by each client")
+    parser.add_argument("--threads", type=int, default=8, help="Threads of the WSGI server")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    run_benchmark(args.latency, args.clients, args.requests, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Compares the size and the time taken to parse and to serialise the bodies of the run submissions in
+each of the encodings that the API accepts, against the plain JSON that it only accepted before.
+
+The request is a submission of the given number of runs, listed one by one, with reduction arguments and
+a custom reduction script of the given size. The response is that of a submission of these runs, holding
+the message that was published for each of them. The bodies are parsed and serialised with the parsers,
+decoders and encoders of the views, through the same code as a request would be (see runs.encodings),
+and decoded and encoded as a Python client would, with json, msgpack, gzip and zstandard, so the figures
+leave out the network and the rest of the handling of a request.
+
+Usage:
+    python -m benchmarks.bench_encodings --runs 100 1000 10000 --script-size 4096 --repeat 20
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import time
+from typing import Callable, Optional
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "autoreduce_rest_api.autoreduce_django.settings")
+django.setup()
+
+# pylint:disable=wrong-import-position
+import msgpack  # noqa: E402
+import zstandard  # noqa: E402
+from rest_framework.parsers import JSONParser  # noqa: E402
+
+from autoreduce_rest_api.runs.encodings import JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE  # noqa: E402
+from autoreduce_rest_api.runs.encodings import DecodedStream, MessagePackParser, compress, encode  # noqa: E402
+
+INSTRUMENT_NAME = "BENCHINSTRUMENT"
+MEDIA_TYPES = ((JSON_CONTENT_TYPE, "json"), (MSGPACK_CONTENT_TYPE, "msgpack"))
+ENCODINGS = (None, "gzip", "zstd")
+
+
+def request_data(runs: int, script: str) -> dict:
+    """Returns the body of a submission of the runs."""
+    return {
+        "runs": list(range(1, runs + 1)),
+        "reduction_script": script,
+        "reduction_arguments": {
+            "ei": [12.5, 45.0],
+            "monovan": 0,
+            "mask_file": "mask_221.xml",
+            "sum_runs": False
+        },
+        "user_id": 1234,
+        "description": "Benchmark submission",
+    }
+
+
+def response_data(data: dict) -> dict:
+    """Returns the response to the submission, with the message published for each of its runs."""
+    return {
+        "submitted_runs": [{
+            "run_number": run_number,
+            "instrument": INSTRUMENT_NAME,
+            "rb_number": "1920001",
+            "data": f"/archive/NDX{INSTRUMENT_NAME}/Instrument/data/cycle_22_1/{INSTRUMENT_NAME}{run_number:08d}.nxs",
+            "facility": "ISIS",
+            "started_by": data["user_id"],
+            "run_title": f"Benchmark run {run_number}",
+            "description": data["description"],
+            "reduction_script": data["reduction_script"],
+            "reduction_arguments": data["reduction_arguments"],
+            "software": {
+                "name": "Mantid",
+                "version": "6.4.0"
+            },
+            "flat_output": False,
+        } for run_number in data["runs"]],
+        "failed_runs": [],
+    }
+
+
+def client_encode(data: dict, media_type: str, encoding: Optional[str]) -> bytes:
+    """Encodes the data as a client sending it would."""
+    content = msgpack.packb(data) if media_type == MSGPACK_CONTENT_TYPE else json.dumps(data).encode()
+    if encoding == "gzip":
+        return gzip.compress(content, compresslevel=6)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(content)
+    return content
+
+
+def client_decode(content: bytes, media_type: str, encoding: Optional[str]) -> dict:
+    """Decodes the content as a client receiving it would."""
+    if encoding == "gzip":
+        content = gzip.decompress(content)
+    elif encoding == "zstd":
+        content = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(content), read_across_frames=True).read()
+    return msgpack.unpackb(content) if media_type == MSGPACK_CONTENT_TYPE else json.loads(content)
+
+
+def server_parse(content: bytes, media_type: str, encoding: Optional[str]) -> dict:
+    """Parses the body of a request as the views do."""
+    stream = io.BytesIO(content)
+    if encoding is not None:
+        stream = DecodedStream(stream, [encoding], max_size=2**40)
+    parser = MessagePackParser() if media_type == MSGPACK_CONTENT_TYPE else JSONParser()
+    return parser.parse(stream, media_type)
+
+
+def server_encode(data: dict, media_type: str, encoding: Optional[str]) -> bytes:
+    """Encodes the body of a response as EncodedResponse and ContentEncodingMiddleware do."""
+    content = encode(data, media_type)
+    return content if encoding is None else compress(encoding, content)
+
+
+def best_time(func: Callable, repeat: int) -> float:
+    """Returns the shortest time taken by the function, in milliseconds, over the repeats."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def run_benchmark(run_counts: list, script_size: int, repeat: int):
+    """Prints the size, and the time taken on each side, of each body in each encoding."""
+    script = ("# reduction step\nprint('reducing')\n" * (script_size // 36 + 1))[:script_size]
+    print(f"script size: {script_size} bytes, best of {repeat}")
+    print(f"{'body':>9} {'runs':>7} {'encoding':>16} {'bytes':>10} {'vs json':>8} "
+          f"{'encode (ms)':>12} {'decode (ms)':>12}")
+    for run_count in run_counts:
+        request = request_data(run_count, script)
+        bodies = (
+            ("request", request, client_encode, server_parse),
+            ("response", response_data(request), server_encode, client_decode),
+        )
+        for body, data, encoder, decoder in bodies:
+            json_size = None
+            for media_type, name in MEDIA_TYPES:
+                for encoding in ENCODINGS:
+                    content = encoder(data, media_type, encoding)
+                    assert decoder(content, media_type, encoding) == data
+                    json_size = json_size or len(content)
+                    encode_time = best_time(lambda: encoder(data, media_type, encoding), repeat)
+                    decode_time = best_time(lambda: decoder(content, media_type, encoding), repeat)
+                    label = name if encoding is None else f"{name}+{encoding}"
+                    print(f"{body:>9} {run_count:>7} {label:>16} {len(content):>10} "
+                          f"{len(content) / json_size:>8.2f} {encode_time:>12.2f} {decode_time:>12.2f}")
+
+
+def main():
+    """Parses the command line arguments and runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, nargs="+", default=[100, 1000, 10000], help="Run counts to submit")
+    parser.add_argument("--script-size",
+                        type=int,
+                        default=4096,
+                        help="Size in bytes of the reduction script of the submissions")
+    parser.add_argument("--repeat", type=int, default=20, help="Times each body is encoded and decoded")
+    args = parser.parse_args()
+    run_benchmark(args.runs, args.script_size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
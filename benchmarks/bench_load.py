@@ -0,0 +1,320 @@
+"""
+Load test of the run endpoints: drives them with concurrent clients and reports, for each endpoint and
+number of clients, the requests per second, the p50/p95/p99 latencies, the database queries made by each
+request and the peak resident memory of the process.
+
+The endpoints are served in process by the sync views, each client sending its requests one after the
+other from a thread of its own, as the threads of hurricane would handle them. ICAT and the datafile read
+are replaced by stubs, and Kafka by an in-memory broker, which sleep for the given latencies, each flush
+of the messages to Kafka taking --kafka-latency seconds. The runs are kept in a test database that is
+destroyed at the end, so no external service is needed. The views no longer call the submit_main,
+submit_batch_main and remove_main scripts, so the stubs replace the services those scripts would have
+reached instead.
+
+The results can be written as JSON with --output, and compared with those of a previous run with
+--compare, which exits with 1 if the requests per second fell, or the p95 latency rose, by more than
+--tolerance percent for any endpoint.
+
+The clients' threads share an SQLite database through a file, on which concurrent removals fail as the
+database is locked. They are counted as errors, so run the remove endpoint with several clients against
+a server database such as MySQL (see TESTING_MYSQL_DB in the settings) for representative figures.
+
+Endpoints:
+    submit: POST /api/runs/<instrument>, each request submitting runs that are not in the database
+    batch: POST /api/runs/batch/<instrument>, each request submitting its runs as a batch
+    list: GET /api/runs/<instrument>, the first page of the runs
+    remove: DELETE /api/runs/<instrument>, each request removing runs of its own
+
+Usage:
+    python -m benchmarks.bench_load --endpoints submit list --clients 1 8 32 --requests 20 --output after.json
+    python -m benchmarks.bench_load --clients 1 8 32 --compare before.json --tolerance 10
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, List
+from unittest.mock import Mock, patch
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "autoreduce_rest_api.autoreduce_django.settings")
+os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "testserver")
+os.environ.setdefault("DJANGO_SECRET_KEY", "benchmark")
+# the limits are not what is measured, and would otherwise reject most requests
+os.environ.setdefault("AUTOREDUCE_INSTRUMENT_CONCURRENCY", "1024")
+os.environ.setdefault("AUTOREDUCE_THROTTLE_BACKEND", "none")
+# the endpoints submit the same runs, which would otherwise be looked up once
+os.environ.setdefault("AUTOREDUCE_RUN_CACHE_BACKEND", "none")
+os.environ.setdefault("AUTOREDUCE_KAFKA_BACKEND", "memory")
+django.setup()
+
+# pylint:disable=wrong-import-position
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+from django.test import Client  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from autoreduce_rest_api.runs.publishing import MemoryBroker, kafka_producer  # noqa: E402
+from autoreduce_rest_api.runs.removal import FAILED  # noqa: E402
+from autoreduce_rest_api.runs.test.utils import create_reduction_run  # noqa: E402
+from benchmarks.bench_removal import QueryCounter  # noqa: E402
+
+INSTRUMENT_NAME = "BENCHINSTRUMENT"
+ENDPOINTS = ("submit", "batch", "list", "remove")
+# run numbers of the runs created in the database, above those submitted, which must not be found there
+CREATED_RUNS_START = 10_000_000
+LISTED_RUNS = 200
+
+
+def stub_services(stack: ExitStack, icat_latency: float, kafka_latency: float):
+    """Replaces the external services with stubs for as long as the stack is open."""
+
+    def slow_icat(_instrument, run_number, _file_ext):
+        time.sleep(icat_latency)
+        return f"/tmp/{INSTRUMENT_NAME}{run_number}.nxs", "1234567"
+
+    for target, kwargs in (
+        ("autoreduce_scripts.manual_operations.manual_submission.get_run_data_from_icat", {
+            "side_effect": slow_icat
+        }),
+        ("autoreduce_scripts.manual_operations.manual_submission.read_from_datafile", {
+            "return_value": "Benchmark title"
+        }),
+    ):
+        stack.enter_context(patch(target, **kwargs))
+    kafka_producer.replace(MemoryBroker(flush_latency=kafka_latency))
+    stack.callback(kafka_producer.replace)
+    # the log line of each submitted message would otherwise be most of what the submission does
+    stack.enter_context(patch("autoreduce_scripts.manual_operations.manual_submission.logger", Mock()))
+
+
+class Request:
+    """Builds the requests sent to an endpoint, each with runs of its own."""
+
+    def __init__(self, endpoint: str, runs_per_request: int):
+        self.endpoint = endpoint
+        self.runs_per_request = runs_per_request
+
+    def runs(self, index: int, start: int = 0) -> range:
+        """Returns the runs of the request."""
+        first = start + index * self.runs_per_request
+        return range(first, first + self.runs_per_request)
+
+    def expression(self, index: int, start: int = 0) -> str:
+        """Returns the range expression of the runs of the request."""
+        runs = self.runs(index, start)
+        return f"{runs[0]}-{runs[-1]}"
+
+    def send(self, client: Client, index: int):
+        """Sends the request to the endpoint and returns the response."""
+        url = f"/api/runs/{INSTRUMENT_NAME}"
+        if self.endpoint == "list":
+            return client.get(url)
+        if self.endpoint == "remove":
+            return client.delete(url, {"runs": self.expression(index, CREATED_RUNS_START)},
+                                 content_type="application/json")
+        if self.endpoint == "batch":
+            url = f"/api/runs/batch/{INSTRUMENT_NAME}"
+        return client.post(url, {"runs": self.expression(index)}, content_type="application/json")
+
+    @staticmethod
+    def failed(response) -> bool:
+        """Returns whether the request, or any of its runs, failed."""
+        if response.status_code >= 300:
+            return True
+        if response.streaming or response["Content-Type"] != "application/json":
+            return False
+        content = json.loads(response.content)
+        return bool(content.get("failed_runs")) or any(run["status"] == FAILED for run in content.get("runs", ()))
+
+
+def create_runs(request: Request, count: int):
+    """Creates the runs of the given number of requests in the database, for them to list or remove."""
+    for index in range(count):
+        for run_number in request.runs(index, CREATED_RUNS_START):
+            create_reduction_run(INSTRUMENT_NAME, run_number)
+
+
+@contextmanager
+def counting_queries(counter: QueryCounter):
+    """
+    Counts the queries made through every connection while in the context, including those of the threads
+    that the views start to look the runs up, which a wrapper of the connection of a client's thread misses.
+    """
+
+    def add_counter(connection, **_kwargs):  # pylint:disable=redefined-outer-name
+        if counter not in connection.execute_wrappers:
+            connection.execute_wrappers.append(counter)
+
+    connection_created.connect(add_counter)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(add_counter)
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Returns the percentile of the sorted values, by the nearest rank."""
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def run_clients(send: Callable[[Client, int], object], clients: int, requests: int, authorization: str) -> dict:
+    """
+    Runs the clients concurrently, each in a thread and sending its requests one after the other.
+
+    Returns:
+        The figures of the requests
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(index: int):
+        http_client = Client(HTTP_AUTHORIZATION=authorization)
+        for request in range(requests):
+            start = time.perf_counter()
+            response = send(http_client, index * requests + request)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                if Request.failed(response):
+                    errors.append(response.status_code)
+        connection.close()
+
+    queries = QueryCounter()
+    with counting_queries(queries):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            for future in [executor.submit(client, index) for index in range(clients)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": len(latencies) / elapsed,
+        "latency_ms": {
+            "mean": statistics.mean(latencies) * 1000,
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": latencies[-1] * 1000,
+        },
+        "queries_per_request": queries.count / len(latencies),
+        # the peak of the whole process so far, in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_benchmark(args) -> List[dict]:
+    """Runs each endpoint with each number of clients and prints the figures of each combination."""
+    token = Token.objects.create(user=get_user_model().objects.create_user("benchmark"))
+    authorization = f"Token {token.key}"
+    results = []
+    print(f"{'endpoint':>8} {'clients':>8} {'requests/s':>11} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'queries':>8} {'errors':>7} {'RSS (MB)':>9}")
+    with ExitStack() as stack:
+        stub_services(stack, args.icat_latency, args.kafka_latency)
+        for endpoint in args.endpoints:
+            request = Request(endpoint, args.runs_per_request)
+            if endpoint == "list":
+                # more than a page
+                create_runs(request, LISTED_RUNS)
+            for clients in args.clients:
+                if endpoint == "remove":
+                    create_runs(request, clients * args.requests)
+                result = {
+                    "endpoint": endpoint,
+                    "clients": clients,
+                    **run_clients(request.send, clients, args.requests, authorization)
+                }
+                results.append(result)
+                print(f"{endpoint:>8} {clients:>8} {result['requests_per_second']:>11.1f} "
+                      f"{result['latency_ms']['p50']:>9.1f} {result['latency_ms']['p95']:>9.1f} "
+                      f"{result['latency_ms']['p99']:>9.1f} {result['queries_per_request']:>8.1f} "
+                      f"{result['errors']:>7} {result['peak_rss_mb']:>9.1f}")
+    return results
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> bool:
+    """
+    Prints the change of the requests per second and the p95 latency of each result from the baseline.
+
+    Returns:
+        Whether any of them is worse than the baseline by more than the tolerance, in percent
+    """
+    previous: Dict[tuple, dict] = {(result["endpoint"], result["clients"]): result for result in baseline}
+    regressed = False
+    print(f"{'endpoint':>8} {'clients':>8} {'requests/s':>11} {'p95':>9}")
+    for result in results:
+        before = previous.get((result["endpoint"], result["clients"]))
+        if before is None:
+            continue
+        throughput = 100 * (result["requests_per_second"] / before["requests_per_second"] - 1)
+        latency = 100 * (result["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1)
+        worse = throughput < -tolerance or latency > tolerance
+        regressed = regressed or worse
+        print(f"{result['endpoint']:>8} {result['clients']:>8} {throughput:>+10.1f}% {latency:>+8.1f}%"
+              f"{'  regression' if worse else ''}")
+    return regressed
+
+
+def main():
+    """Parses the command line arguments and runs the benchmark in a test database."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS), help="Endpoints")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="Concurrent client counts")
+    parser.add_argument("--requests", type=int, default=20, help="Requests sent by each client")
+    parser.add_argument("--runs-per-request", type=int, default=1, help="Runs submitted or removed by each request")
+    parser.add_argument("--icat-latency", type=float, default=0.02, help="Seconds each ICAT lookup takes")
+    parser.add_argument("--kafka-latency", type=float, default=0.002, help="Seconds each flush to Kafka takes")
+    parser.add_argument("--output", help="File to write the results to, as JSON")
+    parser.add_argument("--compare", help="JSON file of the results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=10, help="Percent by which a result can be worse")
+    args = parser.parse_args()
+    # the runs that fail are counted as errors
+    logging.disable(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == "sqlite":
+            # the clients' threads cannot share an in-memory database
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "bench_load.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            results = run_benchmark(args)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(
+                {
+                    "arguments": vars(args),
+                    "python": sys.version,
+                    "platform": platform.platform(),
+                    "database": connection.vendor,
+                    "results": results
+                },
+                output,
+                indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            if compare(results, json.load(baseline)["results"], args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
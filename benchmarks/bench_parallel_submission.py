@@ -0,0 +1,72 @@
+"""
+Measures the wall time of submitting run ranges of increasing size against the number of lookup threads.
+
+ICAT and the datafile read are replaced by stubs, the ICAT stub sleeping for the given latency to stand
+in for the round trip to the service, and Kafka by an in-memory broker, so no external service is needed.
+
+Usage:
+    python -m benchmarks.bench_parallel_submission --latency 0.05 --runs 10 50 100 --workers 1 4 16
+"""
+import argparse
+import logging
+import os
+import time
+from unittest.mock import patch
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "autoreduce_rest_api.autoreduce_django.settings")
+# the instrument cap would otherwise hide the effect of the larger worker counts
+os.environ.setdefault("AUTOREDUCE_INSTRUMENT_CONCURRENCY", "1024")
+# the messages are kept in the process rather than published to Kafka
+os.environ.setdefault("AUTOREDUCE_KAFKA_BACKEND", "memory")
+django.setup()
+
+# pylint:disable=wrong-import-position
+from autoreduce_rest_api.runs.cache import run_metadata_cache  # noqa: E402
+from autoreduce_rest_api.runs.submission import iter_submissions  # noqa: E402
+
+INSTRUMENT_NAME = "BENCHINSTRUMENT"
+SOFTWARE = {"name": "Mantid", "version": "latest"}
+
+
+def run_benchmark(latency: float, run_counts: list, worker_counts: list):
+    """Submits each run count with each worker count and prints the wall time of each combination."""
+
+    def slow_icat(_instrument, run_number, _file_ext):
+        time.sleep(latency)
+        return f"/tmp/{INSTRUMENT_NAME}{run_number}.nxs", "1234567"
+
+    with patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data_from_database",
+               return_value=(None, None, None)), \
+            patch("autoreduce_scripts.manual_operations.manual_submission.get_run_data_from_icat",
+                  side_effect=slow_icat), \
+            patch("autoreduce_scripts.manual_operations.manual_submission.read_from_datafile",
+                  return_value="Benchmark title"):
+        print(f"ICAT latency: {latency * 1000:.0f} ms")
+        print(f"{'runs':>8} {'workers':>8} {'wall time (s)':>14} {'runs/s':>10}")
+        for run_count in run_counts:
+            for workers in worker_counts:
+                # every combination must go to the ICAT stub rather than reuse the previous lookups
+                run_metadata_cache.clear()
+                start = time.perf_counter()
+                results = list(
+                    iter_submissions(INSTRUMENT_NAME, range(run_count), software=SOFTWARE, max_workers=workers))
+                elapsed = time.perf_counter() - start
+                assert len(results) == run_count
+                print(f"{run_count:>8} {workers:>8} {elapsed:>14.3f} {run_count / elapsed:>10.1f}")
+
+
+def main():
+    """Parses the command line arguments and runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each ICAT lookup takes")
+    parser.add_argument("--runs", type=int, nargs="+", default=[10, 50, 100, 200], help="Run counts to submit")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16], help="Lookup thread counts")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    run_benchmark(args.latency, args.runs, args.workers)
+
+
+if __name__ == "__main__":
+    main()
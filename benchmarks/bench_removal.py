@@ -0,0 +1,92 @@
+"""
+Compares the wall time and the number of queries of removing runs with manual_remove.main, as the
+DELETE views used to, and with the bulk removal that they now use.
+
+The runs are created in a test database, which is destroyed at the end, with the given number of
+versions each. The database is that of the settings, so run it against the production engine for
+representative figures.
+
+Usage:
+    python -m benchmarks.bench_removal --runs 100 1000 2000 --versions 2 --chunk-size 500
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "autoreduce_rest_api.autoreduce_django.settings")
+django.setup()
+
+# pylint:disable=wrong-import-position
+from django.db import connection  # noqa: E402
+
+from autoreduce_db.reduction_viewer.models import ReductionRun  # noqa: E402
+from autoreduce_scripts.manual_operations.manual_remove import main as remove_main  # noqa: E402
+
+from autoreduce_rest_api.runs.removal import remove_runs_in_bulk  # noqa: E402
+from autoreduce_rest_api.runs.test.utils import create_reduction_run  # noqa: E402
+
+INSTRUMENT_NAME = "BENCHINSTRUMENT"
+
+
+class QueryCounter:
+    """Counts the queries made through the connection, which unlike its query log is not capped."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def remove_one_by_one(runs: list, _chunk_size: int):
+    """Removes the runs as the DELETE views used to."""
+    # manual_remove prints a line for each run version
+    with contextlib.redirect_stdout(io.StringIO()):
+        remove_main(INSTRUMENT_NAME, runs, delete_all_versions=True, no_input=True)
+
+
+def remove_in_bulk(runs: list, chunk_size: int):
+    """Removes the runs as the DELETE views do now."""
+    remove_runs_in_bulk(INSTRUMENT_NAME, runs, chunk_size=chunk_size)
+
+
+def run_benchmark(run_counts: list, versions: int, chunk_size: int):
+    """Creates and removes each run count with each removal and prints the wall time and queries of each."""
+    print(f"versions per run: {versions}, chunk size: {chunk_size}")
+    print(f"{'removal':>12} {'runs':>8} {'queries':>9} {'wall time (s)':>14} {'runs/s':>10}")
+    for run_count in run_counts:
+        runs = list(range(run_count))
+        for name, remove in (("one by one", remove_one_by_one), ("bulk", remove_in_bulk)):
+            for run_number in runs:
+                for run_version in range(versions):
+                    create_reduction_run(INSTRUMENT_NAME, run_number, run_version=run_version)
+            queries = QueryCounter()
+            with connection.execute_wrapper(queries):
+                start = time.perf_counter()
+                remove(runs, chunk_size)
+                elapsed = time.perf_counter() - start
+            assert not ReductionRun.objects.exists()
+            print(f"{name:>12} {run_count:>8} {queries.count:>9} {elapsed:>14.3f} {run_count / elapsed:>10.1f}")
+
+
+def main():
+    """Parses the command line arguments and runs the benchmark in a test database."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, nargs="+", default=[100, 1000, 2000], help="Run counts to remove")
+    parser.add_argument("--versions", type=int, default=2, help="Versions of each run")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Chunk size of the bulk removal")
+    args = parser.parse_args()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        run_benchmark(args.runs, args.versions, args.chunk_size)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()